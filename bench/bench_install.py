@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+#######################################################################################
+#                                                                                     #
+#   This file is part of the updater4pyi Project.                                     #
+#                                                                                     #
+#   Copyright (C) 2013, Philippe Faist                                                #
+#   philippe.faist@bluewin.ch                                                         #
+#   All rights reserved.                                                              #
+#                                                                                     #
+#   Redistribution and use in source and binary forms, with or without                #
+#   modification, are permitted provided that the following conditions are met:       #
+#                                                                                     #
+#   1. Redistributions of source code must retain the above copyright notice, this    #
+#      list of conditions and the following disclaimer.                               #
+#   2. Redistributions in binary form must reproduce the above copyright notice,      #
+#      this list of conditions and the following disclaimer in the documentation      #
+#      and/or other materials provided with the distribution.                         #
+#                                                                                     #
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND   #
+#   ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED     #
+#   WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE            #
+#   DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR   #
+#   ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES    #
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;      #
+#   LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND       #
+#   ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT        #
+#   (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS     #
+#   SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                      #
+#                                                                                     #
+#######################################################################################
+
+
+
+
+"""
+Benchmark of the installation of an update into a onedir installation, with
+:py:class:`upd_source.UpdateLocalDirectorySource` so that no network is involved: the
+archive extraction, the permissions of the extracted files, the `_updater4pyi_metainf.json`
+permission globs, the rename of the old installation to a backup and the removal of
+that backup.
+
+For each scenario (shape of the release archive), reports the time of
+:py:meth:`upd_core.Updater.install_update` and the time spent in each of its phases (see
+:py:mod:`upd_timing`). With ``--mode=full``, the archive is downloaded completely before
+it is extracted (as with updater subclasses which reimplement
+:py:meth:`~upd_core.Updater.download_file`), instead of being extracted while it is read.
+
+Run ``python bench/bench_install.py --help`` for the options.
+"""
+
+import sys
+import os
+import os.path
+import shutil
+import tempfile
+import argparse
+import logging
+
+import benchutil
+
+from updater4pyi import upd_core, upd_source, upd_log
+
+
+PERMISSIONS = {
+    '*.so': '0755',
+    'dir*/*.txt': '0644',
+    '*/*/*.dat': '0600',
+    }
+"""
+The permission globs written to the `_updater4pyi_metainf.json` file of each release.
+"""
+
+SCENARIOS = [
+    # (name, nfiles, file_size, large_files, large_file_size, depth, format)
+    ('tiny', 10, 4096, 0, 0, 1, 'zip'),
+    ('small', 200, 8*1024, 1, 4*1024*1024, 2, 'zip'),
+    ('medium', 2000, 8*1024, 2, 16*1024*1024, 3, 'zip'),
+    ('medium-tgz', 2000, 8*1024, 2, 16*1024*1024, 3, 'tgz'),
+    ('large-members', 20, 4096, 8, 32*1024*1024, 1, 'zip'),
+    ('deep', 5000, 2048, 0, 0, 8, 'zip'),
+    ('huge', 50000, 1024, 0, 0, 4, 'zip'),
+    ]
+
+PHASES = ['download', 'verify', 'backup_rename', 'extract', 'chmod', 'permissions',
+          'cleanup', 'remove_backup']
+"""
+The phases to report, in order. Other phases which show up are appended.
+"""
+
+
+class FullDownloadUpdater(upd_core.Updater):
+    """
+    An updater which always downloads the full archive before extracting it.
+    """
+    def _can_extract_while_downloading(self):
+        return False
+
+
+def run_scenario(scenario, workdir, args):
+    (name, nfiles, file_size, large_files, large_file_size, depth, fmt) = scenario
+
+    releasedir = os.path.join(workdir, 'releases', '2.0')
+    os.makedirs(releasedir)
+    builddir = os.path.join(workdir, 'build')
+    os.makedirs(builddir)
+    datasize = benchutil.make_onedir_tree(builddir, nfiles, file_size, large_files, large_file_size,
+                                          depth=depth)
+    benchutil.write_metainf(builddir, PERMISSIONS)
+    relfn = os.path.join(releasedir, benchutil.release_filename('2.0', fmt))
+    benchutil.make_archive(builddir, relfn, fmt)
+    shutil.rmtree(builddir)
+    archivesize = os.path.getsize(relfn)
+
+    updater_class = (FullDownloadUpdater if args.mode == 'full' else upd_core.Updater)
+
+    # the installed version has as many files, so that the backup is as large to remove
+    app = benchutil.FakeFrozenApp(os.path.join(workdir, 'inst'), nfiles=nfiles)
+    install = benchutil.Stopwatch()
+    reports = []
+    for rep in range(args.repeat):
+        app.install()
+        with app.frozen():
+            source = upd_source.UpdateLocalDirectorySource(os.path.join(workdir, 'releases'))
+            updater = updater_class('1.0', source, cache_dir=os.path.join(workdir, 'cache-%d' %(rep)))
+            rel_info = updater.check_for_updates()
+            if rel_info is None:
+                raise RuntimeError("Update check didn't find the update")
+            with install.measure():
+                updater.install_update(rel_info)
+            reports.append(updater.last_timing_report())
+
+        if app.installed_version() != 'v2':
+            raise RuntimeError("Update wasn't installed correctly")
+
+    return {
+        'name': name,
+        'format': fmt,
+        'files': nfiles + large_files + 1,
+        'datasize': datasize,
+        'archivesize': archivesize,
+        'install': install,
+        # phases of the median run
+        'report': sorted(zip(install.times, reports))[len(reports)//2][1],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the installation of an update into "
+                                     "a onedir installation, from a local directory.")
+    parser.add_argument('--scenario', action='append', choices=[ s[0] for s in SCENARIOS ],
+                        help="Run this scenario (may be repeated; default: all)")
+    parser.add_argument('--mode', choices=['stream', 'full'], default='stream',
+                        help="Extract the archive while it is read (stream), or download it "
+                        "completely first (full)")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of runs of each scenario")
+    parser.add_argument('--workdir', default=None,
+                        help="Directory for the temporary files (kept if given)")
+    parser.add_argument('--debug', action='store_true', help="Show updater4pyi's debug messages")
+    args = parser.parse_args()
+
+    upd_log.setup_logger(logging.DEBUG if args.debug else logging.ERROR)
+
+    scenarios = [ s for s in SCENARIOS if not args.scenario or s[0] in args.scenario ]
+
+    results = []
+    for scenario in scenarios:
+        workdir = (os.path.join(args.workdir, scenario[0]) if args.workdir
+                   else tempfile.mkdtemp(prefix='upd4pyi_bench_'))
+        if os.path.exists(workdir) and args.workdir:
+            shutil.rmtree(workdir)
+        if not os.path.exists(workdir):
+            os.makedirs(workdir)
+        sys.stderr.write("running scenario %s ...\n" %(scenario[0]))
+        try:
+            results.append(run_scenario(scenario, workdir, args))
+        finally:
+            if not args.workdir:
+                shutil.rmtree(workdir, True)
+
+    print ""
+    print "Installation (%s mode, median of %d runs)" %(args.mode, args.repeat)
+    print ""
+    benchutil.print_table(
+        ['scenario', 'format', 'files', 'data', 'archive', 'install', 'files/s'],
+        [ (r['name'], r['format'], r['files'], benchutil.format_size(r['datasize']),
+           benchutil.format_size(r['archivesize']), '%.3f s' %(r['install'].median()),
+           '%.0f' %(r['files'] / max(r['install'].median(), 1e-9)))
+          for r in results ])
+
+    print ""
+    print "Installation stages (seconds)"
+    print ""
+    phases = [ p for p in PHASES if any([ p in r['report'].phases for r in results ]) ]
+    for r in results:
+        for p in r['report'].phases:
+            if p not in phases:
+                phases.append(p)
+    benchutil.print_table(
+        ['scenario'] + phases,
+        [ [r['name']] + [ '%.3f' %(r['report'].seconds(p)) for p in phases ]
+          for r in results ])
+
+
+if __name__ == '__main__':
+    main()
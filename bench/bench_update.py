@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+#######################################################################################
+#                                                                                     #
+#   This file is part of the updater4pyi Project.                                     #
+#                                                                                     #
+#   Copyright (C) 2013, Philippe Faist                                                #
+#   philippe.faist@bluewin.ch                                                         #
+#   All rights reserved.                                                              #
+#                                                                                     #
+#   Redistribution and use in source and binary forms, with or without                #
+#   modification, are permitted provided that the following conditions are met:       #
+#                                                                                     #
+#   1. Redistributions of source code must retain the above copyright notice, this    #
+#      list of conditions and the following disclaimer.                               #
+#   2. Redistributions in binary form must reproduce the above copyright notice,      #
+#      this list of conditions and the following disclaimer in the documentation      #
+#      and/or other materials provided with the distribution.                         #
+#                                                                                     #
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND   #
+#   ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED     #
+#   WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE            #
+#   DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR   #
+#   ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES    #
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;      #
+#   LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND       #
+#   ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT        #
+#   (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS     #
+#   SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                      #
+#                                                                                     #
+#######################################################################################
+
+
+
+"""
+End-to-end benchmark of the update path: an update check with
+:py:class:`upd_source.UpdateGithubReleasesSource` against a local stand-in for github,
+then the download and installation of the update into a fake frozen onedir
+installation with :py:class:`upd_core.Updater`. Nothing goes over the network.
+
+For each scenario (release archive shape), reports the latency of a fresh update check and
+of a repeated (conditional) check, the time and throughput of the installation, and the
+time spent in each phase of the installation (see :py:mod:`upd_timing`).
+
+Run ``python bench/bench_update.py --help`` for the options.
+"""
+
+import sys
+import os
+import os.path
+import shutil
+import tempfile
+import argparse
+import logging
+
+import benchutil
+
+from updater4pyi import upd_core, upd_source, upd_downloader, upd_log
+
+
+SCENARIOS = [
+    # (name, nfiles, file_size, large_files, large_file_size, format)
+    ('small-zip', 50, 4096, 1, 1024*1024, 'zip'),
+    ('medium-zip', 1000, 16*1024, 2, 8*1024*1024, 'zip'),
+    ('medium-stored-zip', 1000, 16*1024, 2, 8*1024*1024, 'zip-stored'),
+    ('medium-tgz', 1000, 16*1024, 2, 8*1024*1024, 'tgz'),
+    ('large-zip', 200, 64*1024, 4, 32*1024*1024, 'zip'),
+    ('many-files-zip', 10000, 2048, 0, 0, 'zip'),
+    ]
+
+
+def run_scenario(scenario, workdir, args):
+    (name, nfiles, file_size, large_files, large_file_size, fmt) = scenario
+
+    assetdir = os.path.join(workdir, 'assets')
+    os.makedirs(assetdir)
+    builddir = os.path.join(workdir, 'build')
+    os.makedirs(builddir)
+    datasize = benchutil.make_onedir_tree(builddir, nfiles, file_size, large_files, large_file_size)
+    relfn = benchutil.release_filename('2.0', fmt)
+    benchutil.make_archive(builddir, os.path.join(assetdir, relfn), fmt)
+    shutil.rmtree(builddir)
+    archivesize = os.path.getsize(os.path.join(assetdir, relfn))
+
+    server = benchutil.FakeGithubServer(assetdir, https=args.https, latency=args.latency, rate=args.rate)
+    for i in range(args.old_releases):
+        server.add_release('1.0.%d' %(i), [benchutil.release_filename('1.0.%d' %(i), fmt)])
+    server.add_release('2.0', [relfn])
+    server.start()
+    # servers which only serve the release files, like mirrors of the github downloads
+    mirrors = [ benchutil.FakeGithubServer(assetdir, https=args.https, latency=args.latency,
+                                           rate=args.rate).start()
+                for i in range(args.mirrors) ]
+
+    old_cert_file = upd_downloader.CERT_FILE
+    if server.cafile:
+        upd_downloader.CERT_FILE = os.path.join(workdir, 'cacerts.pem')
+        with open(upd_downloader.CERT_FILE, 'w') as f:
+            for srv in [server] + mirrors:
+                with open(srv.cafile) as fca:
+                    f.write(fca.read())
+
+    app = benchutil.FakeFrozenApp(os.path.join(workdir, 'inst'))
+    check_cold = benchutil.Stopwatch()
+    check_cond = benchutil.Stopwatch()
+    install = benchutil.Stopwatch()
+    reports = []
+    try:
+        for rep in range(args.repeat):
+            app.install()
+            listing_cache = os.path.join(workdir, 'listing-cache-%d' %(rep))
+            with app.frozen():
+                source = upd_source.UpdateGithubReleasesSource(
+                    server.user_repo, cache_dir=listing_cache,
+                    api_base_url=server.base_url, download_base_url=server.base_url,
+                    mirror_base_urls=[ srv.base_url for srv in mirrors ])
+                updater = upd_core.Updater('1.0', source, cache_dir=os.path.join(workdir, 'cache-%d' %(rep)))
+
+                # fresh connections for the first check
+                upd_downloader.connection_pool.clear()
+                with check_cold.measure():
+                    rel_info = updater.check_for_updates()
+                if rel_info is None:
+                    raise RuntimeError("Update check didn't find the update")
+                # the second check uses the cached listing (ETag)
+                with check_cond.measure():
+                    updater.check_for_updates()
+
+                with install.measure():
+                    updater.install_update(rel_info)
+                reports.append(updater.last_timing_report())
+
+            if app.installed_version() != 'v2':
+                raise RuntimeError("Update wasn't installed correctly")
+    finally:
+        upd_downloader.CERT_FILE = old_cert_file
+        # close our idle keep-alive connections, so that the server threads finish
+        upd_downloader.connection_pool.clear()
+        server.stop()
+        for srv in mirrors:
+            srv.stop()
+
+    return {
+        'name': name,
+        'files': nfiles + large_files + 1,
+        'datasize': datasize,
+        'archivesize': archivesize,
+        'check_cold': check_cold,
+        'check_cond': check_cond,
+        'install': install,
+        # phases of the median run
+        'report': sorted(zip(install.times, reports))[len(reports)//2][1],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the update path, against a "
+                                     "local stand-in for github.")
+    parser.add_argument('--scenario', action='append', choices=[ s[0] for s in SCENARIOS ],
+                        help="Run this scenario (may be repeated; default: all)")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of runs of each scenario")
+    parser.add_argument('--https', action='store_true',
+                        help="Serve over HTTPS with a self-signed certificate (needs openssl)")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="Delay of each request in seconds, to simulate a remote server")
+    parser.add_argument('--rate', type=float, default=None,
+                        help="Limit the download rate (bytes per second)")
+    parser.add_argument('--mirrors', type=int, default=0,
+                        help="Number of additional servers which mirror the release files")
+    parser.add_argument('--old-releases', type=int, default=20,
+                        help="Number of older releases in the releases listing")
+    parser.add_argument('--workdir', default=None,
+                        help="Directory for the temporary files (kept if given)")
+    parser.add_argument('--debug', action='store_true', help="Show updater4pyi's debug messages")
+    args = parser.parse_args()
+
+    upd_log.setup_logger(logging.DEBUG if args.debug else logging.ERROR)
+
+    scenarios = [ s for s in SCENARIOS if not args.scenario or s[0] in args.scenario ]
+
+    results = []
+    for scenario in scenarios:
+        workdir = (os.path.join(args.workdir, scenario[0]) if args.workdir
+                   else tempfile.mkdtemp(prefix='upd4pyi_bench_'))
+        if os.path.exists(workdir) and args.workdir:
+            shutil.rmtree(workdir)
+        if not os.path.exists(workdir):
+            os.makedirs(workdir)
+        sys.stderr.write("running scenario %s ...\n" %(scenario[0]))
+        try:
+            results.append(run_scenario(scenario, workdir, args))
+        finally:
+            if not args.workdir:
+                shutil.rmtree(workdir, True)
+
+    print ""
+    print "Update path (%s, latency %g s, rate %s, %d mirrors, median of %d runs)" %(
+        ('https' if args.https else 'http'), args.latency,
+        (benchutil.format_size(args.rate)+'/s' if args.rate else 'unlimited'), args.mirrors, args.repeat)
+    print ""
+    benchutil.print_table(
+        ['scenario', 'files', 'data', 'archive', 'check', 'check (304)', 'install', 'throughput'],
+        [ (r['name'], r['files'], benchutil.format_size(r['datasize']),
+           benchutil.format_size(r['archivesize']),
+           '%.1f ms' %(r['check_cold'].median()*1000), '%.1f ms' %(r['check_cond'].median()*1000),
+           '%.3f s' %(r['install'].median()),
+           benchutil.format_rate(r['archivesize'], r['install'].median()))
+          for r in results ])
+
+    print ""
+    print "Installation phases (seconds)"
+    print ""
+    phases = []
+    for r in results:
+        for p in r['report'].phases:
+            if p not in phases:
+                phases.append(p)
+    benchutil.print_table(
+        ['scenario'] + phases,
+        [ [r['name']] + [ '%.3f' %(r['report'].seconds(p)) for p in phases ]
+          for r in results ])
+
+
+if __name__ == '__main__':
+    main()
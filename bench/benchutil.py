@@ -0,0 +1,486 @@
+# -*- coding: utf-8 -*-
+#######################################################################################
+#                                                                                     #
+#   This file is part of the updater4pyi Project.                                     #
+#                                                                                     #
+#   Copyright (C) 2013, Philippe Faist                                                #
+#   philippe.faist@bluewin.ch                                                         #
+#   All rights reserved.                                                              #
+#                                                                                     #
+#   Redistribution and use in source and binary forms, with or without                #
+#   modification, are permitted provided that the following conditions are met:       #
+#                                                                                     #
+#   1. Redistributions of source code must retain the above copyright notice, this    #
+#      list of conditions and the following disclaimer.                               #
+#   2. Redistributions in binary form must reproduce the above copyright notice,      #
+#      this list of conditions and the following disclaimer in the documentation      #
+#      and/or other materials provided with the distribution.                         #
+#                                                                                     #
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND   #
+#   ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED     #
+#   WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE            #
+#   DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR   #
+#   ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES    #
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;      #
+#   LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND       #
+#   ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT        #
+#   (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS     #
+#   SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                      #
+#                                                                                     #
+#######################################################################################
+
+
+"""
+Utilities shared by the benchmarks: synthetic onedir trees and release archives, a fake
+frozen (pyinstaller-like) installation, a local HTTP(S) server which stands in for
+github, and result tables.
+
+The benchmarks import the `updater4pyi` package from the source tree this directory is in.
+"""
+
+import sys
+import os
+import os.path
+import re
+import time
+import json
+import errno
+import random
+import socket
+import hashlib
+import shutil
+import zipfile
+import tarfile
+import tempfile
+import subprocess
+import threading
+import contextlib
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from updater4pyi import util
+
+
+APP_NAME = 'myapp'
+"""
+The name of the fake application, i.e. of its installation directory and its executable.
+"""
+
+
+# -----------------------------------------------------------------------------
+# synthetic release contents
+
+
+def make_onedir_tree(destdir, nfiles, file_size, large_files=0, large_file_size=0, depth=3,
+                     executable_data='#!/bin/sh\necho v2\n', seed=0):
+    """
+    Create a onedir-style tree in `destdir`/:py:data:`APP_NAME`: the executable, and
+    `nfiles` files of about `file_size` bytes (plus `large_files` files of
+    `large_file_size` bytes), spread over nested directories up to `depth` levels deep.
+
+    The file contents are random, but each block of 1 kB is repeated once, so that the
+    data compresses to about half its size, like typical binaries. Returns the total size of the files.
+    """
+    rnd = random.Random(seed)
+    appdir = os.path.join(destdir, APP_NAME)
+    os.makedirs(appdir)
+    with open(os.path.join(appdir, APP_NAME), 'wb') as f:
+        f.write(executable_data)
+    total = len(executable_data)
+
+    # a pool of random data to cut file contents from
+    pool = os.urandom(max(file_size, large_file_size, 1) + 65536)
+
+    dirs = ['']
+    for i in range(max(1, nfiles // 50)):
+        parent = rnd.choice(dirs)
+        if parent.count('/') < depth:
+            dirs.append((parent + '/' if parent else '') + 'dir%d' %(i))
+
+    def write(relname, size):
+        fn = os.path.join(appdir, relname)
+        if not os.path.isdir(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+        half = (size + 1) // 2
+        start = rnd.randint(0, len(pool) - half - 1)
+        src = pool[start:start+half]
+        with open(fn, 'wb') as f:
+            f.write(''.join([ src[i:i+1024]*2 for i in xrange(0, half, 1024) ])[:size])
+
+    for i in range(nfiles):
+        d = rnd.choice(dirs)
+        ext = rnd.choice(('.so', '.pyd', '.pyc', '.dat', '.txt'))
+        write((d + '/' if d else '') + 'file%d%s' %(i, ext), file_size)
+        total += file_size
+    for i in range(large_files):
+        write('large%d.bin' %(i), large_file_size)
+        total += large_file_size
+    return total
+
+
+def write_metainf(destdir, permissions):
+    """
+    Write a `_updater4pyi_metainf.json` file with the given `permissions` (a dictionary of
+    glob pattern -> octal permission string) in `destdir`.
+    """
+    with open(os.path.join(destdir, '_updater4pyi_metainf.json'), 'w') as f:
+        json.dump({'permissions': permissions}, f)
+
+
+def make_archive(srcdir, archivefn, fmt='zip'):
+    """
+    Archive the contents of `srcdir` into `archivefn`. `fmt` is one of ``'zip'``,
+    ``'zip-stored'``, ``'tgz'`` or ``'tbz'``.
+    """
+    names = []
+    for (dirpath, dirnames, filenames) in os.walk(srcdir):
+        dirnames.sort()
+        for fn in sorted(filenames):
+            full = os.path.join(dirpath, fn)
+            names.append((full, os.path.relpath(full, srcdir)))
+
+    if fmt in ('zip', 'zip-stored'):
+        compression = (zipfile.ZIP_DEFLATED if fmt == 'zip' else zipfile.ZIP_STORED)
+        with zipfile.ZipFile(archivefn, 'w', compression, allowZip64=True) as z:
+            for (full, arcname) in names:
+                z.write(full, arcname)
+    elif fmt in ('tgz', 'tbz'):
+        with contextlib.closing(tarfile.open(archivefn, 'w:gz' if fmt == 'tgz' else 'w:bz2')) as t:
+            for (full, arcname) in names:
+                t.add(full, arcname)
+    else:
+        raise ValueError("Unknown archive format: %s" %(fmt))
+
+
+ARCHIVE_EXTENSIONS = {'zip': 'zip', 'zip-stored': 'zip', 'tgz': 'tar.gz', 'tbz': 'tar.bz2'}
+
+
+def release_filename(version, fmt='zip'):
+    """
+    The name of the release archive, as recognized by the default naming strategy.
+    """
+    return '%s-%s-%s.%s' %(APP_NAME, version, util.simple_platform(), ARCHIVE_EXTENSIONS[fmt])
+
+
+def file_digest(fn, algo='sha256'):
+    h = hashlib.new(algo)
+    with open(fn, 'rb') as f:
+        for buf in iter(lambda : f.read(65536), ''):
+            h.update(buf)
+    return algo + ':' + h.hexdigest()
+
+
+# -----------------------------------------------------------------------------
+# fake frozen installation
+
+
+class FakeFrozenApp(object):
+    """
+    A fake onedir installation of :py:data:`APP_NAME` (version 1) in
+    `root`/:py:data:`APP_NAME`. Use :py:meth:`frozen` to make `updater4pyi` believe that
+    it is running from it.
+    """
+    def __init__(self, root, nfiles=10):
+        self.root = root
+        self.appdir = os.path.join(root, APP_NAME)
+        self.executable = os.path.join(self.appdir, APP_NAME)
+        self.nfiles = nfiles
+
+    def install(self):
+        """
+        (Re)install version 1 of the application.
+        """
+        if os.path.exists(self.root):
+            shutil.rmtree(self.root)
+        os.makedirs(self.root)
+        make_onedir_tree(self.root, self.nfiles, 1024, executable_data='#!/bin/sh\necho v1\n', seed=1)
+
+    def installed_version(self):
+        with open(self.executable, 'rb') as f:
+            return f.read().strip().split()[-1]
+
+    @contextlib.contextmanager
+    def frozen(self):
+        """
+        Context manager which sets `sys._MEIPASS` and `sys.executable` as if we were the
+        application.
+        """
+        had_meipass = hasattr(sys, '_MEIPASS')
+        (old_meipass, old_executable) = (getattr(sys, '_MEIPASS', None), sys.executable)
+        sys._MEIPASS = self.appdir
+        sys.executable = self.executable
+        try:
+            yield self
+        finally:
+            sys.executable = old_executable
+            if had_meipass:
+                sys._MEIPASS = old_meipass
+            else:
+                del sys._MEIPASS
+
+
+# -----------------------------------------------------------------------------
+# local stand-in for github
+
+
+class FakeGithubServer(object):
+    """
+    A local HTTP (or HTTPS) server which serves releases of a fake github repository
+    `owner/repo` the way github does: the releases listing at
+    ``/repos/<owner>/<repo>/releases`` (paginated, with ETags), and the release files at
+    ``/<owner>/<repo>/releases/download/<tag>/<filename>`` (with range requests).
+
+    Each request is delayed by `latency` seconds, and release files are sent at no more
+    than `rate` bytes per second (if not `None`).
+    """
+    def __init__(self, assetdir, user_repo='bench/myapp', https=False, latency=0.0, rate=None):
+        self.assetdir = assetdir
+        self.user_repo = user_repo
+        self.latency = latency
+        self.rate = rate
+        self.releases = []
+        self.requests = 0
+        self.certfile = None
+        self.cafile = None
+
+        server = self
+
+        class Handler(_FakeGithubHandler):
+            pass
+        Handler.server_obj = server
+
+        self.httpd = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.scheme = 'http'
+        if https:
+            import ssl
+            (self.certfile, self.cafile) = make_self_signed_cert(tempfile.mkdtemp(prefix='upd4pyi_bench_cert_'))
+            self.httpd.socket = ssl.wrap_socket(self.httpd.socket, certfile=self.certfile,
+                                                server_side=True)
+            self.scheme = 'https'
+        self.base_url = '%s://127.0.0.1:%d' %(self.scheme, self.httpd.server_address[1])
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+
+    def add_release(self, version, filenames):
+        """
+        Publish a release `version` (tag ``v<version>``) with the given files of the asset
+        directory. The newest release should be added last. Files which don't exist are
+        listed nevertheless (e.g. for old releases which only fill the listing).
+        """
+        tag = 'v' + version
+        assets = []
+        for fn in filenames:
+            full = os.path.join(self.assetdir, fn)
+            exists = os.path.isfile(full)
+            assets.append({
+                'name': fn,
+                'label': None,
+                'content_type': 'application/octet-stream',
+                'size': (os.path.getsize(full) if exists else 0),
+                'digest': (file_digest(full) if exists else None),
+                'browser_download_url': '%s/%s/releases/download/%s/%s' %(self.base_url, self.user_repo,
+                                                                          tag, fn),
+                })
+        self.releases.insert(0, {
+            'html_url': '%s/%s/releases/tag/%s' %(self.base_url, self.user_repo, tag),
+            'tag_name': tag,
+            'name': '%s %s' %(APP_NAME, version),
+            'body': 'Release %s of %s.' %(version, APP_NAME),
+            'published_at': '2014-01-01T00:00:00Z',
+            'assets': assets,
+            })
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.certfile is not None:
+            shutil.rmtree(os.path.dirname(self.certfile), True)
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients may well hang up in the middle of a response (e.g. when the updater
+        # switches to a faster mirror); don't clutter the benchmark output with that.
+        e = sys.exc_info()[1]
+        if isinstance(e, socket.error):
+            import ssl
+            if isinstance(e, ssl.SSLError):
+                if e.errno == ssl.SSL_ERROR_EOF or 'EOF' in str(e):
+                    return
+            elif e.errno in (errno.EPIPE, errno.ECONNRESET, errno.ECONNABORTED):
+                return
+        BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+
+class _FakeGithubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    server_obj = None
+
+    # send the status line and headers in one packet, without waiting for delayed ACKs
+    # (which would make the benchmark measure the test server rather than updater4pyi).
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        srv = self.server_obj
+        srv.requests += 1
+        if srv.latency:
+            time.sleep(srv.latency)
+        url = urlparse.urlparse(self.path)
+        prefix = '/' + srv.user_repo
+        if url.path == '/repos' + prefix + '/releases':
+            self._send_listing(dict(urlparse.parse_qsl(url.query)))
+        elif url.path.startswith(prefix + '/releases/download/'):
+            self._send_file(os.path.basename(url.path))
+        else:
+            self._send(404, '{"message": "Not Found"}', 'application/json')
+
+    def _send(self, code, body, content_type, headers=()):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for (k, v) in headers:
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_listing(self, query):
+        srv = self.server_obj
+        per_page = int(query.get('per_page', 30))
+        page = int(query.get('page', 1))
+        releases = srv.releases[(page-1)*per_page:page*per_page]
+        body = json.dumps(releases)
+        etag = '"%s"' %(hashlib.sha1(body).hexdigest())
+        headers = [('ETag', etag)]
+        if page*per_page < len(srv.releases):
+            headers.append(('Link', '<%s/repos/%s/releases?per_page=%d&page=%d>; rel="next"'
+                            %(srv.base_url, srv.user_repo, per_page, page+1)))
+        if self.headers.getheader('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self._send(200, body, 'application/json', headers)
+
+    def _send_file(self, filename):
+        srv = self.server_obj
+        fn = os.path.join(srv.assetdir, filename)
+        if not os.path.isfile(fn):
+            self._send(404, 'Not Found', 'text/plain')
+            return
+        size = os.path.getsize(fn)
+        etag = '"%s-%d"' %(filename, size)
+        (first, last) = (0, size - 1)
+        code = 200
+        m = re.match(r'^bytes=(\d+)-(\d*)$', self.headers.getheader('Range') or '')
+        if m and self.headers.getheader('If-Range', etag) == etag:
+            (first, last) = (int(m.group(1)), min(size - 1, int(m.group(2) or size - 1)))
+            if first >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d' %(size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            code = 206
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(last - first + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        if code == 206:
+            self.send_header('Content-Range', 'bytes %d-%d/%d' %(first, last, size))
+        self.end_headers()
+        with open(fn, 'rb') as f:
+            f.seek(first)
+            remaining = last - first + 1
+            t0 = time.time()
+            sent = 0
+            while remaining > 0:
+                buf = f.read(min(remaining, 65536))
+                self.wfile.write(buf)
+                remaining -= len(buf)
+                sent += len(buf)
+                if srv.rate:
+                    ahead = sent / float(srv.rate) - (time.time() - t0)
+                    if ahead > 0:
+                        time.sleep(ahead)
+
+
+def make_self_signed_cert(destdir):
+    """
+    Create a self-signed certificate for ``127.0.0.1`` with the `openssl` command line tool.
+    Returns the names of the PEM file containing both the key and the certificate (for the
+    server), and of the file containing only the certificate (for the client).
+    """
+    pem = os.path.join(destdir, 'cert.pem')
+    subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '2',
+                           '-subj', '/CN=127.0.0.1', '-keyout', pem, '-out', pem + '.crt'],
+                          stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+    with open(pem, 'ab') as f:
+        with open(pem + '.crt', 'rb') as fcrt:
+            f.write(fcrt.read())
+    return (pem, pem + '.crt')
+
+
+# -----------------------------------------------------------------------------
+# measuring and reporting
+
+
+class Stopwatch(object):
+    """
+    Repeated measurements of the same operation; reports the best and median times.
+    """
+    def __init__(self):
+        self.times = []
+
+    @contextlib.contextmanager
+    def measure(self):
+        t0 = time.time()
+        yield
+        self.times.append(time.time() - t0)
+
+    def best(self):
+        return min(self.times)
+
+    def median(self):
+        t = sorted(self.times)
+        return t[len(t)//2]
+
+
+def format_size(nbytes):
+    from updater4pyi import upd_progress
+    return upd_progress.format_size(nbytes)
+
+
+def format_rate(nbytes, seconds):
+    if not seconds:
+        return '-'
+    return format_size(nbytes / seconds) + '/s'
+
+
+def print_table(headers, rows, out=sys.stdout):
+    """
+    Print a simple text table.
+    """
+    rows = [ [ str(x) for x in row ] for row in rows ]
+    widths = [ max([len(h)] + [ len(r[i]) for r in rows ]) for (i, h) in enumerate(headers) ]
+    fmt = '  '.join([ '%%-%ds' %(w) for w in widths ])
+    out.write(fmt %tuple(headers) + '\n')
+    out.write('  '.join([ '-'*w for w in widths ]) + '\n')
+    for r in rows:
+        out.write(fmt %tuple(r) + '\n')
+    out.flush()
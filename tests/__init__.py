@@ -0,0 +1,4 @@
+# Tests for updater4pyi. Run them from the top directory with:
+#
+#     python -m unittest discover -s tests -t .
+#
@@ -0,0 +1,120 @@
+
+import os
+import os.path
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from updater4pyi import upd_archive
+from updater4pyi.upd_defs import Updater4PyiError
+
+
+FILES = {
+    'myapp/myapp': 'exe v2' * 1000,
+    'myapp/lib/a.so': os.urandom(100000),
+    'myapp/lib/empty.txt': '',
+    }
+
+
+class _NoSeek(object):
+    # only read() is available, like for a download
+    def __init__(self, data):
+        self.f = StringIO(data)
+    def read(self, n=-1):
+        return self.f.read(n)
+
+
+def _zip_data(compression=zipfile.ZIP_DEFLATED, files=FILES):
+    buf = StringIO()
+    z = zipfile.ZipFile(buf, 'w', compression)
+    z.writestr('myapp/lib/', '')
+    for fn in sorted(files):
+        z.writestr(fn, files[fn])
+    z.close()
+    return buf.getvalue()
+
+def _tar_data(mode):
+    buf = StringIO()
+    t = tarfile.open(fileobj=buf, mode=mode)
+    for fn in sorted(FILES):
+        tinfo = tarfile.TarInfo(fn)
+        tinfo.size = len(FILES[fn])
+        t.addfile(tinfo, StringIO(FILES[fn]))
+    t.close()
+    return buf.getvalue()
+
+
+class TestExtract(unittest.TestCase):
+
+    def setUp(self):
+        self.destdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.destdir)
+
+    def check_files(self):
+        for (fn, data) in FILES.items():
+            with open(os.path.join(self.destdir, fn), 'rb') as f:
+                self.assertEqual(f.read(), data, fn)
+
+    def test_stream_zip(self):
+        for compression in (zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED):
+            names = upd_archive.extract_stream(_NoSeek(_zip_data(compression)), self.destdir)
+            self.assertEqual(sorted(names), sorted(FILES.keys() + ['myapp/lib/']))
+            self.check_files()
+            shutil.rmtree(self.destdir)
+            os.mkdir(self.destdir)
+
+    def test_stream_tar(self):
+        for mode in ('w', 'w:gz', 'w:bz2'):
+            names = upd_archive.extract_stream(_NoSeek(_tar_data(mode)), self.destdir)
+            self.assertEqual(sorted(names), sorted(FILES))
+            self.check_files()
+
+    def test_stream_zip_with_prefix(self):
+        # e.g. a self-extracting archive: must be extracted from the central directory
+        data = 'MZ stub program' * 100 + _zip_data()
+        self.assertRaises(upd_archive.UnsupportedArchiveStream,
+                          upd_archive.extract_stream, _NoSeek(data), self.destdir)
+
+    def test_stream_not_an_archive(self):
+        self.assertRaises(upd_archive.UnsupportedArchiveStream,
+                          upd_archive.extract_stream, _NoSeek('garbage' * 100), self.destdir)
+
+    def test_stream_corrupt_zip(self):
+        data = _zip_data(zipfile.ZIP_STORED)
+        i = data.index('exe v2')
+        data = data[:i] + 'EXE' + data[i+3:]
+        self.assertRaises(Updater4PyiError, upd_archive.extract_stream, _NoSeek(data), self.destdir)
+
+    def test_stream_no_escape(self):
+        data = _zip_data(files={'../evil': 'x', '/abs': 'y'})
+        upd_archive.extract_stream(_NoSeek(data), self.destdir)
+        self.assertEqual(sorted(os.listdir(self.destdir)), ['abs', 'evil', 'myapp'])
+
+    def test_extract_zip(self):
+        zipfn = os.path.join(self.destdir, 'a.zip')
+        with open(zipfn, 'wb') as f:
+            f.write(_zip_data())
+        for workers in (None, 3):
+            outdir = os.path.join(self.destdir, 'out%s' %(workers))
+            names = upd_archive.extract_zip(zipfn, outdir, workers=workers,
+                                            exclude=('myapp/lib/empty.txt',), mode=0750)
+            self.assertEqual(sorted(names), ['myapp/lib/', 'myapp/lib/a.so', 'myapp/myapp'])
+            with open(os.path.join(outdir, 'myapp/lib/a.so'), 'rb') as f:
+                self.assertEqual(f.read(), FILES['myapp/lib/a.so'])
+            self.assertFalse(os.path.exists(os.path.join(outdir, 'myapp/lib/empty.txt')))
+            self.assertEqual(os.stat(os.path.join(outdir, 'myapp/myapp')).st_mode & 0777, 0750)
+
+    def test_extract_zip_invalid(self):
+        fn = os.path.join(self.destdir, 'a.zip')
+        with open(fn, 'wb') as f:
+            f.write('garbage')
+        self.assertRaises(Updater4PyiError, upd_archive.extract_zip, fn, self.destdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+
+import os
+import os.path
+import random
+import shutil
+import hashlib
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from updater4pyi import upd_chunks
+from updater4pyi.upd_defs import Updater4PyiError
+
+
+CHUNKER = {'min_size': 256, 'avg_bits': 10, 'max_size': 4096}
+
+
+def _random_data(rnd, n):
+    return ''.join([ chr(rnd.randint(0, 255)) for i in xrange(n) ])
+
+
+class TestChunks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rnd = random.Random(1)
+        self.old = _random_data(rnd, 100000)
+        # insert and change a few bytes: the chunk boundaries resynchronize after the edits
+        self.new = (self.old[:30000] + _random_data(rnd, 100) + self.old[30000:70000] +
+                    'changed' + self.old[70007:])
+        self.oldfn = os.path.join(self.tmpdir, 'myapp-1.0')
+        self.newfn = os.path.join(self.tmpdir, 'myapp-1.1')
+        for (fn, data) in ((self.oldfn, self.old), (self.newfn, self.new)):
+            with open(fn, 'wb') as f:
+                f.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_iter_chunks(self):
+        chunks = list(upd_chunks.iter_chunks(StringIO(self.new), **CHUNKER))
+        self.assertEqual(''.join(chunks), self.new)
+        self.assertTrue(len(chunks) > 10)
+        for c in chunks[:-1]:
+            self.assertTrue(CHUNKER['min_size'] <= len(c) <= CHUNKER['max_size'])
+        # the chunking depends on the contents only
+        self.assertEqual(list(upd_chunks.iter_chunks(StringIO(self.new), **CHUNKER)), chunks)
+
+    def test_iter_chunks_invalid_params(self):
+        self.assertRaises(ValueError, list, upd_chunks.iter_chunks(StringIO('x'), 4, 2, 1024))
+        self.assertRaises(ValueError, list, upd_chunks.iter_chunks(StringIO('x'), 256, 2, 128))
+
+    def index(self):
+        d = upd_chunks.make_chunk_index(self.newfn, chunker=CHUNKER)
+        self.assertEqual(d['digest'], 'sha256:' + hashlib.sha256(self.new).hexdigest())
+        return upd_chunks.ChunkIndex.from_dict(d)
+
+    def test_rebuild(self):
+        index = self.index()
+        requests = []
+        def fetch_range(first, last):
+            requests.append((first, last))
+            return StringIO(self.new[first:last+1])
+
+        with tempfile.TemporaryFile() as fdst:
+            (reused, fetched) = index.rebuild(fdst, [(self.oldfn, None)], fetch_range)
+            fdst.seek(0)
+            self.assertEqual(fdst.read(), self.new)
+
+        self.assertEqual(reused + fetched, len(self.new))
+        self.assertTrue(fetched < len(self.new) // 4, fetched)
+        self.assertEqual(sum([ l - f + 1 for (f, l) in requests ]), fetched)
+
+    def test_rebuild_with_seed_index(self):
+        index = self.index()
+        seed_index = upd_chunks.ChunkIndex.from_dict(upd_chunks.make_chunk_index(self.oldfn,
+                                                                                 chunker=CHUNKER))
+        self.assertEqual(index.find_local_chunks([(self.oldfn, seed_index)]),
+                         index.find_local_chunks([(self.oldfn, None)]))
+
+    def test_rebuild_bad_data(self):
+        index = self.index()
+        def fetch_range(first, last):
+            return StringIO('x' * (last - first + 1))
+        with tempfile.TemporaryFile() as fdst:
+            self.assertRaises(Updater4PyiError, index.rebuild, fdst, [(self.oldfn, None)], fetch_range)
+
+    def test_rebuild_short_read(self):
+        index = self.index()
+        def fetch_range(first, last):
+            return StringIO(self.new[first:last])
+        with tempfile.TemporaryFile() as fdst:
+            self.assertRaises(IOError, index.rebuild, fdst, [(self.oldfn, None)], fetch_range)
+
+    def test_invalid_index(self):
+        self.assertRaises(Updater4PyiError, upd_chunks.ChunkIndex.parse, 'not json')
+        self.assertRaises(Updater4PyiError, upd_chunks.ChunkIndex.parse, '{"size": 10}')
+        self.assertRaises(Updater4PyiError, upd_chunks.ChunkIndex.parse,
+                          '{"size": 10, "chunks": [[5, "00"]]}')
+
+
+if __name__ == '__main__':
+    unittest.main()
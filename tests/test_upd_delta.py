@@ -0,0 +1,76 @@
+
+import bz2
+import struct
+import unittest
+
+from updater4pyi import upd_delta
+from updater4pyi.upd_defs import Updater4PyiError
+
+
+def _offtout(x):
+    if x < 0:
+        return struct.pack('<Q', -x | (1 << 63))
+    return struct.pack('<Q', x)
+
+def _make_patch(ctrl, diff, extra, newsize):
+    # a BSDIFF40 patch with the given control triples and (uncompressed) diff and extra
+    # blocks
+    ctrlblock = bz2.compress(''.join([ _offtout(x)+_offtout(y)+_offtout(z) for (x, y, z) in ctrl ]))
+    diffblock = bz2.compress(diff)
+    return (upd_delta.BSDIFF_MAGIC + _offtout(len(ctrlblock)) + _offtout(len(diffblock)) +
+            _offtout(newsize) + ctrlblock + diffblock + bz2.compress(extra))
+
+def _diff(old, new):
+    return ''.join([ chr((ord(n) - ord(o)) & 0xff) for (o, n) in zip(old, new) ])
+
+
+class TestApplyPatch(unittest.TestCase):
+
+    old = 'The quick brown fox jumps over the lazy dog. ' * 200
+
+    def make_new_and_patch(self):
+        # replace 5 bytes after the first 20 (which have one byte changed), and change
+        # a byte near the end
+        head = self.old[:3] + 'X' + self.old[4:20]
+        rest = self.old[25:-10] + '!' + self.old[-9:]
+        new = head + 'HELLO' + rest
+        patch = _make_patch([(20, 5, 5), (len(rest), 0, 0)],
+                            _diff(self.old[:20], head) + _diff(self.old[25:], rest),
+                            'HELLO', len(new))
+        return (new, patch)
+
+    def test_pure_python(self):
+        (new, patch) = self.make_new_and_patch()
+        self.assertEqual(upd_delta._apply_bsdiff_patch(self.old, patch), new)
+
+    def test_apply_patch(self):
+        (new, patch) = self.make_new_and_patch()
+        self.assertEqual(upd_delta.apply_patch(self.old, patch), new)
+
+    def test_beyond_old_data(self):
+        # bytes outside of the old data count as zeros
+        patch = _make_patch([(4, 0, 0)], 'abcd', '', 4)
+        self.assertEqual(upd_delta._apply_bsdiff_patch('', patch), 'abcd')
+
+    def test_bad_header(self):
+        (new, patch) = self.make_new_and_patch()
+        self.assertRaises(Updater4PyiError, upd_delta._apply_bsdiff_patch, self.old,
+                          'BSDIFF39' + patch[8:])
+        self.assertRaises(Updater4PyiError, upd_delta._apply_bsdiff_patch, self.old, patch[:20])
+
+    def test_corrupt_control(self):
+        # more bytes than the new file has
+        patch = _make_patch([(10, 0, 0)], 'x'*10, '', 5)
+        self.assertRaises(Updater4PyiError, upd_delta._apply_bsdiff_patch, self.old, patch)
+        # not enough
+        patch = _make_patch([(5, 0, 0)], 'x'*5, '', 10)
+        self.assertRaises(Updater4PyiError, upd_delta._apply_bsdiff_patch, self.old, patch)
+
+    def test_corrupt_compressed_data(self):
+        (new, patch) = self.make_new_and_patch()
+        self.assertRaises(Updater4PyiError, upd_delta._apply_bsdiff_patch, self.old,
+                          patch[:40] + 'garbage' + patch[47:])
+
+
+if __name__ == '__main__':
+    unittest.main()
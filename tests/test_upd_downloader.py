@@ -0,0 +1,158 @@
+
+import os
+import os.path
+import re
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+import SocketServer
+import BaseHTTPServer
+
+from updater4pyi import upd_downloader
+from updater4pyi.upd_defs import Updater4PyiError
+
+
+class TestParseContentRange(unittest.TestCase):
+
+    def test_parse(self):
+        p = upd_downloader._parse_content_range
+        self.assertEqual(p('bytes 0-99/1000'), (0, 99, 1000))
+        self.assertEqual(p(' bytes 100-199/* '), (100, 199, None))
+        self.assertEqual(p(None), None)
+        self.assertEqual(p(''), None)
+        self.assertEqual(p('bytes */1000'), None)
+        self.assertEqual(p('items 0-1/2'), None)
+        self.assertEqual(p('bytes 0-99'), None)
+
+
+class TestDownloadVerifier(unittest.TestCase):
+
+    def test_digest(self):
+        data = 'some data' * 100
+        v = upd_downloader.DownloadVerifier(size=len(data),
+                                            digest='sha256:' + hashlib.sha256(data).hexdigest())
+        v.update(data[:10])
+        v.update(data[10:])
+        v.finish()
+
+        v = upd_downloader.DownloadVerifier(digest='sha256:' + hashlib.sha256(data).hexdigest())
+        v.update(data + 'x')
+        self.assertRaises(Updater4PyiError, v.finish)
+
+    def test_size(self):
+        v = upd_downloader.DownloadVerifier(size=10)
+        self.assertRaises(Updater4PyiError, v.check_size, 11)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # serves server.data at any path, honoring Range and If-Range, and drops the
+    # connection after server.drop_after bytes of the body (once).
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        srv = self.server
+        data = srv.data
+        etag = '"%s"' %(hashlib.sha1(data).hexdigest())
+        rng = self.headers.getheader('Range')
+        srv.requests.append((rng, self.headers.getheader('If-Range')))
+
+        (first, code) = (0, 200)
+        if rng and self.headers.getheader('If-Range') in (None, etag):
+            first = int(re.match(r'bytes=(\d+)-$', rng).group(1))
+            code = 206
+        body = data[first:]
+
+        self.send_response(code)
+        self.send_header('ETag', etag)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(body)))
+        if code == 206:
+            self.send_header('Content-Range', 'bytes %d-%d/%d' %(first, len(data)-1, len(data)))
+        self.end_headers()
+
+        if srv.drop_after is not None:
+            self.wfile.write(body[:srv.drop_after])
+            srv.drop_after = None
+            self.close_connection = 1
+            return
+        self.wfile.write(body)
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # the client hanging up is expected
+        pass
+
+
+class TestPartialDownloadStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.data = os.urandom(300000)
+        self.server.drop_after = None
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/myapp-1.1.zip' %(self.server.server_address[1])
+        # a single connection, so that the resumed request is easy to check
+        self.store = upd_downloader.PartialDownloadStore(os.path.join(self.tmpdir, 'partial'),
+                                                         max_segments=1)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        upd_downloader.connection_pool.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def verifier(self, data=None):
+        data = (data if data is not None else self.server.data)
+        return upd_downloader.DownloadVerifier(size=len(data),
+                                               digest='sha256:' + hashlib.sha256(data).hexdigest())
+
+    def read(self, fn):
+        with open(fn, 'rb') as f:
+            return f.read()
+
+    def test_fetch(self):
+        fn = self.store.fetch(self.url, verifier=self.verifier())
+        self.assertEqual(self.read(fn), self.server.data)
+        self.assertEqual(self.server.requests, [(None, None)])
+
+    def test_resume(self):
+        self.server.drop_after = 100000
+        self.assertRaises(IOError, self.store.fetch, self.url, retries=0, verifier=self.verifier())
+
+        fn = self.store.fetch(self.url, retries=0, verifier=self.verifier())
+        self.assertEqual(self.read(fn), self.server.data)
+        (rng, ifrange) = self.server.requests[-1]
+        self.assertEqual(rng, 'bytes=100000-')
+        self.assertTrue(ifrange)
+
+    def test_resume_changed_file(self):
+        self.server.drop_after = 100000
+        self.assertRaises(IOError, self.store.fetch, self.url, retries=0, verifier=self.verifier())
+
+        # the server has a new file: it ignores the range, and we start over
+        self.server.data = os.urandom(200000)
+        fn = self.store.fetch(self.url, retries=0, verifier=self.verifier())
+        self.assertEqual(self.read(fn), self.server.data)
+
+    def test_verification_failure(self):
+        self.assertRaises(Updater4PyiError, self.store.fetch, self.url, retries=0,
+                          verifier=self.verifier(self.server.data[:-1] + 'x'))
+        # the bad download is not kept
+        self.assertEqual(os.listdir(self.store.directory), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
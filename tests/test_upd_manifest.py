@@ -0,0 +1,107 @@
+
+import os
+import os.path
+import json
+import shutil
+import tempfile
+import unittest
+
+from updater4pyi import upd_manifest
+from updater4pyi.upd_defs import Updater4PyiError
+
+
+def _write(fn, data):
+    if not os.path.isdir(os.path.dirname(fn)):
+        os.makedirs(os.path.dirname(fn))
+    with open(fn, 'wb') as f:
+        f.write(data)
+
+def _read(fn):
+    with open(fn, 'rb') as f:
+        return f.read()
+
+
+class TestFileManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.olddir = os.path.join(self.tmpdir, 'old')
+        self.newdir = os.path.join(self.tmpdir, 'new')
+        for (d, changed) in ((self.olddir, 'v1'), (self.newdir, 'v2')):
+            _write(os.path.join(d, 'myapp'), 'exe ' + changed)
+            _write(os.path.join(d, 'lib', 'same.so'), 'same' * 1000)
+            _write(os.path.join(d, 'lib', 'changed.so'), 'lib ' + changed)
+        _write(os.path.join(self.olddir, 'lib', 'removed.so'), 'old')
+        _write(os.path.join(self.newdir, 'lib', 'added.so'), 'new')
+        os.makedirs(os.path.join(self.newdir, 'plugins'))
+        if hasattr(os, 'symlink'):
+            os.symlink('lib/same.so', os.path.join(self.newdir, 'same-link.so'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def manifest(self):
+        data = json.dumps(upd_manifest.make_manifest(self.newdir, files_url='files/'))
+        return upd_manifest.FileManifest.parse(data, url='http://example.com/myapp-1.1.manifest.json')
+
+    def test_parse(self):
+        manifest = self.manifest()
+        entries = dict([ (e.path, e) for e in manifest.entries ])
+        self.assertEqual(sorted(entries), ['lib/added.so', 'lib/changed.so', 'lib/same.so', 'myapp'])
+        self.assertEqual(entries['myapp'].url, 'http://example.com/files/myapp')
+        self.assertEqual(entries['myapp'].size, 6)
+        self.assertEqual(manifest.dirs, ['lib', 'plugins'])
+        if hasattr(os, 'symlink'):
+            self.assertEqual(manifest.links, [upd_manifest.ManifestLink('same-link.so', 'lib/same.so')])
+
+    def test_diff_tree(self):
+        (unchanged, changed, removed) = self.manifest().diff_tree(self.olddir)
+        self.assertEqual(sorted([ e.path for e in unchanged ]), ['lib/same.so'])
+        self.assertEqual(sorted([ e.path for e in changed ]), ['lib/added.so', 'lib/changed.so', 'myapp'])
+        self.assertEqual(removed, [os.path.join('lib', 'removed.so')])
+
+    def test_build_tree(self):
+        fetched = []
+        def fetch_file(entry, fdst):
+            fetched.append(entry.path)
+            fdst.write(_read(os.path.join(self.newdir, entry.path)))
+
+        destdir = os.path.join(self.tmpdir, 'built')
+        self.manifest().build_tree(self.olddir, destdir, fetch_file)
+
+        self.assertEqual(sorted(fetched), ['lib/added.so', 'lib/changed.so', 'myapp'])
+        for fn in ('myapp', 'lib/same.so', 'lib/changed.so', 'lib/added.so'):
+            self.assertEqual(_read(os.path.join(destdir, fn)), _read(os.path.join(self.newdir, fn)))
+        self.assertFalse(os.path.exists(os.path.join(destdir, 'lib', 'removed.so')))
+        self.assertTrue(os.path.isdir(os.path.join(destdir, 'plugins')))
+        if hasattr(os, 'symlink'):
+            self.assertEqual(os.readlink(os.path.join(destdir, 'same-link.so')), 'lib/same.so')
+
+    def test_build_tree_bad_download(self):
+        def fetch_file(entry, fdst):
+            fdst.write('corrupt')
+        self.assertRaises(Updater4PyiError, self.manifest().build_tree,
+                          self.olddir, os.path.join(self.tmpdir, 'built'), fetch_file)
+
+    def test_build_tree_failed_download(self):
+        def fetch_file(entry, fdst):
+            raise IOError("connection reset")
+        self.assertRaises(Updater4PyiError, self.manifest().build_tree,
+                          self.olddir, os.path.join(self.tmpdir, 'built'), fetch_file)
+
+    def test_invalid(self):
+        def parse(d):
+            return upd_manifest.FileManifest.parse(json.dumps(d))
+        entry = {'path': 'myapp', 'size': 1, 'digest': 'sha256:00'}
+        self.assertRaises(Updater4PyiError, upd_manifest.FileManifest.parse, 'not json')
+        self.assertRaises(Updater4PyiError, parse, {'nofiles': []})
+        self.assertRaises(Updater4PyiError, parse, {'files': [dict(entry, path='../escape')]})
+        self.assertRaises(Updater4PyiError, parse, {'files': [dict(entry, path='/abs')]})
+        self.assertRaises(Updater4PyiError, parse, {'files': [entry],
+                                                    'links': [{'path': 'l', 'target': '/etc'}]})
+        self.assertRaises(Updater4PyiError, parse, {'files': [entry],
+                                                    'links': [{'path': 'a/l', 'target': '../../x'}]})
+
+
+if __name__ == '__main__':
+    unittest.main()
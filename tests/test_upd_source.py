@@ -0,0 +1,138 @@
+
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from updater4pyi import upd_source
+from updater4pyi.upd_source import BinReleaseInfo
+
+
+class _CountingSource(upd_source.UpdateSource):
+    def __init__(self):
+        self.calls = 0
+        self.version = '1.1'
+        self.called = threading.Event()
+        super(_CountingSource, self).__init__()
+
+    def source_identity(self):
+        return 'counting'
+
+    def get_releases(self, newer_than_version=None, **kwargs):
+        self.calls += 1
+        self.called.set()
+        return [
+            BinReleaseInfo(version=self.version, filename='myapp-%s.zip' %(self.version),
+                           url='http://example.com/myapp-%s.zip' %(self.version),
+                           reltype=upd_source.RELTYPE_ARCHIVE, platform='linux'),
+            BinReleaseInfo(version='1.2beta1', filename='myapp-1.2beta1.zip',
+                           url='http://example.com/myapp-1.2beta1.zip',
+                           reltype=upd_source.RELTYPE_ARCHIVE, platform='linux'),
+            ]
+
+
+class TestCachingUpdateSource(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.source = _CountingSource()
+        self.caching = upd_source.CachingUpdateSource(self.source, cache_dir=self.cache_dir,
+                                                      ttl=3600, stale_ttl=3600)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def versions(self, releases):
+        return [ r.get_version() for r in releases ]
+
+    def test_fresh(self):
+        self.assertEqual(self.versions(self.caching.get_releases('1.0')), ['1.1', '1.2beta1'])
+        self.source.version = '1.1.1'
+        releases = self.caching.get_releases('1.0')
+        self.assertEqual(self.versions(releases), ['1.1', '1.2beta1'])
+        self.assertEqual(releases[0].get_url(), 'http://example.com/myapp-1.1.zip')
+        self.assertEqual(self.source.calls, 1)
+        # a different newer_than_version is cached separately
+        self.caching.get_releases('1.1')
+        self.assertEqual(self.source.calls, 2)
+
+    def test_stale(self):
+        self.caching.get_releases('1.0')
+        self.source.version = '1.1.1'
+        self.source.called.clear()
+        self.caching.ttl = 0
+        # the stale releases are returned, and refreshed in the background
+        self.assertEqual(self.versions(self.caching.get_releases('1.0')), ['1.1', '1.2beta1'])
+        self.assertTrue(self.source.called.wait(10))
+        self.caching.ttl = 3600
+        for i in range(100):
+            releases = self.caching.get_releases('1.0')
+            if releases[0].get_version() == '1.1.1':
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.versions(releases), ['1.1.1', '1.2beta1'])
+        self.assertEqual(self.source.calls, 2)
+
+    def test_expired(self):
+        self.caching.get_releases('1.0')
+        self.source.version = '1.1.1'
+        self.caching.ttl = self.caching.stale_ttl = 0
+        self.assertEqual(self.versions(self.caching.get_releases('1.0')), ['1.1.1', '1.2beta1'])
+        self.assertEqual(self.source.calls, 2)
+
+    def test_filters_and_clear(self):
+        self.caching.get_releases('1.0')
+        self.caching.add_release_filter(upd_source.UpdateSourceDevelopmentReleasesFilter(False))
+        self.assertEqual(self.versions(self.caching.get_releases('1.0')), ['1.1'])
+        self.assertEqual(self.source.calls, 1)
+        self.caching.clear()
+        self.caching.get_releases('1.0')
+        self.assertEqual(self.source.calls, 2)
+
+
+class TestNamingStrategyCache(unittest.TestCase):
+
+    def setUp(self):
+        self.matches = []
+        def make_info(m, filename, url, **kwargs):
+            self.matches.append(filename)
+            return BinReleaseInfo(version=m.group('version'), filename=filename, url=url,
+                                  reltype=upd_source.RELTYPE_ARCHIVE, **kwargs)
+        self.strategy = upd_source.ReleaseInfoFromNameStrategy([
+            (r'^myapp-(?P<version>[\d.]+)\.zip$', make_info),
+            ])
+
+    def release(self, body):
+        return {'rel_tag_name': 'v1.1', 'rel_html_url': 'http://example.com/releases/v1.1',
+                'rel_body': body}
+
+    def test_cached(self):
+        rel = self.release('Release notes')
+        a = self.strategy.get_release_info('myapp-1.1.zip', 'http://example.com/a', release=rel)
+        a.version = 'modified'
+        b = self.strategy.get_release_info('myapp-1.1.zip', 'http://example.com/a', release=rel)
+        self.assertEqual(self.matches, ['myapp-1.1.zip'])
+        # the cached object isn't shared with the callers
+        self.assertEqual(b.get_version(), '1.1')
+        self.assertTrue(b.release is rel)
+
+    def test_key_on_release_identity(self):
+        self.strategy.get_release_info('myapp-1.1.zip', 'http://example.com/a',
+                                       release=self.release('Release notes'))
+        # edited release notes: the same release
+        rel = self.release('Edited release notes')
+        b = self.strategy.get_release_info('myapp-1.1.zip', 'http://example.com/a', release=rel)
+        self.assertEqual(len(self.matches), 1)
+        self.assertEqual(b.release['rel_body'], 'Edited release notes')
+        # another file or URL is matched again
+        self.strategy.get_release_info('myapp-1.1.zip', 'http://example.com/b', release=rel)
+        self.assertEqual(len(self.matches), 2)
+
+    def test_no_match(self):
+        self.assertEqual(self.strategy.get_release_info('README.txt', 'http://example.com/r'), None)
+        self.assertEqual(self.strategy.get_release_info('README.txt', 'http://example.com/r'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
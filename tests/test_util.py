@@ -0,0 +1,69 @@
+
+import pickle
+import unittest
+from StringIO import StringIO
+
+from updater4pyi import util
+
+
+class TestParseVersion(unittest.TestCase):
+
+    def test_ordering(self):
+        ordered = ['0.9', '1.0.dev1', '1.0a1', '1.0b2', '1.0rc1', '1.0', '1.0-1', '1.0.1',
+                   '1.2', '1.10', '2.0']
+        for (i, a) in enumerate(ordered):
+            for b in ordered[i+1:]:
+                self.assertTrue(util.parse_version(a) < util.parse_version(b), (a, b))
+                self.assertTrue(util.parse_version(b) > util.parse_version(a), (a, b))
+
+    def test_trailing_zeros(self):
+        self.assertEqual(util.parse_version('1.2'), util.parse_version('1.2.0'))
+        self.assertEqual(hash(util.parse_version('1.2')), hash(util.parse_version('1.2.0')))
+
+    def test_long_tags(self):
+        a = util.parse_version('1.0-verylongreleasetagnumberone')
+        b = util.parse_version('1.0-verylongreleasetagnumbertwo')
+        self.assertNotEqual(a, b)
+        self.assertTrue(a < b)
+
+    def test_compare_with_strings(self):
+        v = util.parse_version('1.2')
+        self.assertTrue(v < '1.3')
+        self.assertTrue(v >= '1.2.0')
+        # only equal to other versions, so that equality agrees with the hashes
+        self.assertFalse(v == '1.2')
+        self.assertTrue(v != '1.2')
+
+    def test_pickle(self):
+        v = util.parse_version('1.2b3')
+        self.assertEqual(pickle.loads(pickle.dumps(v)), v)
+        self.assertEqual(pickle.loads(pickle.dumps(v, 2)), v)
+
+
+class TestIterJsonArray(unittest.TestCase):
+
+    def test_elements(self):
+        data = '[ {"a": [1, 2, "x]"]}, 3, "s,t" , [], {"b": {}} ]'
+        self.assertEqual(list(util.iter_json_array(StringIO(data), chunk_size=3)),
+                         [{'a': [1, 2, 'x]']}, 3, 's,t', [], {'b': {}}])
+
+    def test_empty(self):
+        self.assertEqual(list(util.iter_json_array(StringIO(' [ ] '))), [])
+
+    def test_stops_early(self):
+        # the rest of the document is not read if the caller stops iterating
+        it = util.iter_json_array(StringIO('[1, 2, garbage'), chunk_size=2)
+        self.assertEqual(next(it), 1)
+
+    def test_not_an_array(self):
+        with self.assertRaises(util.NotAJsonArray) as cm:
+            list(util.iter_json_array(StringIO('{"message": "Not Found"}')))
+        self.assertEqual(cm.exception.value, {'message': 'Not Found'})
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, list, util.iter_json_array(StringIO('[1, 2')))
+        self.assertRaises(ValueError, list, util.iter_json_array(StringIO('[1 2]')))
+
+
+if __name__ == '__main__':
+    unittest.main()
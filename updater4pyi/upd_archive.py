@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+#######################################################################################
+#                                                                                     #
+#   This file is part of the updater4pyi Project.                                     #
+#                                                                                     #
+#   Copyright (C) 2014, Philippe Faist                                                #
+#   philippe.faist@bluewin.ch                                                         #
+#   All rights reserved.                                                              #
+#                                                                                     #
+#   Redistribution and use in source and binary forms, with or without                #
+#   modification, are permitted provided that the following conditions are met:       #
+#                                                                                     #
+#   1. Redistributions of source code must retain the above copyright notice, this    #
+#      list of conditions and the following disclaimer.                               #
+#   2. Redistributions in binary form must reproduce the above copyright notice,      #
+#      this list of conditions and the following disclaimer in the documentation      #
+#      and/or other materials provided with the distribution.                         #
+#                                                                                     #
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND   #
+#   ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED     #
+#   WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE            #
+#   DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR   #
+#   ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES    #
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;      #
+#   LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND       #
+#   ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT        #
+#   (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS     #
+#   SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                      #
+#                                                                                     #
+#######################################################################################
+
+
+"""
+Utilities to extract release archives.
+
+:py:func:`extract_zip` extracts a ZIP file, optionally with several threads.
+Decompressing and writing the files release python's global interpreter lock, so this may
+make use of several CPU cores for archives with many files.
+
+:py:func:`extract_stream` extracts archives while they are being downloaded. It reads the archive sequentially from a file-like object, and
+writes each member to disk as soon as it has been received, so that the archive itself
+never needs to be stored.
+
+TAR files (possibly compressed with gzip or bzip2) are read with :py:mod:`tarfile`'s
+streaming mode. ZIP files are read from the *local headers* which precede each member's
+data, instead of the central directory at the end of the file. This works for ZIP files
+created by all usual tools, except for those which write members without compression and
+with a trailing *data descriptor* (e.g. when zipping from a pipe), and for ZIP files
+which don't start with a local header (e.g. self-extracting archives, which are prefixed
+by a program); for those, :py:exc:`UnsupportedArchiveStream` is raised.
+"""
+
+import os
+import os.path
+import time
+import struct
+import zlib
+import shutil
+import zipfile
+import tarfile
+import threading
+import Queue
+
+from .upd_defs import Updater4PyiError
+from . import upd_timing
+from .upd_log import logger
+
+
+# -----------------------------------------------------------------------------
+
+
+class UnsupportedArchiveStream(Updater4PyiError):
+    """
+    Raised by :py:func:`extract_stream` if the archive can't be extracted sequentially. The
+    archive should then be downloaded in full and extracted normally.
+    """
+    pass
+
+
+_BLOCK_SIZE = 65536
+
+# small members are extracted in batches of about this total size, to keep the overhead
+# per task small.
+_EXTRACT_BATCH_SIZE = 1024*1024
+
+# zipfile's member file objects are slow with large reads; this is what
+# ZipFile.extract() uses.
+_EXTRACT_BLOCK_SIZE = 16*1024
+
+
+def default_extract_workers():
+    """
+    Return a suitable number of threads for :py:func:`extract_zip` if the files should be
+    extracted in parallel, i.e. the number of CPUs, but at most 8.
+    """
+    try:
+        import multiprocessing
+        return max(1, min(8, multiprocessing.cpu_count()))
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+def extract_zip(zipfilename, destdir, workers=None, exclude=(), mode=0755, progress=None):
+    """
+    Extract all members of the ZIP file `zipfilename` into the directory `destdir`,
+    except for the member names listed in `exclude`, and set the permissions of the
+    extracted files to `mode`.
+
+    The members are extracted by `workers` threads, each with their own handle on the ZIP
+    file (see also :py:func:`default_extract_workers`). By default, the members are
+    extracted one by one in the calling thread. All directories are created first. The
+    largest members are extracted first, and small members are grouped in batches, so
+    that the work is spread evenly.
+
+    If a :py:class:`upd_progress.ProgressTracker` is given as `progress`, it is informed of
+    each extracted file.
+
+    Returns the list of the names of the extracted members. Raises
+    :py:exc:`upd_defs.Updater4PyiError` if the ZIP file is invalid.
+    """
+    if workers is None:
+        workers = 1
+
+    try:
+        with zipfile.ZipFile(zipfilename, 'r') as thezipfile:
+            infolist = [ zinfo for zinfo in thezipfile.infolist() if zinfo.filename not in exclude ]
+    except (zipfile.BadZipfile, IOError) as e:
+        raise Updater4PyiError("Invalid ZIP archive: %s" %(e))
+
+    # create all directories up front
+    files = []
+    dirs = set()
+    for zinfo in infolist:
+        targetpath = _safe_target_path(destdir, zinfo.filename)
+        if zinfo.filename.endswith('/'):
+            dirs.add(targetpath.rstrip('/'))
+        else:
+            dirs.add(os.path.dirname(targetpath))
+            files.append((zinfo, targetpath))
+    for d in sorted(dirs):
+        if not os.path.isdir(d):
+            os.makedirs(d)
+
+    # largest first, small ones in batches
+    files.sort(key=lambda f: f[0].file_size, reverse=True)
+    tasks = Queue.Queue()
+    batch = []
+    batchsize = 0
+    for f in files:
+        batch.append(f)
+        batchsize += f[0].file_size
+        if batchsize >= _EXTRACT_BATCH_SIZE:
+            tasks.put(batch)
+            batch = []
+            batchsize = 0
+    if batch:
+        tasks.put(batch)
+
+    if progress is not None:
+        progress.reset(0, sum([ f[0].file_size for f in files ]), 0, len(files))
+
+    errors = []
+    timing = upd_timing.current_report()
+
+    def worker():
+        chmod_time = 0.0
+        chmod_count = 0
+        try:
+            with zipfile.ZipFile(zipfilename, 'r') as zf:
+                while not errors:
+                    try:
+                        batch = tasks.get_nowait()
+                    except Queue.Empty:
+                        return
+                    for (zinfo, targetpath) in batch:
+                        with zf.open(zinfo) as fsrc:
+                            with open(targetpath, 'wb') as fdst:
+                                shutil.copyfileobj(fsrc, fdst, _EXTRACT_BLOCK_SIZE)
+                        t0 = time.time()
+                        os.chmod(targetpath, mode)
+                        chmod_time += time.time() - t0
+                        chmod_count += 1
+                        if progress is not None:
+                            progress.add(zinfo.file_size, 1)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            if timing is not None and chmod_count:
+                timing.add(upd_timing.PHASE_CHMOD, chmod_time, chmod_count)
+
+    nthreads = min(workers, tasks.qsize())
+    if nthreads <= 1:
+        worker()
+    else:
+        threads = [ threading.Thread(target=worker) for i in range(nthreads) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    if errors:
+        if isinstance(errors[0], (zipfile.BadZipfile, zlib.error)):
+            raise Updater4PyiError("Invalid ZIP archive: %s" %(errors[0]))
+        raise errors[0]
+
+    if progress is not None:
+        progress.finish()
+
+    logger.debug("extracted %d files with %d threads", len(files), max(1, nthreads))
+
+    return [ zinfo.filename for zinfo in infolist ]
+
+# ZIP local file header: signature, version needed, flags, method, time, date, crc32,
+# compressed size, uncompressed size, file name length, extra field length
+_ZIP_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+_ZIP_LOCAL_SIG = 'PK\x03\x04'
+_ZIP_END_SIGS = ('PK\x01\x02', # central directory
+                 'PK\x05\x06', # end of central directory
+                 'PK\x06\x06', # zip64 end of central directory
+                 )
+_ZIP_DD_SIG = 'PK\x07\x08'
+_ZIP_FLAG_ENCRYPTED = 0x01
+_ZIP_FLAG_DATA_DESCRIPTOR = 0x08
+_ZIP_FLAG_UTF8 = 0x800
+_ZIP_STORED = 0
+_ZIP_DEFLATED = 8
+
+
+def extract_stream(f, destdir, progress=None):
+    """
+    Extract the archive read from the file-like object `f` into the directory `destdir`.
+    Only `f.read()` is used, and the archive is read only up to the end of its last
+    member. If a :py:class:`upd_progress.ProgressTracker` is given as `progress`, it is
+    informed of each extracted member (the totals are unknown).
+
+    Returns the list of the names of the extracted members. Raises
+    :py:exc:`UnsupportedArchiveStream` if the archive can't be extracted sequentially
+    (which includes files which aren't recognized as an archive here, but which may still
+    be e.g. ZIP files with a prefix), or :py:exc:`upd_defs.Updater4PyiError` if it is
+    corrupt.
+    """
+    reader = _Reader(f)
+    head = reader.peek(512)
+
+    if progress is not None:
+        progress.reset()
+
+    if head.startswith(_ZIP_LOCAL_SIG):
+        names = _extract_zip_stream(reader, destdir, progress)
+        if progress is not None:
+            progress.finish()
+        return names
+
+    if (head.startswith('\x1f\x8b') or head.startswith('BZh') or
+        head[257:262] == 'ustar'):
+        try:
+            thetarfile = tarfile.open(fileobj=reader, mode='r|*')
+            names = []
+            for tinfo in thetarfile:
+                thetarfile.extract(tinfo, destdir)
+                names.append(tinfo.name)
+                if progress is not None:
+                    progress.add(tinfo.size, (1 if tinfo.isfile() else 0))
+            thetarfile.close()
+            if progress is not None:
+                progress.finish()
+            return names
+        except tarfile.TarError as e:
+            raise Updater4PyiError("Invalid TAR archive: %s" %(e))
+
+    raise UnsupportedArchiveStream("Downloaded file doesn't start with a ZIP or TAR header")
+
+
+def _extract_zip_stream(reader, destdir, progress=None):
+    names = []
+    chmod_timing = [0.0, 0]
+    try:
+        _extract_zip_stream_members(reader, destdir, progress, names, chmod_timing)
+    finally:
+        timing = upd_timing.current_report()
+        if timing is not None and chmod_timing[1]:
+            timing.add(upd_timing.PHASE_CHMOD, chmod_timing[0], chmod_timing[1])
+    return names
+
+
+def _extract_zip_stream_members(reader, destdir, progress, names, chmod_timing):
+    while True:
+        sig = reader.peek(4)
+        if sig in _ZIP_END_SIGS or not sig:
+            return
+        if sig != _ZIP_LOCAL_SIG:
+            # e.g. an archive extra data record; the central directory will tell
+            raise UnsupportedArchiveStream("Unexpected ZIP header %r" %(sig))
+
+        (sig, version, flags, method, mtime, mdate, crc, csize, usize, fnlen, extralen) = \
+            _ZIP_LOCAL_HEADER.unpack(reader.read_exactly(_ZIP_LOCAL_HEADER.size))
+        filename = reader.read_exactly(fnlen)
+        extra = reader.read_exactly(extralen)
+
+        if flags & _ZIP_FLAG_UTF8:
+            filename = filename.decode('utf-8')
+
+        if flags & _ZIP_FLAG_ENCRYPTED:
+            raise UnsupportedArchiveStream("ZIP member %s is encrypted" %(filename))
+        if method not in (_ZIP_STORED, _ZIP_DEFLATED):
+            raise UnsupportedArchiveStream("ZIP member %s uses unsupported compression method %d"
+                                           %(filename, method))
+
+        zip64 = False
+        if csize == 0xFFFFFFFF or usize == 0xFFFFFFFF:
+            (usize, csize) = _zip64_sizes(extra, usize, csize)
+            zip64 = True
+
+        has_dd = bool(flags & _ZIP_FLAG_DATA_DESCRIPTOR)
+        if has_dd and method == _ZIP_STORED:
+            raise UnsupportedArchiveStream("ZIP member %s has no size in its local header" %(filename))
+
+        targetpath = _safe_target_path(destdir, filename)
+
+        if filename.endswith('/'):
+            if not os.path.isdir(targetpath):
+                os.makedirs(targetpath)
+            if method == _ZIP_DEFLATED:
+                # empty deflate stream
+                _copy_member(reader, None, method, (None if has_dd else csize))
+        else:
+            if not os.path.isdir(os.path.dirname(targetpath)):
+                os.makedirs(os.path.dirname(targetpath))
+            with open(targetpath, 'wb') as fdst:
+                (gotcrc, gotsize) = _copy_member(reader, fdst, method, (None if has_dd else csize))
+            t0 = time.time()
+            os.chmod(targetpath, 0755) # make executable
+            chmod_timing[0] += time.time() - t0
+            chmod_timing[1] += 1
+
+        if has_dd:
+            if reader.peek(4) == _ZIP_DD_SIG:
+                reader.read_exactly(4)
+            if zip64:
+                (crc, csize, usize) = struct.unpack('<IQQ', reader.read_exactly(20))
+            else:
+                (crc, csize, usize) = struct.unpack('<III', reader.read_exactly(12))
+
+        if not filename.endswith('/'):
+            if gotsize != usize or gotcrc != crc:
+                raise Updater4PyiError("Invalid ZIP archive: member %s is corrupt" %(filename))
+
+        logger.debug("extracted %s", filename)
+        names.append(filename)
+        if progress is not None and not filename.endswith('/'):
+            progress.add(usize, 1)
+
+
+def _copy_member(reader, fdst, method, csize):
+    # copy (and decompress) the data of a member, of compressed size `csize` (or until the
+    # end of the deflate stream if csize is None). Returns (crc32, uncompressed size).
+    crc = 0
+    size = 0
+    d = (zlib.decompressobj(-15) if method == _ZIP_DEFLATED else None)
+    remaining = csize
+    while remaining is None or remaining > 0:
+        buf = reader.read(_BLOCK_SIZE if remaining is None else min(_BLOCK_SIZE, remaining))
+        if not buf:
+            raise Updater4PyiError("Invalid ZIP archive: truncated")
+        if remaining is not None:
+            remaining -= len(buf)
+        data = (d.decompress(buf) if d is not None else buf)
+        if d is not None and d.unused_data:
+            # end of the deflate stream: give back what follows
+            reader.unread(d.unused_data)
+            remaining = 0
+        if data:
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            if fdst is not None:
+                fdst.write(data)
+    if d is not None:
+        data = d.flush()
+        if data:
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            if fdst is not None:
+                fdst.write(data)
+    return (crc & 0xFFFFFFFF, size)
+
+
+def _zip64_sizes(extra, usize, csize):
+    # find the zip64 extended information extra field
+    i = 0
+    while i + 4 <= len(extra):
+        (hid, hlen) = struct.unpack('<HH', extra[i:i+4])
+        if hid == 0x0001:
+            fields = extra[i+4:i+4+hlen]
+            j = 0
+            if usize == 0xFFFFFFFF:
+                (usize,) = struct.unpack('<Q', fields[j:j+8])
+                j += 8
+            if csize == 0xFFFFFFFF:
+                (csize,) = struct.unpack('<Q', fields[j:j+8])
+            return (usize, csize)
+        i += 4 + hlen
+    raise Updater4PyiError("Invalid ZIP archive: missing zip64 sizes")
+
+
+def _safe_target_path(destdir, filename):
+    # the same sanitization as zipfile.ZipFile.extract(): no absolute paths, no '..'
+    parts = [ x for x in filename.replace('\\', '/').split('/')
+              if x and x not in ('.', '..') ]
+    if not parts:
+        raise Updater4PyiError("Invalid ZIP archive: bad member name %r" %(filename))
+    return os.path.join(destdir, *parts) + ('/' if filename.endswith('/') else '')
+
+
+class _Reader(object):
+    # wraps a file-like object, allowing to peek at and to give back data.
+    def __init__(self, f):
+        self.f = f
+        self.pending = ''
+
+    def read(self, n=-1):
+        if self.pending:
+            if n < 0:
+                data = self.pending + self.f.read()
+                self.pending = ''
+                return data
+            data = self.pending[:n]
+            self.pending = self.pending[n:]
+            return data
+        return self.f.read(n)
+
+    def read_exactly(self, n):
+        data = self.peek(n)
+        if len(data) < n:
+            raise Updater4PyiError("Invalid archive: truncated")
+        self.pending = self.pending[n:]
+        return data
+
+    def peek(self, n):
+        while len(self.pending) < n:
+            buf = self.f.read(max(n - len(self.pending), _BLOCK_SIZE))
+            if not buf:
+                break
+            self.pending += buf
+        return self.pending[:n]
+
+    def unread(self, data):
+        self.pending = data + self.pending
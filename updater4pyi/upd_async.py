@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#######################################################################################
+#                                                                                     #
+#   This file is part of the updater4pyi Project.                                     #
+#                                                                                     #
+#   Copyright (C) 2014, Philippe Faist                                                #
+#   philippe.faist@bluewin.ch                                                         #
+#   All rights reserved.                                                              #
+#                                                                                     #
+#   Redistribution and use in source and binary forms, with or without                #
+#   modification, are permitted provided that the following conditions are met:       #
+#                                                                                     #
+#   1. Redistributions of source code must retain the above copyright notice, this    #
+#      list of conditions and the following disclaimer.                               #
+#   2. Redistributions in binary form must reproduce the above copyright notice,      #
+#      this list of conditions and the following disclaimer in the documentation      #
+#      and/or other materials provided with the distribution.                         #
+#                                                                                     #
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND   #
+#   ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED     #
+#   WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE            #
+#   DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR   #
+#   ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES    #
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;      #
+#   LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND       #
+#   ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT        #
+#   (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS     #
+#   SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                      #
+#                                                                                     #
+#######################################################################################
+
+
+"""
+Utilities to run the update work in the background.
+
+:py:func:`run_in_thread` runs a function in a separate thread and immediately returns a
+*future* for its result, so that the caller isn't blocked by network transfers. This is
+what the `*_async` methods of :py:class:`upd_core.Updater` use.
+
+If the :py:mod:`concurrent.futures` module is available (it is part of the standard
+library since python 3.2, and it is available as the `futures
+<https://pypi.python.org/pypi/futures>`_ backport for python 2), the returned futures are
+:py:class:`concurrent.futures.Future` instances. Applications with an `asyncio` event
+loop may then wait for them with ``await asyncio.wrap_future(future)``. Otherwise, a
+:py:class:`UpdateFuture` with the same basic interface is returned.
+"""
+
+import sys
+import threading
+
+from .upd_log import logger
+
+
+# -----------------------------------------------------------------------------
+
+
+class UpdateFuture(object):
+    """
+    A minimal version of :py:class:`concurrent.futures.Future`, for when that module isn't
+    available. Only the methods needed to wait for and to get the result are provided.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        """
+        Return `True` if the work is finished.
+        """
+        with self._condition:
+            return self._done
+
+    def result(self, timeout=None):
+        """
+        Wait for the work to finish (at most `timeout` seconds, if not `None`) and return
+        its result. If the work raised an exception, that exception is raised here.
+        """
+        self._wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Wait for the work to finish (at most `timeout` seconds, if not `None`) and return
+        the exception it raised, or `None`.
+        """
+        self._wait(timeout)
+        return self._exception
+
+    def add_done_callback(self, fn):
+        """
+        Call `fn(future)` when the work is finished. If it is already finished, `fn` is
+        called immediately. Note that `fn` is called from the worker thread.
+        """
+        with self._condition:
+            if not self._done:
+                self._callbacks.append(fn)
+                return
+        self._call(fn)
+
+    def set_running_or_notify_cancel(self):
+        return True
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def set_exception(self, exception):
+        self._finish(None, exception)
+
+    def _wait(self, timeout):
+        with self._condition:
+            if not self._done:
+                self._condition.wait(timeout)
+            if not self._done:
+                raise RuntimeError("Timed out waiting for update operation")
+
+    def _finish(self, result, exception):
+        with self._condition:
+            self._result = result
+            self._exception = exception
+            self._done = True
+            self._condition.notify_all()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for fn in callbacks:
+            self._call(fn)
+
+    def _call(self, fn):
+        try:
+            fn(self)
+        except Exception:
+            logger.exception("Exception in future callback %r", fn)
+
+
+def new_future():
+    """
+    Return a new :py:class:`concurrent.futures.Future` if possible, otherwise a new
+    :py:class:`UpdateFuture`.
+    """
+    try:
+        from concurrent.futures import Future
+    except ImportError:
+        return UpdateFuture()
+    return Future()
+
+
+def run_in_thread(fn, *args, **kwargs):
+    """
+    Call `fn(*args, **kwargs)` in a new (daemon) thread, and return a future for its result
+    (see :py:func:`new_future`).
+    """
+    future = new_future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            future.set_exception(sys.exc_info()[1])
+        else:
+            future.set_result(result)
+
+    t = threading.Thread(target=run, name='updater4pyi-%s' %(getattr(fn, '__name__', 'worker')))
+    t.daemon = True
+    t.start()
+    return future
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+#######################################################################################
+#                                                                                     #
+#   This file is part of the updater4pyi Project.                                     #
+#                                                                                     #
+#   Copyright (C) 2014, Philippe Faist                                                #
+#   philippe.faist@bluewin.ch                                                         #
+#   All rights reserved.                                                              #
+#                                                                                     #
+#   Redistribution and use in source and binary forms, with or without                #
+#   modification, are permitted provided that the following conditions are met:       #
+#                                                                                     #
+#   1. Redistributions of source code must retain the above copyright notice, this    #
+#      list of conditions and the following disclaimer.                               #
+#   2. Redistributions in binary form must reproduce the above copyright notice,      #
+#      this list of conditions and the following disclaimer in the documentation      #
+#      and/or other materials provided with the distribution.                         #
+#                                                                                     #
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND   #
+#   ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED     #
+#   WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE            #
+#   DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR   #
+#   ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES    #
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;      #
+#   LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND       #
+#   ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT        #
+#   (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS     #
+#   SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                      #
+#                                                                                     #
+#######################################################################################
+
+"""
+Content-defined chunking, to rebuild release files by reusing bytes we already have
+locally.
+
+The publisher splits a release file into *content-defined chunks* (the chunk boundaries
+depend on the contents, so that inserting or removing bytes in a file only affects the
+chunks around the change), and publishes the list of chunks with their digests as a
+*chunk index* next to the release file. The :py:class:`~upd_core.Updater` then rebuilds
+the release file from the chunks it finds in local files (the executable currently
+running, or the previously downloaded release file), and only downloads the missing
+chunks with HTTP Range requests on the release file URL. This is similar to what `zsync
+<http://zsync.moria.org.uk/>`_ or `casync <https://github.com/systemd/casync>`_ do.
+
+The chunk index is a JSON file of the form::
+
+    {
+      "size": 153092096,
+      "digest": "sha256:9f86d0...",
+      "chunker": { "min_size": 16384, "avg_bits": 16, "max_size": 262144 },
+      "chunk_digest": "sha256",
+      "chunks": [ [ 70311, "60303a..." ], [ 18022, "fd61a0..." ], ... ]
+    }
+
+where each chunk is given by its length and its hex digest, in order. You may generate a
+chunk index with :py:func:`make_chunk_index`.
+
+The chunker is a *gear hash* rolling hash: a cut point is placed after a byte when the
+lowest `avg_bits` bits of the hash vanish, with chunks no smaller than `min_size` and no
+larger than `max_size` bytes.
+"""
+
+import os
+import os.path
+import json
+import struct
+import hashlib
+
+from . import util
+from .upd_defs import Updater4PyiError
+from .upd_log import logger
+
+
+# -----------------------------------------------------------------------------
+
+
+DEFAULT_CHUNKER_PARAMS = {
+    'min_size': 16384,
+    'avg_bits': 16,
+    'max_size': 262144,
+    }
+
+DEFAULT_CHUNK_DIGEST = 'sha256'
+
+# the gear hash only depends on the last 32 bytes, so we start hashing 32 bytes before
+# the first possible cut point
+_GEAR_WINDOW = 32
+
+# a fixed table of pseudo-random 32-bit values (this must never change, or published
+# chunk indexes become useless)
+_GEAR = tuple([ struct.unpack('<I', hashlib.md5(b'updater4pyi-gear-%d' %(i)).digest()[:4])[0]
+                for i in xrange(256) ])
+
+_READ_BLOCK_SIZE = 4*1024*1024
+
+
+
+def iter_chunks(f, min_size, avg_bits, max_size):
+    """
+    Split the contents of the open file `f` into content-defined chunks. Yields the
+    contents of the chunks, in order, as strings.
+    """
+    if min_size < _GEAR_WINDOW or max_size < min_size:
+        raise ValueError("Invalid chunker parameters")
+
+    gear = _GEAR
+    mask = (1 << avg_bits) - 1
+    buf = bytearray()
+    pos = 0
+    eof = False
+
+    while True:
+        if not eof and len(buf) - pos < max_size:
+            data = f.read(_READ_BLOCK_SIZE)
+            if data:
+                del buf[:pos]
+                pos = 0
+                buf.extend(data)
+                continue
+            eof = True
+
+        n = min(len(buf) - pos, max_size)
+        if not n:
+            return
+
+        cut = n
+        if n > min_size:
+            h = 0
+            for i in xrange(pos + min_size - _GEAR_WINDOW, pos + min_size):
+                h = ((h << 1) + gear[buf[i]]) & 0xffffffff
+            for i in xrange(pos + min_size, pos + n):
+                h = ((h << 1) + gear[buf[i]]) & 0xffffffff
+                if not (h & mask):
+                    cut = i + 1 - pos
+                    break
+
+        yield str(buf[pos:pos+cut])
+        pos += cut
+
+
+
+class ChunkIndex(object):
+    """
+    The list of content-defined chunks of a release file. See the module documentation
+    for the format.
+    """
+    def __init__(self, chunks, size, digest=None, chunker=None, chunk_digest=DEFAULT_CHUNK_DIGEST):
+        """
+        `chunks` is a list of tuples `(length, hexdigest)`. The other arguments
+        correspond to the fields of the JSON representation (see module documentation).
+        """
+        self.chunks = [ (int(l), str(h).lower()) for (l, h) in chunks ]
+        self.size = size
+        self.digest = digest
+        self.chunker = dict(chunker if chunker is not None else DEFAULT_CHUNKER_PARAMS)
+        self.chunk_digest = chunk_digest
+
+        if sum([ l for (l, h) in self.chunks ]) != self.size:
+            raise Updater4PyiError("Invalid chunk index: chunk lengths don't add up to the file size")
+        hashlib.new(self.chunk_digest)
+
+    @staticmethod
+    def parse(data):
+        """
+        Parse the JSON chunk index `data` (a string) and return a `ChunkIndex`
+        instance. Raises :py:exc:`upd_defs.Updater4PyiError` if the index is invalid.
+        """
+        try:
+            return ChunkIndex.from_dict(json.loads(data))
+        except ValueError as e:
+            raise Updater4PyiError("Invalid chunk index: %s" %(str(e)))
+
+    @staticmethod
+    def from_dict(d):
+        try:
+            return ChunkIndex(chunks=d['chunks'], size=int(d['size']), digest=d.get('digest', None),
+                              chunker=d.get('chunker', None),
+                              chunk_digest=d.get('chunk_digest', DEFAULT_CHUNK_DIGEST))
+        except (KeyError, TypeError, ValueError) as e:
+            raise Updater4PyiError("Invalid chunk index: %s" %(str(e)))
+
+    def to_dict(self):
+        return {
+            'size': self.size,
+            'digest': self.digest,
+            'chunker': self.chunker,
+            'chunk_digest': self.chunk_digest,
+            'chunks': [ [l, h] for (l, h) in self.chunks ],
+            }
+
+    def chunk_hexdigest(self, data):
+        return hashlib.new(self.chunk_digest, data).hexdigest()
+
+    def iter_offsets(self):
+        """
+        Yields tuples `(offset, length, hexdigest)` for each chunk, in order.
+        """
+        offset = 0
+        for (l, h) in self.chunks:
+            yield (offset, l, h)
+            offset += l
+
+
+    def find_local_chunks(self, seeds):
+        """
+        Find which of our chunks are available in local files.
+
+        `seeds` is a list of tuples `(filename, seed_index)`, where `seed_index` is the
+        known `ChunkIndex` of that file, or `None` if the file has to be scanned.
+
+        Returns a dictionary mapping chunk hex digests to tuples `(filename, offset)`.
+        """
+        wanted = set([ h for (l, h) in self.chunks ])
+        found = {}
+
+        for (fn, seed_index) in seeds:
+            if not os.path.isfile(fn):
+                continue
+            if seed_index is not None and seed_index.chunk_digest == self.chunk_digest:
+                for (offset, l, h) in seed_index.iter_offsets():
+                    if h in wanted and h not in found:
+                        found[h] = (fn, offset)
+                continue
+
+            logger.debug("scanning %s for reusable chunks", fn)
+            try:
+                with open(fn, 'rb') as f:
+                    offset = 0
+                    for data in iter_chunks(f, **self.chunker):
+                        h = self.chunk_hexdigest(data)
+                        if h in wanted and h not in found:
+                            found[h] = (fn, offset)
+                        offset += len(data)
+            except (IOError, OSError) as e:
+                logger.warning("Can't read %s: %s", fn, e)
+
+        return found
+
+
+    def rebuild(self, fdst, seeds, fetch_range, max_gap=0):
+        """
+        Rebuild the file described by this index into the open file `fdst` (which should
+        be opened for reading and writing), by copying the chunks found in the local files
+        `seeds` (see :py:meth:`find_local_chunks`), and fetching the other ones with
+        `fetch_range(first, last)`. The latter should return a file-like object with the
+        bytes `first` to `last` (inclusive) of the remote file, and raise an `IOError` on
+        failure.
+
+        Missing chunks which are less than `max_gap` bytes apart are fetched in a single
+        request.
+
+        Returns a tuple `(reused_bytes, fetched_bytes)`. Raises
+        :py:exc:`upd_defs.Updater4PyiError` if the rebuilt file is invalid, or `IOError`
+        if fetching data failed.
+        """
+
+        found = self.find_local_chunks(seeds)
+
+        fdst.seek(0)
+        fdst.truncate(self.size)
+
+        # copy the chunks we have locally
+        missing = []
+        reused = 0
+        seedfiles = {}
+        try:
+            for (offset, l, h) in self.iter_offsets():
+                data = None
+                if h in found:
+                    (fn, seedoffset) = found[h]
+                    if fn not in seedfiles:
+                        seedfiles[fn] = open(fn, 'rb')
+                    seedfiles[fn].seek(seedoffset)
+                    data = seedfiles[fn].read(l)
+                    if len(data) != l or self.chunk_hexdigest(data) != h:
+                        # the seed file changed under our feet
+                        data = None
+                if data is None:
+                    missing.append((offset, l, h))
+                    continue
+                fdst.seek(offset)
+                fdst.write(data)
+                reused += l
+        finally:
+            for sf in seedfiles.itervalues():
+                sf.close()
+
+        # coalesce the missing chunks into ranges
+        ranges = []
+        for (offset, l, h) in missing:
+            if ranges and offset - (ranges[-1][0] + ranges[-1][1]) <= max_gap:
+                ranges[-1] = (ranges[-1][0], offset + l - ranges[-1][0])
+            else:
+                ranges.append((offset, l))
+
+        logger.debug("chunk index: reusing %d bytes, fetching %d chunks in %d ranges",
+                     reused, len(missing), len(ranges))
+
+        fetched = 0
+        for (offset, l) in ranges:
+            fsrc = fetch_range(offset, offset + l - 1)
+            try:
+                data = fsrc.read(l)
+            finally:
+                fsrc.close()
+            if len(data) != l:
+                raise IOError("Short read fetching bytes %d-%d" %(offset, offset+l-1))
+            fdst.seek(offset)
+            fdst.write(data)
+            fetched += l
+
+        # check the fetched chunks and the full file
+        fdst.flush()
+        fdst.seek(0)
+        hasher = None
+        expected_hexdigest = None
+        if self.digest:
+            (hasher, expected_hexdigest) = util.digest_hasher(self.digest)
+        missing_offsets = set([ offset for (offset, l, h) in missing ])
+        for (offset, l, h) in self.iter_offsets():
+            data = fdst.read(l)
+            if hasher is not None:
+                hasher.update(data)
+            if offset in missing_offsets and self.chunk_hexdigest(data) != h:
+                raise Updater4PyiError("Fetched chunk at offset %d doesn't match the chunk index" %(offset))
+        if hasher is not None and hasher.hexdigest() != expected_hexdigest:
+            raise Updater4PyiError("File rebuilt from chunks doesn't match published digest")
+
+        return (reused, fetched)
+
+
+
+def make_chunk_index(fn, chunker=None, chunk_digest=DEFAULT_CHUNK_DIGEST, digest_algorithm='sha256'):
+    """
+    Utility for publishers: compute the chunk index of the file `fn`, and return it as a
+    dictionary which can be dumped as JSON (e.g. with `json.dump()`).
+    """
+    if chunker is None:
+        chunker = DEFAULT_CHUNKER_PARAMS
+
+    hasher = hashlib.new(digest_algorithm)
+    chunks = []
+    size = 0
+    with open(fn, 'rb') as f:
+        for data in iter_chunks(f, **chunker):
+            hasher.update(data)
+            chunks.append([len(data), hashlib.new(chunk_digest, data).hexdigest()])
+            size += len(data)
+
+    return {
+        'size': size,
+        'digest': digest_algorithm + ':' + hasher.hexdigest(),
+        'chunker': dict(chunker),
+        'chunk_digest': chunk_digest,
+        'chunks': chunks,
+        }
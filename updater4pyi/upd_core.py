@@ -44,6 +44,8 @@ import glob
 import subprocess
 import tempfile
 import shutil
+import hashlib
+import httplib
 
 from . import util
 from . import upd_version
@@ -51,6 +53,13 @@ from .upd_log import logger
 from .upd_defs import RELTYPE_UNKNOWN, RELTYPE_EXE, RELTYPE_ARCHIVE, RELTYPE_BUNDLE_ARCHIVE
 from .upd_defs import Updater4PyiError
 import upd_downloader
+from . import upd_delta
+from . import upd_manifest
+from . import upd_chunks
+from . import upd_archive
+from . import upd_async
+from . import upd_progress
+from . import upd_timing
 
 
 # --------------------------------
@@ -143,13 +152,22 @@ class Updater(object):
     This class needs to be specified a *source* for updates. See
     :py:class:`upd_source.UpdateSource`.
     """
-    def __init__(self, current_version, update_source):
+    def __init__(self, current_version, update_source, cache_dir=None, extract_workers=None):
         """
         Instantiates an `Updater`, with updates provided by the source `update_source` (a
         `upd_source.UpdateSource` subclass instance).
 
         The `current_version` is the current version string of the software, and will
         be provided to the `update_source`.
+
+        The `cache_dir` is a directory in which the updater may keep files between
+        updates (see :py:meth:`cache_dir`). By default, a directory specific to this
+        installation is chosen in the user's cache directory.
+
+        ZIP archives are extracted with `extract_workers` threads (see
+        :py:func:`upd_archive.extract_zip`). By default, the files are extracted one by
+        one. To extract with one thread per CPU, pass
+        :py:func:`upd_archive.default_extract_workers()`.
         """
 
         # sys._MEIPASS seems to be set all the time, even we don't self-extract.
@@ -163,6 +181,13 @@ class Updater(object):
         self._current_version = current_version
         self._file_to_update = determine_file_to_update()
 
+        self._cache_dir = cache_dir
+        self._extract_workers = extract_workers
+
+        self._progress_observers = []
+        self._timing_observers = []
+        self._last_timing_report = None
+
         super(Updater, self).__init__()
 
 
@@ -184,10 +209,96 @@ class Updater(object):
         """
         return self._file_to_update
 
+    def cache_dir(self):
+        """
+        Return the directory in which the updater keeps files between updates, such as
+        the previously downloaded release file for reusing chunks (see
+        :py:meth:`download_chunked`). The directory is not necessarily created yet.
+        """
+        if self._cache_dir is None:
+            fn = self._file_to_update.fn
+            self._cache_dir = os.path.join(util.user_cache_dir('updater4pyi'),
+                                           re.sub(r'[^\w.-]', '_', os.path.basename(fn)) + '-' +
+                                           hashlib.md5(util.utf8_str(fn)).hexdigest()[:8])
+        return self._cache_dir
+
+    def partial_download_store(self):
+        """
+        Return the :py:class:`upd_downloader.PartialDownloadStore` in which
+        :py:meth:`download_file` keeps partial downloads. It is located in the
+        :py:meth:`cache_dir`.
+        """
+        return upd_downloader.PartialDownloadStore(os.path.join(self.cache_dir(), 'partial'))
+
 
     # -------------------------------------------
 
 
+    def add_progress_observer(self, observer):
+        """
+        Register a callable `observer` which is called with a
+        :py:class:`upd_progress.ProgressInfo` argument as the update is being downloaded and
+        extracted by :py:meth:`install_update`.
+
+        Note that the observer is called from the thread which runs
+        :py:meth:`install_update` (or even from a download thread), so GUI interfaces
+        should forward the information to their main thread.
+        """
+        self._progress_observers.append(observer)
+
+    def remove_progress_observer(self, observer):
+        """
+        Unregister an observer previously registered with :py:meth:`add_progress_observer`.
+        """
+        self._progress_observers.remove(observer)
+
+    def _progress_tracker(self, phase, **kwargs):
+        return upd_progress.ProgressTracker(phase, observers=self._progress_observers, **kwargs)
+
+
+    def last_timing_report(self):
+        """
+        Return the :py:class:`upd_timing.TimingReport` of the last call to
+        :py:meth:`check_for_updates` or :py:meth:`install_update` which completed (or
+        failed), or `None`.
+        """
+        return self._last_timing_report
+
+    def add_timing_observer(self, observer):
+        """
+        Register a callable `observer` which is called with the
+        :py:class:`upd_timing.TimingReport` of each call to :py:meth:`check_for_updates`
+        and :py:meth:`install_update`, when it completes or fails. It is called from the
+        thread which ran the operation.
+        """
+        self._timing_observers.append(observer)
+
+    def remove_timing_observer(self, observer):
+        """
+        Unregister an observer previously registered with :py:meth:`add_timing_observer`.
+        """
+        self._timing_observers.remove(observer)
+
+    def _timed(self, operation, fn, *args):
+        report = upd_timing.TimingReport(operation)
+        error = None
+        try:
+            with upd_timing.reporting(report):
+                return fn(*args)
+        except BaseException as e:
+            error = (str(e) or type(e).__name__)
+            raise
+        finally:
+            report.finish(error)
+            self._last_timing_report = report
+            logger.debug("%s", report)
+            for observer in list(self._timing_observers):
+                try:
+                    observer(report)
+                except Exception:
+                    logger.exception("Exception in timing observer %r", observer)
+
+
     def check_for_updates(self):
         """
         Perform an update check.
@@ -196,9 +307,15 @@ class Updater(object):
         update is found, then a :py:class:`upd_source.BinReleaseInfo` object is returned,
         describing the software update. Otherwise, if no update is available, `None` is
         returned.
+
+        The time spent in the different phases of the check is recorded in a
+        :py:class:`upd_timing.TimingReport`, see :py:meth:`last_timing_report`.
         """
-        
-        releases = self._update_source.get_releases(newer_than_version=self._current_version)
+        return self._timed('check_for_updates', self._check_for_updates)
+
+    def _check_for_updates(self):
+        with upd_timing.phase(upd_timing.PHASE_SOURCE_QUERY):
+            releases = self._update_source.get_releases(newer_than_version=self._current_version)
 
         logger.debug("releases=%r" %(releases))
 
@@ -208,20 +325,21 @@ class Updater(object):
 
         wanted_reltype = self._file_to_update.reltype
 
-        # this is current version
-        curver = util.parse_version(self._current_version)
-
-        # select the releases that match our criteria;
-        # also sort the releases by version number.
-        rel_w_parsedversion = [(r, util.parse_version(r.get_version())) for r in releases]
-        releases2 = sorted([(rel, relparsedver)
-                            for (rel, relparsedver) in rel_w_parsedversion
-                            if (rel.get_reltype() == wanted_reltype and
-                                rel.get_platform() == util.simple_platform() and
-                                relparsedver > curver)
-                            ],
-                           key=lambda r2: r2[1],
-                           reverse=True);
+        with upd_timing.phase(upd_timing.PHASE_RELEASE_SELECTION):
+            # this is current version
+            curver = util.parse_version(self._current_version)
+
+            # select the releases that match our criteria;
+            # also sort the releases by version number.
+            rel_w_parsedversion = [(r, r.get_parsed_version()) for r in releases]
+            releases2 = sorted([(rel, relparsedver)
+                                for (rel, relparsedver) in rel_w_parsedversion
+                                if (rel.get_reltype() == wanted_reltype and
+                                    rel.get_platform() == util.simple_platform() and
+                                    relparsedver > curver)
+                                ],
+                               key=lambda r2: r2[1],
+                               reverse=True);
 
         if (releases2):
             # found release(s) which are strictly newer, and which satisfy our format requirements.
@@ -247,6 +365,10 @@ class Updater(object):
         def __init__(self, filetoupdate, needs_sudo, **kwargs):
             self.filetoupdate = filetoupdate
             self.needs_sudo = needs_sudo
+            # set by findextractto()
+            self.extractto = None
+            self.installto = None
+            self.extracttotemp = False
 
             super(Updater._ExtractLocation, self).__init__(**kwargs)
 
@@ -294,36 +416,57 @@ class Updater(object):
         :py:class:`upd_source.BinReleaseInfo` returned by :py:meth:`check_for_updates`.
 
         The actual updates are downloaded by calling :py:meth:`download_file`. You may
-        overload that function if you need to customize the download process. You may also
+        overload that function if you need to customize the download process. For
+        one-file executables, the update is first attempted to be rebuilt from a binary
+        delta patch with :py:meth:`download_delta`. For directory installations, if the
+        release publishes a file manifest (see :py:meth:`download_manifest`), only the
+        files which changed are downloaded. Otherwise, if the release publishes a chunk
+        index, the release file is rebuilt by reusing local data with
+        :py:meth:`download_chunked`. Otherwise, archives are extracted while they are
+        being downloaded, with :py:meth:`download_extract` (unless you customized
+        :py:meth:`download_file` or :py:meth:`verify_download`, which need the full
+        archive file). You may also
         override :py:meth:`verify_download` to implement some download integrity verification.
 
+        The progress of the download and of the extraction is reported to the observers
+        registered with :py:meth:`add_progress_observer`.
+
+        The time spent in the different phases of the installation is recorded in a
+        :py:class:`upd_timing.TimingReport`, see :py:meth:`last_timing_report`.
+
         This function does not return anything. If an error occurred,
         :py:exc:`upd_defs.Updater4PyiError` is raised.
         """
+        self._timed('install_update', self._install_update, rel_info)
+
+    def _install_update(self, rel_info):
 
         # first, save the file locally.
         tmpfile = tempfile.NamedTemporaryFile(mode='w+b', prefix='upd4pyi_tmp_', dir=None, delete=False)
 
         url = rel_info.get_url();
 
-        try:
-            self.download_file(url, tmpfile)
-        except IOError as e: 
-            if hasattr(e, 'code'): # HTTPError 
-                raise Updater4PyiError('Got HTTP error: %d %s' %(e.code, e.reason))
-            elif hasattr(e, 'reason'): # URLError 
-                raise Updater4PyiError('Connection error: %s' %(e.reason))
-            else:
-                raise Updater4PyiError('Error: %s' %(str(e)))
+        with upd_timing.phase(upd_timing.PHASE_DOWNLOAD):
+            (manifest, chunk_index, stagedir) = self._download_update(rel_info, tmpfile)
 
         #
         # Verify download integrity
         #
-        if (not self.verify_download(rel_info, tmpfile)):
+        if manifest is None and stagedir is None:
+            with upd_timing.phase(upd_timing.PHASE_VERIFY):
+                verified = self.verify_download(rel_info, tmpfile)
+        else:
+            verified = True
+        if not verified:
             logger.warning("Failed to download %s : download verification failed.", url);
-            os.unlink(tmpfile);
+            os.unlink(tmpfile.name);
             raise Updater4PyiError("Failed to download software update: verification failed.")
 
+        if chunk_index is not None and stagedir is None:
+            # keep this release file around, we'll reuse its chunks for the next update.
+            # (If the archive was extracted while downloading, there is no file to keep.)
+            self._save_chunk_seed(tmpfile.name, chunk_index)
+
         # at this point, file is downloaded and on disk.
 
         # the file/directory we have to update.
@@ -357,6 +500,10 @@ class Updater(object):
                 logger.debug("cleaning up maybe %s", tmpfile.name)
                 util.ignore_exc(lambda : os.unlink(tmpfile.name), OSError)
 
+            if stagedir is not None and os.path.exists(stagedir):
+                logger.debug("cleaning up maybe %s", stagedir)
+                util.ignore_exc(lambda : shutil.rmtree(stagedir), OSError)
+
             if extractloc is not None and extractloc.extracttotemp and os.path.exists(extractloc.extractto):
                 logger.debug("cleaning up maybe %s", extractloc.extractto)
                 util.ignore_exc(lambda : shutil.rmtree(extractloc.extractto), OSError)
@@ -366,7 +513,8 @@ class Updater(object):
         backupfilename = _backupname(filetoupdate.fn)
         if not needs_work_in_temp_dir:
             try:
-                os.rename(filetoupdate.fn, backupfilename);
+                with upd_timing.phase(upd_timing.PHASE_BACKUP_RENAME):
+                    os.rename(filetoupdate.fn, backupfilename);
             except OSError as e:
                 cleanuptempfiles();
                 raise Updater4PyiError("Failed to rename file %s!" %(str(e)))
@@ -408,7 +556,48 @@ class Updater(object):
 
                 logger.debug("extractloc: %r", extractloc.__dict__)
 
-                if (zipfile.is_zipfile(tmpfile.name)):
+                if manifest is not None:
+                    # partial update: build the new directory from the files we have
+                    # installed and the files which changed.
+                    basefn = os.path.basename(filetoupdate.fn)
+                    extractloc.findextractto(namelist=[basefn])
+                    extractto = extractloc.extractto
+
+                    # (the changed files are downloaded while the tree is being built)
+                    with upd_timing.phase(upd_timing.PHASE_DOWNLOAD):
+                        manifest.build_tree(
+                            localdir=(filetoupdate.fn if needs_work_in_temp_dir else backupfilename),
+                            destdir=os.path.join(extractto, basefn),
+                            fetch_file=lambda entry, fdst: self.download_file(entry.url, fdst,
+                                                                              size=entry.size,
+                                                                              digest=entry.digest),
+                            )
+
+                elif stagedir is not None:
+                    # the archive was already extracted while it was being downloaded, we
+                    # just need to move the files into place.
+                    names = os.listdir(stagedir)
+
+                    extractloc.findextractto(namelist=names)
+                    extractto = extractloc.extractto
+
+                    permdata = None
+                    if '_updater4pyi_metainf.json' in names:
+                        try:
+                            with open(os.path.join(stagedir, '_updater4pyi_metainf.json'), 'r') as f:
+                                permdata = json.load(f)
+                        except ValueError as e:
+                            logger.warning("Invalid JSON data in metainf file _updater4pyi_metainf.json: %s" %(str(e)))
+
+                    with upd_timing.phase(upd_timing.PHASE_EXTRACT):
+                        for name in names:
+                            if name in Updater.SPECIAL_ZIP_FILES:
+                                continue
+                            shutil.move(os.path.join(stagedir, name), os.path.join(extractto, name))
+
+                    _apply_metainf_permissions(permdata, filetoupdate.fn)
+
+                elif (zipfile.is_zipfile(tmpfile.name)):
                     # ZIP file
                     thezipfile = zipfile.ZipFile(tmpfile.name, 'r')
 
@@ -425,28 +614,16 @@ class Updater(object):
                         except ValueError as e:
                             logger.warning("Invalid JSON data in metainf file _updater4pyi_metainf.json: %s" %(str(e)))
 
-                    # iterate over files to extract with executable permissions set.
-                    for zinfo in thezipfile.infolist():
-                        if zinfo.filename in Updater.SPECIAL_ZIP_FILES:
-                            continue
-                        thezipfile.extract(zinfo, extractto)
-                        os.chmod(os.path.join(extractto, zinfo.filename), 0755) # make executable
                     thezipfile.close()
 
+                    # extract the files with executable permissions set.
+                    with upd_timing.phase(upd_timing.PHASE_EXTRACT):
+                        upd_archive.extract_zip(tmpfile.name, extractto, workers=self._extract_workers,
+                                                exclude=Updater.SPECIAL_ZIP_FILES, mode=0755,
+                                                progress=self._progress_tracker(upd_progress.PHASE_EXTRACT))
+
                     # override some permissions with a special metainfo file.
-                    if permdata and 'permissions' in permdata:
-                        for (pattern,perm) in permdata['permissions'].iteritems():
-                            logger.debug("pattern: %s to perms=%s" %(pattern, perm))
-                            # int(s, 0) converts s to int, parsing prefixes '0' (octal), '0x' (hex)
-                            # cf. http://stackoverflow.com/questions/604240/
-                            iperm = int(perm,0);
-                            for it in glob.iglob(os.path.join(filetoupdate.fn, pattern)):
-                                logger.debug("Changing permissions of %s to %#o" %(it, iperm))
-                                try:
-                                    os.chmod(it, iperm)
-                                except OSError:
-                                    logger.warning("Failed to set permissions to file %s. Ignoring." %(it));
-                                    pass
+                    _apply_metainf_permissions(permdata, filetoupdate.fn)
 
                     # remove the temporary downloaded file.
                     os.unlink(tmpfile.name)
@@ -459,8 +636,21 @@ class Updater(object):
                     extractloc.findextractto(namelist=thetarfile.getnames())
                     extractto = extractloc.extractto
 
-                    thezipfile.extractall(extractto)
-                    thezipfile.close()
+                    members = thetarfile.getmembers()
+                    progress = self._progress_tracker(upd_progress.PHASE_EXTRACT)
+                    progress.reset(0, sum([ m.size for m in members ]),
+                                   0, len([ m for m in members if m.isfile() ]))
+
+                    def members_with_progress():
+                        # extractall() asks for the next member once it has extracted this one.
+                        for m in members:
+                            yield m
+                            progress.add(m.size, (1 if m.isfile() else 0))
+
+                    with upd_timing.phase(upd_timing.PHASE_EXTRACT):
+                        thetarfile.extractall(extractto, members=members_with_progress())
+                    thetarfile.close()
+                    progress.finish()
 
                     # remove the temporary downloaded file.
                     os.unlink(tmpfile.name)
@@ -482,12 +672,13 @@ class Updater(object):
 
             else:
                 # make sure the file is executable
-                os.chmod(tmpfile.name,
-                         stat.S_IREAD|stat.S_IWRITE|stat.S_IEXEC|
-                         stat.S_IRUSR|stat.S_IWUSR|stat.S_IXUSR|
-                         stat.S_IRGRP|stat.S_IXGRP|
-                         stat.S_IROTH|stat.S_IXOTH
-                         )
+                with upd_timing.phase(upd_timing.PHASE_PERMISSIONS):
+                    os.chmod(tmpfile.name,
+                             stat.S_IREAD|stat.S_IWRITE|stat.S_IEXEC|
+                             stat.S_IRUSR|stat.S_IWUSR|stat.S_IXUSR|
+                             stat.S_IRGRP|stat.S_IXGRP|
+                             stat.S_IROTH|stat.S_IXOTH
+                             )
 
                 if not needs_work_in_temp_dir:
                     # following docs: these may be on different filesystems, and docs specify that os.rename()
@@ -501,9 +692,10 @@ class Updater(object):
             # do possibly the sudo install if needed
             if needs_work_in_temp_dir:
                 if util.is_linux() or util.is_macosx():
-                    res = util.run_as_admin([util.which('bash'),
-                                             util.resource_path('updater4pyi/installers/unix/do_install.sh'),
-                                             filetoupdate.fn, backupfilename, extractedfile, installto])
+                    with upd_timing.phase(upd_timing.PHASE_PRIVILEGED_INSTALL):
+                        res = util.run_as_admin([util.which('bash'),
+                                                 util.resource_path('updater4pyi/installers/unix/do_install.sh'),
+                                                 filetoupdate.fn, backupfilename, extractedfile, installto])
                     if (res != 0):
                         raise Updater4PyiError("Can't install the update to the final location %s!" %(installto))
                 elif util.is_win():
@@ -541,12 +733,14 @@ class Updater(object):
 
         except Exception:
             logger.error("Software Update Error: %s\n" %(str(sys.exc_info()[1])));
-            failure_cleanupandrestorebackup()
+            with upd_timing.phase(upd_timing.PHASE_CLEANUP):
+                failure_cleanupandrestorebackup()
             raise
 
         # cleaning up temp files
         logger.debug("cleaning up temp files")
-        cleanuptempfiles()
+        with upd_timing.phase(upd_timing.PHASE_CLEANUP):
+            cleanuptempfiles()
 
         # remove the backup.
         if not needs_work_in_temp_dir:
@@ -554,22 +748,87 @@ class Updater(object):
             if (reltype_is_dir):
                 logger.debug("removing backup directory %s", backupfilename)
                 try:
-                    shutil.rmtree(backupfilename)
+                    with upd_timing.phase(upd_timing.PHASE_REMOVE_BACKUP):
+                        shutil.rmtree(backupfilename)
                 except (OSError,IOError):
                     logger.warning("Failed to remove backup directory %s !", backupfilename)
                     # e.g. this might happen if the executable is on some filesystems such as sshfs
             else:
                 logger.debug("removing backup file %s", backupfilename)
                 try:
-                    os.unlink(backupfilename)
+                    with upd_timing.phase(upd_timing.PHASE_REMOVE_BACKUP):
+                        os.unlink(backupfilename)
                 except (OSError,IOError):
                     logger.warning("Failed to remove backup file %s !", backupfilename)
 
 
+    def _download_update(self, rel_info, tmpfile):
+        # get the update by the cheapest means: only the files which changed, a delta
+        # patch, the chunks we don't have yet, or the full file (extracted while it is
+        # downloaded if possible). Returns (manifest, chunk_index, stagedir).
+
+        url = rel_info.get_url();
+
+        manifest = None
+        chunk_index = None
+        stagedir = None
+        if self._file_to_update.reltype in (RELTYPE_ARCHIVE, RELTYPE_BUNDLE_ARCHIVE):
+            manifest = self.download_manifest(rel_info)
+
+        if manifest is not None:
+            # we'll only fetch the files which changed, no need for the full archive.
+            logger.debug("Updating with file manifest %s.", manifest.url)
+            tmpfile.close()
+        elif (self._file_to_update.reltype == RELTYPE_EXE and
+              self.download_delta(rel_info, tmpfile)):
+            # we rebuilt the new executable from the running one, no need for a full download.
+            logger.debug("Rebuilt update from a binary delta patch.")
+        else:
+            chunk_index = self.download_chunk_index(rel_info)
+            if (chunk_index is not None and
+                self.download_chunked(rel_info, chunk_index, tmpfile)):
+                logger.debug("Rebuilt update from chunks.")
+            else:
+                if (self._file_to_update.reltype in (RELTYPE_ARCHIVE, RELTYPE_BUNDLE_ARCHIVE) and
+                    self._can_extract_while_downloading()):
+                    # extract the archive as it comes in, into a staging directory
+                    stagedir = tempfile.mkdtemp(prefix='upd4pyi_tmp_stage_', dir=self._stage_dir_location())
+                    try:
+                        if self.download_extract(rel_info, stagedir):
+                            logger.debug("Extracted update while downloading it.")
+                            tmpfile.close()
+                            os.unlink(tmpfile.name)
+                        else:
+                            shutil.rmtree(stagedir)
+                            stagedir = None
+                    except (IOError, OSError, Updater4PyiError) as e:
+                        util.ignore_exc(lambda : shutil.rmtree(stagedir), OSError)
+                        util.ignore_exc(tmpfile.close)
+                        util.ignore_exc(lambda : os.unlink(tmpfile.name), OSError)
+                        raise _download_error(e)
+                if stagedir is None:
+                    try:
+                        self.download_file(url, tmpfile, size=rel_info.get_size(),
+                                           digest=rel_info.get_digest(),
+                                           **_mirrors_kwargs(rel_info))
+                    except (IOError, Updater4PyiError) as e:
+                        util.ignore_exc(tmpfile.close)
+                        util.ignore_exc(lambda : os.unlink(tmpfile.name), OSError)
+                        raise _download_error(e)
+
+        return (manifest, chunk_index, stagedir)
+
 
-    def download_file(self, theurl, fdst):
+    def download_file(self, theurl, fdst, size=None, digest=None, mirrors=None):
         """
         Download the file given at location `theurl` to the destination file `fdst`.
+        The expected `size` and `digest` of the file are given if they are known (see
+        :py:meth:`upd_source.BinReleaseInfo.get_size` and
+        :py:meth:`upd_source.BinReleaseInfo.get_digest`). If the same file is available
+        from other locations, they are given as the list `mirrors` (see
+        :py:meth:`upd_source.BinReleaseInfo.get_mirror_urls`); this argument is only
+        passed if there are any, so that reimplementations which don't support mirrors
+        keep working.
 
         You may reimplement this function to customize the download process. Check out
         `upd_downloader.url_opener` if you want to download stuff from an HTTPS url, it
@@ -577,21 +836,290 @@ class Updater(object):
 
         The default implementation downloads the file with the `upd_downloader` utility
         which provides secure downloads with certificate validation for HTTPS downloads.
+        Downloads are resumed after connection errors, and partial downloads are kept in
+        the :py:meth:`partial_download_store` to be resumed later if we give up. The size
+        and digest are checked as the data comes in (see
+        :py:class:`upd_downloader.DownloadVerifier`), and the progress is reported to the
+        progress observers (see :py:meth:`add_progress_observer`). With `mirrors`, the
+        file is downloaded from the location which responds fastest, continuing from
+        another one if it fails or stalls, and large files are fetched from several
+        locations at once (see :py:func:`upd_downloader.download`).
 
         This function should return nothing. If an error occurs, this function should
-        raise an `IOError`.
+        raise an `IOError`, or :py:exc:`upd_defs.Updater4PyiError` if the downloaded data
+        doesn't match the expected size or digest.
         """
 
         logger.debug("fetching URL %s to temp file %s ...", theurl, util.ignore_exc(lambda : fdst.name))
 
-        fdata = upd_downloader.url_opener.open(theurl);
-        shutil.copyfileobj(fdata, fdst)
-        fdata.close()
-        fdst.close()
+        upd_downloader.download(theurl, fdst, store=self.partial_download_store(),
+                                verifier=upd_downloader.DownloadVerifier(size=size, digest=digest),
+                                progress=self._progress_tracker(upd_progress.PHASE_DOWNLOAD,
+                                                                name=theurl, bytes_total=size),
+                                mirrors=mirrors)
 
         logger.debug("... done.")
 
 
+    def download_extract(self, rel_info, destdir):
+        """
+        Download the archive of the release `rel_info` and extract it into the directory
+        `destdir` while it is being downloaded (see :py:mod:`upd_archive`), so that
+        extracting the files overlaps with the download and the archive itself is never
+        stored. The size and digest of the archive are checked as it comes in.
+
+        Returns `True` if the archive was extracted, or `False` if it can't be extracted
+        sequentially, in which case the full archive should be downloaded instead (and
+        `destdir` may contain partially extracted files). Raises an `IOError` or
+        :py:exc:`upd_defs.Updater4PyiError` if the download or the extraction failed.
+        """
+
+        url = rel_info.get_url()
+
+        logger.debug("fetching URL %s and extracting to %s ...", url, destdir)
+
+        fstream = upd_downloader.DownloadStream(
+            url,
+            verifier=upd_downloader.DownloadVerifier(size=rel_info.get_size(), digest=rel_info.get_digest()),
+            progress=self._progress_tracker(upd_progress.PHASE_DOWNLOAD, name=url,
+                                            bytes_total=rel_info.get_size()),
+            mirrors=_mirror_urls(rel_info),
+            )
+        try:
+            names = upd_archive.extract_stream(fstream, destdir,
+                                               progress=self._progress_tracker(upd_progress.PHASE_EXTRACT))
+            # read the rest of the archive (e.g. a ZIP central directory), so that it is
+            # verified completely
+            while fstream.read(65536):
+                pass
+        except upd_archive.UnsupportedArchiveStream as e:
+            logger.warning("Can't extract %s while downloading it, will download full archive: %s",
+                           rel_info.get_filename(), e)
+            return False
+        finally:
+            fstream.close()
+
+        logger.debug("... done, extracted %d files.", len(names))
+        return True
+
+    def _can_extract_while_downloading(self):
+        # download_file() and verify_download() work on the full archive file, so if they
+        # were reimplemented, we need to store that file.
+        cls = type(self)
+        return (cls.download_file.__func__ is Updater.download_file.__func__ and
+                cls.verify_download.__func__ is Updater.verify_download.__func__)
+
+    def _stage_dir_location(self):
+        # extract next to the installation if possible, so that the files can be moved
+        # into place by simply renaming them.
+        d = os.path.dirname(self._file_to_update.fn)
+        if util.dirIsWritable(d):
+            return d
+        return None
+
+
+    def download_manifest(self, rel_info):
+        """
+        Fetch the file manifest of the release `rel_info`, if it publishes one (see
+        :py:meth:`upd_source.BinReleaseInfo.get_manifest_url` and :py:mod:`upd_manifest`).
+
+        Returns a :py:class:`upd_manifest.FileManifest` instance, or `None` if no
+        manifest is available or if it couldn't be fetched, in which case the full archive
+        should be downloaded instead.
+        """
+
+        manifest_url = rel_info.get_manifest_url()
+        if not manifest_url:
+            return None
+
+        logger.debug("fetching file manifest %s ...", manifest_url)
+
+        try:
+            fdata = upd_downloader.url_opener.open(manifest_url)
+            data = fdata.read()
+            fdata.close()
+            manifest = upd_manifest.FileManifest.parse(data, url=manifest_url)
+        except (IOError, httplib.HTTPException, Updater4PyiError) as e:
+            logger.warning("Can't use file manifest %s, will download full update: %s", manifest_url, e)
+            return None
+
+        if manifest.links and not hasattr(os, 'symlink'):
+            logger.debug("Can't create the symbolic links of file manifest %s, will download full update.",
+                         manifest_url)
+            return None
+
+        return manifest
+
+
+    def download_chunk_index(self, rel_info):
+        """
+        Fetch the chunk index of the release file of `rel_info`, if it publishes one (see
+        :py:meth:`upd_source.BinReleaseInfo.get_chunk_index_url` and
+        :py:mod:`upd_chunks`).
+
+        Returns a :py:class:`upd_chunks.ChunkIndex` instance, or `None` if no chunk index
+        is available or if it couldn't be fetched.
+        """
+
+        chunk_index_url = rel_info.get_chunk_index_url()
+        if not chunk_index_url:
+            return None
+
+        logger.debug("fetching chunk index %s ...", chunk_index_url)
+
+        try:
+            fdata = upd_downloader.url_opener.open(chunk_index_url)
+            data = fdata.read()
+            fdata.close()
+            return upd_chunks.ChunkIndex.parse(data)
+        except (IOError, httplib.HTTPException, Updater4PyiError) as e:
+            logger.warning("Can't use chunk index %s: %s", chunk_index_url, e)
+            return None
+
+
+    def download_chunked(self, rel_info, chunk_index, fdst):
+        """
+        Rebuild the release file of `rel_info` into `fdst` by reusing the chunks (see
+        :py:mod:`upd_chunks`) which we find in local files, and fetching only the
+        missing chunks with HTTP Range requests on the release file URL.
+
+        The chunks are looked for in the release file we installed last time (if it was
+        kept in the :py:meth:`cache_dir`) and, for one-file executables, in the executable
+        currently running.
+
+        Returns `True` if the new file was written to `fdst` (which is then closed), or
+        `False` if anything went wrong, in which case the full release file should be
+        downloaded instead.
+        """
+
+        url = rel_info.get_url()
+
+        if not chunk_index.digest:
+            chunk_index.digest = rel_info.get_digest()
+
+        seeds = []
+        seed = self._load_chunk_seed()
+        if seed is not None:
+            seeds.append(seed)
+        if self._file_to_update.reltype == RELTYPE_EXE:
+            seeds.append((self._file_to_update.fn, None))
+
+        try:
+            (reused, fetched) = chunk_index.rebuild(
+                fdst, seeds,
+                fetch_range=lambda first, last: upd_downloader.open_range(url, first, last),
+                )
+        except (IOError, httplib.HTTPException, Updater4PyiError) as e:
+            logger.warning("Failed to rebuild %s from chunks, will download full update: %s",
+                           rel_info.get_filename(), e)
+            fdst.seek(0)
+            fdst.truncate()
+            return False
+
+        fdst.close()
+
+        logger.debug("... done, reused %d bytes and fetched %d bytes.", reused, fetched)
+        return True
+
+
+    def _chunk_seed_files(self):
+        d = self.cache_dir()
+        return (os.path.join(d, 'chunkseed.bin'), os.path.join(d, 'chunkseed.json'))
+
+    def _load_chunk_seed(self):
+        (seedfn, seedjsonfn) = self._chunk_seed_files()
+        try:
+            with open(seedjsonfn, 'r') as f:
+                d = json.load(f)
+            st = os.stat(seedfn)
+            if st.st_size != d['size'] or abs(st.st_mtime - d['mtime']) > 1:
+                logger.debug("cached chunk seed %s changed, ignoring it", seedfn)
+                return None
+            return (seedfn, upd_chunks.ChunkIndex.from_dict(d['index']))
+        except (IOError, OSError, ValueError, KeyError, Updater4PyiError):
+            return None
+
+    def _save_chunk_seed(self, fn, chunk_index):
+        (seedfn, seedjsonfn) = self._chunk_seed_files()
+        try:
+            if not os.path.isdir(os.path.dirname(seedfn)):
+                os.makedirs(os.path.dirname(seedfn))
+            for x in (seedjsonfn, seedfn):
+                if os.path.exists(x):
+                    os.unlink(x)
+            util.link_or_copy(fn, seedfn)
+            st = os.stat(seedfn)
+            with open(seedjsonfn, 'w') as f:
+                json.dump({'size': st.st_size, 'mtime': st.st_mtime, 'index': chunk_index.to_dict()}, f)
+        except (IOError, OSError, shutil.Error) as e:
+            logger.warning("Can't keep release file for reusing chunks: %s", e)
+
+
+    def download_delta(self, rel_info, fdst):
+        """
+        Try to rebuild the release file of `rel_info` from the executable we are currently
+        running and a binary delta patch, instead of downloading the full release file.
+
+        This is only possible if the release advertises a delta patch (see
+        :py:meth:`upd_source.BinReleaseInfo.get_delta_patches`) from our current version,
+        and if it publishes a digest of the full release file (see
+        :py:meth:`upd_source.BinReleaseInfo.get_digest`). The rebuilt file is checked
+        against that digest.
+
+        Returns `True` if the new file was written to `fdst` (which is then closed), or
+        `False` if no suitable patch is available or if anything went wrong, in which case
+        the full release file should be downloaded instead.
+        """
+
+        digest = rel_info.get_digest()
+        if not digest:
+            logger.debug("No digest published for %s, not using delta patches.", rel_info.get_filename())
+            return False
+
+        curver = util.parse_version(self._current_version)
+        patches = [ p for p in rel_info.get_delta_patches()
+                    if util.parse_version(p.from_version) == curver ]
+        if not patches:
+            logger.debug("No delta patch available from version %s.", self._current_version)
+            return False
+
+        patchinfo = patches[0]
+
+        try:
+            (hasher, expected_hexdigest) = util.digest_hasher(digest)
+        except ValueError as e:
+            logger.warning("Can't use delta patch: %s", e)
+            return False
+
+        logger.debug("fetching delta patch %s ...", patchinfo.url)
+
+        try:
+            fpatch = upd_downloader.url_opener.open(patchinfo.url)
+            patchdata = fpatch.read()
+            fpatch.close()
+
+            with open(self._file_to_update.fn, 'rb') as f:
+                olddata = f.read()
+
+            newdata = upd_delta.apply_patch(olddata, patchdata)
+        except (IOError, httplib.HTTPException, Updater4PyiError) as e:
+            logger.warning("Failed to apply delta patch %s, will download full update: %s",
+                           patchinfo.filename, e)
+            return False
+
+        hasher.update(newdata)
+        if hasher.hexdigest() != expected_hexdigest:
+            logger.warning("File rebuilt from delta patch %s doesn't match published digest, "
+                           "will download full update.", patchinfo.filename)
+            return False
+
+        fdst.write(newdata)
+        fdst.close()
+
+        logger.debug("... done, rebuilt %d bytes from %d-byte patch.", len(newdata), len(patchdata))
+        return True
+
+
     def verify_download(self, rel_info, tmpfile):
         """
         Verify the integrity of the downloaded file. Return `True` if the download
@@ -607,17 +1135,56 @@ class Updater(object):
               where the file was downloaded. This function should in principle check
               the validity of the contents of this file.
 
-        You may reimplement this function to implement integrity check. The default
-        implementation does nothing and returns `True`.
+        You may reimplement this function to implement integrity check. The published
+        digest of the release file (see :py:meth:`upd_source.BinReleaseInfo.get_digest`)
+        has already been checked while the file was downloaded or rebuilt, so the default
+        implementation only checks the size of the file against
+        :py:meth:`upd_source.BinReleaseInfo.get_size`, if it is known.
 
         Don't raise arbitrary exceptions here because they might not be caught. You may
         raise :py:exc:`upd_defs.Updater4PyiError` for serious errors, though.
         """
-        # TODO: add support for GPG signing, MD5/SHA-1 checksum checks etc... ???
-        # Note: might not be necessary with secure https downloads with checked certificate
+        # TODO: add support for GPG signing ???
+        size = rel_info.get_size()
+        if size is not None and os.path.getsize(tmpfile.name) != size:
+            logger.warning("Downloaded file has %d bytes, expected %d.", os.path.getsize(tmpfile.name), size)
+            return False
         return True
 
 
+    # ---------------------------------------------------------------
+
+    # asynchronous versions, which don't block the caller
+
+    def check_for_updates_async(self):
+        """
+        Run :py:meth:`check_for_updates` in a background thread, and immediately return a
+        future for its result (see :py:func:`upd_async.run_in_thread`).
+        """
+        return upd_async.run_in_thread(self.check_for_updates)
+
+    def download_file_async(self, theurl, fdst, size=None, digest=None, mirrors=None):
+        """
+        Run :py:meth:`download_file` in a background thread, and immediately return a
+        future for its completion (see :py:func:`upd_async.run_in_thread`).
+        """
+        kwargs = ({'mirrors': mirrors} if mirrors else {})
+        return upd_async.run_in_thread(self.download_file, theurl, fdst, size=size, digest=digest,
+                                       **kwargs)
+
+    def install_update_async(self, rel_info):
+        """
+        Run :py:meth:`install_update` in a background thread, and immediately return a
+        future for its completion (see :py:func:`upd_async.run_in_thread`).
+
+        Note that on some platforms, :py:meth:`install_update` exits the program to let an
+        external utility finish the installation. The `SystemExit` exception is then
+        raised when the result of the future is retrieved, in the thread which retrieves
+        it.
+        """
+        return upd_async.run_in_thread(self.install_update, rel_info)
+
+
     # ---------------------------------------------------------------
 
     # utility: restart this application
@@ -666,6 +1233,56 @@ class Updater(object):
 # --------------------------------------------------------------
     
 
+def _download_error(e):
+    # the Updater4PyiError to raise for an error which occurred while downloading
+    if isinstance(e, Updater4PyiError):
+        return e
+    if hasattr(e, 'code'): # HTTPError 
+        return Updater4PyiError('Got HTTP error: %d %s' %(e.code, e.reason))
+    elif hasattr(e, 'reason'): # URLError 
+        return Updater4PyiError('Connection error: %s' %(e.reason))
+    else:
+        return Updater4PyiError('Error: %s' %(str(e)))
+
+
+def _mirror_urls(rel_info):
+    # the other locations of the release file, if rel_info knows about them
+    if not hasattr(rel_info, 'get_urls'):
+        return []
+    return rel_info.get_urls()[1:]
+
+def _mirrors_kwargs(rel_info):
+    # the `mirrors` argument for download_file(), only given if there are mirrors (see
+    # download_file())
+    mirrors = _mirror_urls(rel_info)
+    if not mirrors:
+        return {}
+    return {'mirrors': mirrors}
+
+
+def _apply_metainf_permissions(permdata, basedir):
+    # override some permissions of the files in basedir, as given in the special metainfo
+    # file.
+    if not permdata or 'permissions' not in permdata:
+        return
+    with upd_timing.phase(upd_timing.PHASE_PERMISSIONS):
+        _apply_permissions(permdata['permissions'], basedir)
+
+def _apply_permissions(permissions, basedir):
+    for (pattern,perm) in permissions.iteritems():
+        logger.debug("pattern: %s to perms=%s" %(pattern, perm))
+        # int(s, 0) converts s to int, parsing prefixes '0' (octal), '0x' (hex)
+        # cf. http://stackoverflow.com/questions/604240/
+        iperm = int(perm,0);
+        for it in glob.iglob(os.path.join(basedir, pattern)):
+            logger.debug("Changing permissions of %s to %#o" %(it, iperm))
+            try:
+                os.chmod(it, iperm)
+            except OSError:
+                logger.warning("Failed to set permissions to file %s. Ignoring." %(it));
+                pass
+
+
 def _backupname(filename):
     try_suffix = '.bkp'
     n = 1
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+#######################################################################################
+#                                                                                     #
+#   This file is part of the updater4pyi Project.                                     #
+#                                                                                     #
+#   Copyright (C) 2014, Philippe Faist                                                #
+#   philippe.faist@bluewin.ch                                                         #
+#   All rights reserved.                                                              #
+#                                                                                     #
+#   Redistribution and use in source and binary forms, with or without                #
+#   modification, are permitted provided that the following conditions are met:       #
+#                                                                                     #
+#   1. Redistributions of source code must retain the above copyright notice, this    #
+#      list of conditions and the following disclaimer.                               #
+#   2. Redistributions in binary form must reproduce the above copyright notice,      #
+#      this list of conditions and the following disclaimer in the documentation      #
+#      and/or other materials provided with the distribution.                         #
+#                                                                                     #
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND   #
+#   ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED     #
+#   WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE            #
+#   DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR   #
+#   ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES    #
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;      #
+#   LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND       #
+#   ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT        #
+#   (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS     #
+#   SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                      #
+#                                                                                     #
+#######################################################################################
+
+"""
+Utilities for binary delta updates.
+
+A *delta patch* describes how to rebuild the file of a new release from the file of an
+older release. For one-file executables (:py:const:`upd_defs.RELTYPE_EXE`), most of the
+bytes usually don't change between two point releases, so the patch is much smaller than
+the full release file.
+
+Patches are expected in the ``BSDIFF40`` format, as produced by the `bsdiff
+<http://www.daemonology.net/bsdiff/>`_ utility or by the `bsdiff4
+<https://pypi.python.org/pypi/bsdiff4>`_ python module (e.g. with
+``bsdiff4.file_diff('myapp-1.0-linux', 'myapp-1.1-linux', 'myapp-1.1-linux.from-1.0.bsdiff')``).
+
+If the `bsdiff4` module is available, it is used to apply the patches. Otherwise, a
+(slower) pure python implementation is used.
+"""
+
+import bz2
+import struct
+import itertools
+
+from .upd_defs import Updater4PyiError
+from .upd_log import logger
+
+
+# -----------------------------------------------------------------------------
+
+
+BSDIFF_MAGIC = 'BSDIFF40'
+
+_BSDIFF_HEADER_LEN = 32
+
+# size of the blocks in which we add the diff bytes to the old bytes.
+_ADD_BLOCK_SIZE = 4096
+
+
+def apply_patch(olddata, patchdata):
+    """
+    Apply the binary delta patch `patchdata` to the contents `olddata` of the old file, and
+    return the contents of the new file. All arguments and the return value are byte
+    strings.
+
+    If the patch is malformed, an :py:exc:`upd_defs.Updater4PyiError` is raised.
+    """
+
+    try:
+        import bsdiff4
+    except ImportError:
+        bsdiff4 = None
+
+    if bsdiff4 is not None:
+        try:
+            return bsdiff4.patch(olddata, patchdata)
+        except ValueError as e:
+            raise Updater4PyiError("Invalid delta patch: %s" %(str(e)))
+
+    logger.debug("bsdiff4 module not available, applying patch with pure python code")
+
+    return _apply_bsdiff_patch(olddata, patchdata)
+
+
+
+def _offtin(buf, pos):
+    # bsdiff stores 64-bit integers in little-endian sign-magnitude representation.
+    y = struct.unpack_from('<Q', buf, pos)[0]
+    if y & (1 << 63):
+        return -(y - (1 << 63))
+    return y
+
+
+def _apply_bsdiff_patch(olddata, patchdata):
+
+    if len(patchdata) < _BSDIFF_HEADER_LEN or patchdata[:8] != BSDIFF_MAGIC:
+        raise Updater4PyiError("Invalid delta patch: bad header")
+
+    ctrllen = _offtin(patchdata, 8)
+    difflen = _offtin(patchdata, 16)
+    newsize = _offtin(patchdata, 24)
+    if ctrllen < 0 or difflen < 0 or newsize < 0:
+        raise Updater4PyiError("Invalid delta patch: corrupt header")
+
+    ctrlstart = _BSDIFF_HEADER_LEN
+    diffstart = ctrlstart + ctrllen
+    extrastart = diffstart + difflen
+
+    try:
+        ctrl = bz2.decompress(patchdata[ctrlstart:diffstart])
+        diff = bz2.decompress(patchdata[diffstart:extrastart])
+        extra = bz2.decompress(patchdata[extrastart:])
+    except (IOError, EOFError, ValueError) as e:
+        raise Updater4PyiError("Invalid delta patch: can't decompress data: %s" %(str(e)))
+
+    newdata = bytearray(newsize)
+    oldpos = 0
+    newpos = 0
+    diffpos = 0
+    extrapos = 0
+
+    for i in xrange(0, len(ctrl) - len(ctrl) % 24, 24):
+        x = _offtin(ctrl, i)
+        y = _offtin(ctrl, i+8)
+        z = _offtin(ctrl, i+16)
+
+        if (x < 0 or y < 0 or newpos + x + y > newsize or
+            diffpos + x > len(diff) or extrapos + y > len(extra)):
+            raise Updater4PyiError("Invalid delta patch: corrupt control data")
+
+        # add x bytes of the diff block to the old data
+        newdata[newpos:newpos+x] = _add_bytes(olddata, oldpos, diff, diffpos, x)
+        newpos += x
+        oldpos += x
+        diffpos += x
+
+        # copy y bytes of the extra block
+        newdata[newpos:newpos+y] = extra[extrapos:extrapos+y]
+        newpos += y
+        extrapos += y
+
+        # seek in the old data
+        oldpos += z
+
+    if newpos != newsize:
+        raise Updater4PyiError("Invalid delta patch: truncated control data")
+
+    return str(newdata)
+
+
+def _add_bytes(olddata, oldpos, diff, diffpos, n):
+    # bytes outside of the old data count as zeros (as in the reference bspatch).
+    if oldpos >= 0 and oldpos + n <= len(olddata):
+        src = bytearray(olddata[oldpos:oldpos+n])
+    else:
+        src = bytearray(n)
+        lo = max(oldpos, 0)
+        hi = min(oldpos + n, len(olddata))
+        if lo < hi:
+            src[lo-oldpos:hi-oldpos] = olddata[lo:hi]
+
+    # the diff block is mostly zeros for unchanged regions, so only do the expensive
+    # byte-by-byte addition where necessary.
+    for k in xrange(0, n, _ADD_BLOCK_SIZE):
+        dblock = diff[diffpos+k:diffpos+min(k+_ADD_BLOCK_SIZE, n)]
+        if dblock.count('\0') == len(dblock):
+            continue
+        src[k:k+len(dblock)] = bytearray((a + b) & 0xff
+                                         for (a, b) in itertools.izip(src[k:k+len(dblock)],
+                                                                      bytearray(dblock)))
+
+    return src
@@ -39,14 +39,25 @@ and and `this solution <http://stackoverflow.com/a/14320202/1694896>`_ on Stack
 
 import logging
 
+import os
+import os.path
+import re
+import time
+import json
+import hashlib
+import threading
+import Queue
 import httplib
 import ssl
 import socket
 import shutil
+import urllib
 import urllib2
 
 from . import upd_version
 from . import util
+from . import upd_timing
+from .upd_defs import Updater4PyiError
 from .upd_log import logger
 
 
@@ -54,6 +65,200 @@ from .upd_log import logger
 
 CERT_FILE = util.resource_path('updater4pyi/cacert.pem');
 
+DEFAULT_POOL_MAX_IDLE_PER_HOST = 8
+"""
+The default maximum number of idle connections a :py:class:`ConnectionPool` keeps per host.
+"""
+
+DEFAULT_POOL_IDLE_TIMEOUT = 30
+"""
+The default number of seconds after which a :py:class:`ConnectionPool` no longer reuses an
+idle connection (servers usually close them at some point).
+"""
+
+
+class ConnectionPool(object):
+    """
+    A pool of idle HTTP(S) connections, which can be reused for further requests to the
+    same host ("keep-alive"), so that we don't pay for a new TCP connection and a new TLS
+    handshake for each request. Connections are taken out of the pool while they are
+    being used, so the pool may be shared by several threads.
+    """
+    def __init__(self, max_idle_per_host=DEFAULT_POOL_MAX_IDLE_PER_HOST,
+                 idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def get(self, key):
+        """
+        Take an idle connection for `key` (which identifies the connection class and the
+        host) out of the pool, or return `None` if there is none.
+        """
+        now = time.time()
+        with self._lock:
+            conns = self._idle.get(key, [])
+            while conns:
+                (conn, t) = conns.pop()
+                if now - t < self.idle_timeout:
+                    return conn
+                conn.close()
+        return None
+
+    def put(self, key, conn):
+        """
+        Give back a connection for `key`, whose last response was read completely.
+        """
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.max_idle_per_host:
+                conns.append((conn, time.time()))
+                return
+        conn.close()
+
+    def clear(self):
+        """
+        Close all idle connections.
+        """
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for conns in idle.values():
+            for (conn, t) in conns:
+                conn.close()
+
+
+connection_pool = ConnectionPool()
+"""
+The :py:class:`ConnectionPool` used by :py:data:`url_opener`.
+"""
+
+
+# NOTE: not derived from object, because urllib2's handlers are old-style classes and
+# object.__init__ would be found before theirs.
+class KeepAliveHandlerMixin:
+    """
+    Mixin for `urllib2.AbstractHTTPHandler` subclasses, which reuses connections from the
+    :py:data:`connection_pool` instead of opening a new connection for each request.
+
+    A connection goes back to the pool when its response has been read completely (or
+    when it is closed and there are only a few bytes left to read). If a request fails on
+    a reused connection, e.g. because the server has closed it in the meantime, it is
+    retried once on a new connection.
+    """
+
+    # if a response is closed with no more than this number of bytes not read, read them
+    # anyway so that the connection can be reused.
+    _DRAIN_MAX = 65536
+
+    def do_open(self, http_class, req, **http_conn_args):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items()
+                            if k not in headers))
+        headers["Connection"] = "keep-alive"
+        headers = dict(
+            (name.title(), val) for name, val in headers.items())
+
+        tunnel_headers = {}
+        if req._tunnel_host:
+            proxy_auth_hdr = "Proxy-Authorization"
+            if proxy_auth_hdr in headers:
+                tunnel_headers[proxy_auth_hdr] = headers[proxy_auth_hdr]
+                # Proxy-Authorization should not be sent to origin server.
+                del headers[proxy_auth_hdr]
+
+        key = (http_class, host, req._tunnel_host)
+
+        h = connection_pool.get(key)
+        while True:
+            reused = (h is not None)
+            if not reused:
+                h = http_class(host, timeout=req.timeout, **http_conn_args)
+                h.set_debuglevel(self._debuglevel)
+                if req._tunnel_host:
+                    h.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+            elif h.sock is not None:
+                h.sock.settimeout(req.timeout if req.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT
+                                  else socket.getdefaulttimeout())
+            try:
+                if not reused:
+                    # connect explicitly, so that the connection (and TLS handshake) is timed.
+                    with upd_timing.phase(upd_timing.PHASE_CONNECT):
+                        h.connect()
+                h.request(req.get_method(), req.get_selector(), req.data, headers)
+                try:
+                    r = h.getresponse(buffering=True)
+                except TypeError: # buffering kw not supported
+                    r = h.getresponse()
+                break
+            except (socket.error, httplib.HTTPException) as err:
+                h.close()
+                if reused and not req.has_data():
+                    # the server probably closed this idle connection; try a new one.
+                    logger.debug("reused connection to %s failed (%s), reconnecting", host, err)
+                    h = None
+                    continue
+                if isinstance(err, socket.error):
+                    raise urllib2.URLError(err)
+                raise
+
+        # see urllib2.AbstractHTTPHandler.do_open()
+        pr = _PooledResponse(r, h, key, self._DRAIN_MAX)
+        fp = socket._fileobject(pr, close=True)
+
+        resp = urllib.addinfourl(fp, r.msg, req.get_full_url())
+        resp.code = r.status
+        resp.msg = r.reason
+        return resp
+
+
+class _PooledResponse(object):
+    # gives the connection back to the pool once the response has been read.
+    def __init__(self, r, conn, key, drain_max):
+        self.r = r
+        self.conn = conn
+        self.key = key
+        self.drain_max = drain_max
+
+    def recv(self, n):
+        data = self.r.read(n)
+        if self.r.isclosed():
+            self._release()
+        return data
+
+    read = recv
+
+    def close(self):
+        if self.conn is None:
+            return
+        if (not self.r.isclosed() and not self.r.will_close and self.r.length is not None and
+            self.r.length <= self.drain_max):
+            try:
+                self.r.read()
+            except (socket.error, httplib.HTTPException):
+                pass
+        if self.r.isclosed():
+            self._release()
+            return
+        self.r.close()
+        self.conn.close()
+        self.conn = None
+
+    def _release(self):
+        if self.conn is None:
+            return
+        if self.r.will_close:
+            self.conn.close()
+        else:
+            connection_pool.put(self.key, self.conn)
+        self.conn = None
+
+
 class ValidHTTPSConnection(httplib.HTTPConnection):
     """
     HTTPS connection based on httplib.HTTPConnection, with complete certificate validation
@@ -86,10 +291,18 @@ class ValidHTTPSConnection(httplib.HTTPConnection):
                                     cert_reqs=ssl.CERT_REQUIRED)
 
 
-class ValidHTTPSHandler(urllib2.HTTPSHandler):
+class KeepAliveHTTPHandler(KeepAliveHandlerMixin, urllib2.HTTPHandler):
+    """
+    A HTTP urllib2 handler which reuses connections (see :py:class:`KeepAliveHandlerMixin`).
+    """
+    pass
+
+
+class ValidHTTPSHandler(KeepAliveHandlerMixin, urllib2.HTTPSHandler):
     """
     A HTTPS urllib2 handler using :py:class:`ValidHttpsConnection`, i.e. with correct
-    server certificate validation.
+    server certificate validation. Connections are reused (see
+    :py:class:`KeepAliveHandlerMixin`).
     """
 
     def https_open(self, req):
@@ -97,12 +310,1067 @@ class ValidHTTPSHandler(urllib2.HTTPSHandler):
 
 
 
-url_opener = urllib2.build_opener(ValidHTTPSHandler)
+url_opener = urllib2.build_opener(KeepAliveHTTPHandler, ValidHTTPSHandler)
 """
 The URL opener obtained with `urllib2.build_opener`, with valid HTTPS server certificate
-validation.
+validation, and which reuses connections (see :py:data:`connection_pool`). It may be used
+by several threads at once.
 """
 
 # add a User-agent header
 url_opener.addheaders = [('User-agent', 'Updater4Pyi-SoftwareUpdater %s'%(upd_version.version_str))]
 
+
+
+# ------------------------------------------------------------------------
+
+
+def open_range(url, first, last=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+    """
+    Open the URL `url` and return a file-like object which reads the bytes `first` to
+    `last` (inclusive) of the remote file, or until the end of the file if `last` is
+    `None`. This uses an HTTP Range request, or a plain seek for ``file:`` URLs. The
+    `timeout` (in seconds) applies to the connection and to each read.
+
+    Raises an `IOError` (or `urllib2.URLError`) if the server does not honor the range
+    request.
+    """
+
+    if url.startswith('file:'):
+        f = open(urllib.url2pathname(url[len('file:'):]), 'rb')
+        f.seek(first)
+        if last is None:
+            return f
+        return _LimitedReader(f, last - first + 1)
+
+    req = urllib2.Request(url, headers={
+        'Range': 'bytes=%d-%s' %(first, (str(last) if last is not None else '')),
+        })
+    fdata = url_opener.open(req, timeout=timeout)
+    if fdata.getcode() != 206:
+        fdata.close()
+        raise IOError("Server does not support range requests for %s" %(url))
+    return fdata
+
+
+class _LimitedReader(object):
+    def __init__(self, f, n):
+        self.f = f
+        self.remaining = n
+
+    def read(self, n=-1):
+        if n < 0 or n > self.remaining:
+            n = self.remaining
+        data = self.f.read(n)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+
+# ------------------------------------------------------------------------
+
+
+DEFAULT_RETRIES = 5
+"""
+The default number of times a download is resumed after a connection error, before
+giving up.
+"""
+
+DEFAULT_MAX_SEGMENTS = 6
+"""
+The default maximum number of parallel connections used to download a single file. See
+:py:class:`SegmentedFetch`.
+"""
+
+DEFAULT_SEGMENTED_MIN_SIZE = 4*1024*1024
+"""
+Files smaller than this (in bytes) are downloaded with a single connection.
+"""
+
+_BLOCK_SIZE = 65536
+
+DEFAULT_PREFETCH_SIZE = 8*1024*1024
+"""
+A :py:class:`DownloadStream` downloads up to this number of bytes ahead of the reader.
+"""
+
+DEFAULT_PROBE_TIMEOUT = 5
+"""
+The default number of seconds :py:func:`probe_mirrors` waits for the locations of a file to
+respond.
+"""
+
+DEFAULT_STALL_TIMEOUT = 30
+"""
+When a file can be downloaded from several locations (mirrors), a connection which didn't
+receive any data for this number of seconds is considered stalled, and the download
+continues from another location.
+"""
+
+
+def probe_mirrors(urls, timeout=DEFAULT_PROBE_TIMEOUT):
+    """
+    Find out which of the `urls`, which are all locations of the same file, responds
+    fastest. All locations are probed at once, by fetching the first byte of the file
+    (which also leaves an open connection to each of them in the
+    :py:data:`connection_pool`).
+
+    Returns the list of `urls` ordered by the time it took to get that byte. Locations
+    which failed or didn't respond within `timeout` seconds come last, in their original
+    order, as they may still be used if all others fail.
+    """
+    urls = _unique(urls)
+    if len(urls) < 2:
+        return urls
+
+    latencies = {}
+    cond = threading.Condition()
+    timing = upd_timing.current_report()
+
+    def probe(url):
+        with upd_timing.reporting(timing):
+            t0 = time.time()
+            try:
+                f = open_range(url, 0, 0, timeout=timeout)
+                try:
+                    f.read()
+                finally:
+                    f.close()
+                latency = time.time() - t0
+            except (IOError, httplib.HTTPException) as e:
+                logger.debug("location %s failed to respond: %s", url, e)
+                latency = None
+        with cond:
+            latencies[url] = latency
+            cond.notify_all()
+
+    for url in urls:
+        t = threading.Thread(target=probe, args=(url,))
+        t.daemon = True
+        t.start()
+
+    deadline = time.time() + timeout
+    with cond:
+        while len(latencies) < len(urls):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            cond.wait(remaining)
+        latencies = dict(latencies)
+
+    fast = sorted([ u for u in urls if latencies.get(u) is not None ], key=lambda u: latencies[u])
+    logger.debug("probed locations: %s", ", ".join([ "%s (%s)" %(u, ("%.3f s" %(latencies[u])
+                                                                     if latencies.get(u) is not None
+                                                                     else "failed"))
+                                                     for u in urls ]))
+    return fast + [ u for u in urls if latencies.get(u) is None ]
+
+
+def _unique(urls):
+    seen = set()
+    return [ u for u in urls if not (u in seen or seen.add(u)) ]
+
+
+def _source_timeout(sources, stall_timeout):
+    # with several locations to choose from, don't wait forever for a stalled connection
+    if len(sources) > 1 and stall_timeout is not None:
+        return stall_timeout
+    return socket._GLOBAL_DEFAULT_TIMEOUT
+
+
+def _mixable(verifier):
+    # data from different locations of a file is only put together if the digest of the
+    # file is known, so that a location which has a different file is caught.
+    return verifier is not None and bool(verifier.digest)
+
+
+class DownloadVerifier(object):
+    """
+    Checks the size and the digest of a file as it is being downloaded, so that the file
+    doesn't have to be read again afterwards.
+
+    The expected `size` (in bytes) and `digest` (``'<algorithm>:<hexdigest>'``, see
+    :py:func:`util.digest_hasher`) may each be `None` if unknown. Data which goes beyond
+    the expected size is rejected as soon as it is received.
+
+    All checks raise :py:exc:`upd_defs.Updater4PyiError` if they fail.
+    """
+    def __init__(self, size=None, digest=None):
+        self.size = size
+        self.digest = digest
+        self.reset()
+
+    def reset(self):
+        """
+        Start over, e.g. because the download restarts from the beginning.
+        """
+        self.received = 0
+        self.hasher = None
+        if self.digest:
+            try:
+                (self.hasher, self.expected_hexdigest) = util.digest_hasher(self.digest)
+            except ValueError as e:
+                raise Updater4PyiError("Can't verify download: %s" %(e))
+
+    def check_size(self, size):
+        """
+        Check the size announced by the server, e.g. in a `Content-Length` header (which
+        may be `None` if there was none).
+        """
+        if self.size is not None and size is not None and size != self.size:
+            raise Updater4PyiError("Download has wrong size: %d bytes instead of %d"
+                                   %(size, self.size))
+
+    def update(self, data):
+        """
+        Account for the next `data` of the file.
+        """
+        self.received += len(data)
+        if self.size is not None and self.received > self.size:
+            raise Updater4PyiError("Download is larger than the expected %d bytes" %(self.size))
+        if self.hasher is not None:
+            self.hasher.update(data)
+
+    def update_from_file(self, f, n):
+        """
+        Account for the next `n` bytes of the file, which are read from the open file `f`.
+        """
+        while n > 0:
+            buf = f.read(min(n, _BLOCK_SIZE))
+            if not buf:
+                raise IOError("Unexpected end of file %s" %(util.ignore_exc(lambda : f.name)))
+            self.update(buf)
+            n -= len(buf)
+
+    def finish(self):
+        """
+        Check that the whole file was received and that it matches the expected digest.
+        """
+        if self.size is not None and self.received != self.size:
+            raise Updater4PyiError("Download is incomplete: got %d of %d bytes"
+                                   %(self.received, self.size))
+        if self.hasher is not None and self.hasher.hexdigest() != self.expected_hexdigest:
+            raise Updater4PyiError("Download doesn't match the published checksum (%s)" %(self.digest))
+
+
+
+def download(url, fdst, store=None, retries=DEFAULT_RETRIES, verifier=None, progress=None,
+             mirrors=None, stall_timeout=DEFAULT_STALL_TIMEOUT):
+    """
+    Download the file at `url` into the open file `fdst`, which is closed at the end.
+
+    If a :py:class:`PartialDownloadStore` is given as `store`, HTTP(S) downloads are
+    resumable: the data is first downloaded into the store, and resumed with HTTP Range
+    requests after a connection error (up to `retries` times), or the next time this
+    function is called for the same URL if we gave up. The complete file is then moved to
+    the location of `fdst`.
+
+    If a :py:class:`DownloadVerifier` is given, the data is checked while it is being
+    downloaded. If a :py:class:`upd_progress.ProgressTracker` is given as `progress`, it
+    is informed of the data as it comes in.
+
+    The same file may be available from other locations, given as a list of `mirrors`.
+    They are all probed first (see :py:func:`probe_mirrors`), and the file is downloaded
+    from the one which responds fastest. If the download fails, or if no data was received
+    for `stall_timeout` seconds, it continues from the next location. Large files are
+    fetched from several locations at once (see :py:class:`SegmentedFetch`). Data from
+    different locations is only put together if the digest of the file is known (see
+    :py:class:`DownloadVerifier`), otherwise switching to another location starts the
+    download over.
+
+    Raises an `IOError` (or `urllib2.URLError`) if the download failed, or
+    :py:exc:`upd_defs.Updater4PyiError` if the verification failed.
+    """
+    sources = _unique([url] + list(mirrors or []))
+    if len(sources) > 1:
+        with upd_timing.phase(upd_timing.PHASE_MIRROR_PROBE):
+            sources = probe_mirrors(sources)
+
+    if store is None or not re.match(r'^https?:', url, re.IGNORECASE):
+        try:
+            for (i, source) in enumerate(sources):
+                try:
+                    _download_plain(source, fdst, verifier, progress,
+                                    timeout=_source_timeout(sources, stall_timeout))
+                    if verifier is not None:
+                        verifier.finish()
+                    break
+                except (IOError, httplib.HTTPException, Updater4PyiError) as e:
+                    if i == len(sources) - 1:
+                        raise
+                    logger.warning("Download from %s failed (%s), trying %s", source, e, sources[i+1])
+                    fdst.seek(0)
+                    fdst.truncate()
+        finally:
+            fdst.close()
+        if progress is not None:
+            progress.finish()
+        return
+
+    partfn = store.fetch(url, retries=retries, verifier=verifier, progress=progress, sources=sources,
+                         stall_timeout=stall_timeout)
+
+    fdst.close()
+    shutil.move(partfn, fdst.name)
+    store.discard(url)
+
+
+def _download_plain(url, fdst, verifier, progress, timeout):
+    fdata = url_opener.open(url, timeout=timeout)
+    try:
+        size = fdata.info().getheader('Content-Length')
+        size = (int(size) if size and size.isdigit() else None)
+        if verifier is not None:
+            verifier.reset()
+            verifier.check_size(size)
+        if progress is not None:
+            progress.reset(0, size)
+        while True:
+            buf = fdata.read(_BLOCK_SIZE)
+            if not buf:
+                break
+            if verifier is not None:
+                verifier.update(buf)
+            fdst.write(buf)
+            if progress is not None:
+                progress.add(len(buf))
+    finally:
+        fdata.close()
+
+
+
+class DownloadStream(object):
+    """
+    A file-like object which reads the file at `url` sequentially, while it is being
+    downloaded by a background thread, up to `prefetch_size` bytes ahead of the
+    reader. This way, whatever the reader does with the data (e.g. extracting it) overlaps
+    with the download.
+
+    Connection errors are retried up to `retries` times, resuming the download with an HTTP
+    Range request where it was interrupted. If a :py:class:`DownloadVerifier` is given, the
+    data is checked as it comes in, and the last :py:meth:`read` raises
+    :py:exc:`upd_defs.Updater4PyiError` if the check fails. If a
+    :py:class:`upd_progress.ProgressTracker` is given as `progress`, it is informed of the
+    data as it is downloaded.
+
+    The file may also be downloaded from the other locations given as `mirrors`, as with
+    :py:func:`download`: the fastest location is used, and the download continues from
+    another one if it fails or stalls for `stall_timeout` seconds (resuming where it was
+    interrupted only if the digest of the file is known).
+
+    Errors are raised by :py:meth:`read`. Always call :py:meth:`close` when done.
+    """
+    def __init__(self, url, verifier=None, retries=DEFAULT_RETRIES,
+                 prefetch_size=DEFAULT_PREFETCH_SIZE, progress=None, mirrors=None,
+                 stall_timeout=DEFAULT_STALL_TIMEOUT):
+        self.url = url
+        self.sources = _unique([url] + list(mirrors or []))
+        self.stall_timeout = stall_timeout
+        self.verifier = (verifier if verifier is not None else DownloadVerifier())
+        self.progress = progress
+        self.retries = retries
+        self.timing = upd_timing.current_report()
+        self.queue = Queue.Queue(maxsize=max(1, prefetch_size // _BLOCK_SIZE))
+        self.buf = ''
+        self.eof = False
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def read(self, n=-1):
+        chunks = [self.buf]
+        have = len(self.buf)
+        while not self.eof and (n < 0 or have < n):
+            item = self.queue.get()
+            if item is None:
+                self.eof = True
+            elif isinstance(item, Exception):
+                self.eof = True
+                raise item
+            else:
+                chunks.append(item)
+                have += len(item)
+        data = ''.join(chunks)
+        if n < 0:
+            self.buf = ''
+            return data
+        self.buf = data[n:]
+        return data[:n]
+
+    def close(self):
+        self.closed.set()
+        # unblock the download thread, in case it's waiting for room in the queue
+        try:
+            while True:
+                self.queue.get_nowait()
+        except Queue.Empty:
+            pass
+        self.thread.join()
+
+    def _put(self, item):
+        while not self.closed.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+        raise _StreamClosed()
+
+    def _run(self):
+        try:
+            with upd_timing.reporting(self.timing):
+                self._download()
+            self._put(None)
+        except _StreamClosed:
+            pass
+        except Exception as e:
+            try:
+                self._put(e)
+            except _StreamClosed:
+                pass
+
+    def _download(self):
+        sources = self.sources
+        if len(sources) > 1:
+            with upd_timing.phase(upd_timing.PHASE_MIRROR_PROBE):
+                sources = probe_mirrors(sources)
+        timeout = _source_timeout(sources, self.stall_timeout)
+        source = sources[0]
+        # the location the data we have so far came from
+        origin = None
+        pos = 0
+        size = None
+        validator = None
+        attempt = 0
+        failures = 0
+        while True:
+            try:
+                req = urllib2.Request(source)
+                if pos:
+                    req.add_header('Range', 'bytes=%d-' %(pos))
+                    if source == origin:
+                        req.add_header('If-Range', validator)
+                    logger.debug("resuming download of %s at byte %d from %s", self.url, pos, source)
+                fdata = url_opener.open(req, timeout=timeout)
+                try:
+                    headers = fdata.info()
+                    if pos:
+                        crange = _parse_content_range(headers.getheader('Content-Range'))
+                        if fdata.getcode() != 206 or crange is None or crange[0] != pos:
+                            if source != origin:
+                                raise IOError("Can't resume download of %s from %s" %(self.url, source))
+                            raise Updater4PyiError("File %s changed on the server while downloading it"
+                                                   %(self.url))
+                        if size is not None and crange[2] is not None and crange[2] != size:
+                            raise IOError("%s has a different file (%d bytes instead of %d)"
+                                          %(source, crange[2], size))
+                    else:
+                        origin = source
+                        etag = headers.getheader('ETag')
+                        validator = ((etag if etag and not etag.startswith('W/') else None) or
+                                     headers.getheader('Last-Modified'))
+                        size = headers.getheader('Content-Length')
+                        size = (int(size) if size and size.isdigit() else None)
+                        self.verifier.reset()
+                        self.verifier.check_size(size)
+                        if self.progress is not None:
+                            self.progress.reset(0, size)
+                    while True:
+                        buf = fdata.read(_BLOCK_SIZE)
+                        if not buf:
+                            break
+                        self.verifier.update(buf)
+                        pos += len(buf)
+                        if self.progress is not None:
+                            self.progress.add(len(buf))
+                        self._put(buf)
+                finally:
+                    fdata.close()
+                if size is not None and pos < size:
+                    raise IOError("Connection closed while fetching %s" %(source))
+                self.verifier.finish()
+                if self.progress is not None:
+                    self.progress.finish()
+                return
+            except urllib2.HTTPError as e:
+                if e.code < 500 and len(sources) == 1:
+                    raise
+                err = e
+            except (IOError, httplib.HTTPException) as e:
+                err = e
+            if len(sources) > 1 and (not pos or _mixable(self.verifier)):
+                failures += 1
+                if failures % len(sources):
+                    # try the next location right away
+                    logger.warning("Download from %s failed (%s), continuing from %s",
+                                   source, err, sources[failures % len(sources)])
+                    source = sources[failures % len(sources)]
+                    continue
+                # all locations failed, start over with the fastest one after a while
+                if isinstance(err, urllib2.HTTPError) and err.code < 500:
+                    raise err
+                source = sources[0]
+            elif not validator or not re.match(r'^https?:', source, re.IGNORECASE):
+                # can't resume
+                raise IOError("Download of %s failed: %s" %(self.url, err))
+            attempt += 1
+            if attempt > self.retries:
+                raise IOError("Download of %s failed after %d attempts: %s" %(self.url, attempt, err))
+            delay = min(2**attempt, 30)
+            logger.warning("Download of %s interrupted (%s), resuming in %d seconds", self.url, err, delay)
+            time.sleep(delay)
+
+
+class _StreamClosed(Exception):
+    pass
+
+
+
+class PartialDownloadStore(object):
+    """
+    Keeps partially downloaded files in a directory, so that interrupted downloads can be
+    resumed later, even after the program was restarted.
+
+    A partial download is kept along with the validators the server sent for it (ETag,
+    Last-Modified, size). It is only resumed if the server confirms that the file did not
+    change (with an `If-Range` request header); otherwise the download starts over.
+    """
+
+    MAX_AGE_DAYS = 30
+    """
+    Partial downloads which were not touched for this number of days are removed.
+    """
+
+    def __init__(self, directory, max_segments=DEFAULT_MAX_SEGMENTS,
+                 segmented_min_size=DEFAULT_SEGMENTED_MIN_SIZE, stripe_mirrors=True):
+        """
+        Partial downloads are kept in `directory`.
+
+        Files of at least `segmented_min_size` bytes are downloaded with up to
+        `max_segments` parallel connections, if the server supports range requests (see
+        :py:class:`SegmentedFetch`). Set `max_segments` to 1 to disable this.
+
+        If the file is available from several locations, the parallel connections are
+        spread over all of them, unless `stripe_mirrors` is `False`, in which case the
+        other locations are only used if the fastest one fails.
+        """
+        self.directory = directory
+        self.max_segments = max_segments
+        self.segmented_min_size = segmented_min_size
+        self.stripe_mirrors = stripe_mirrors
+
+    def _files(self, url):
+        key = hashlib.sha1(util.utf8_str(url)).hexdigest()
+        return (os.path.join(self.directory, key+'.part'), os.path.join(self.directory, key+'.json'))
+
+    def _load_info(self, url):
+        (partfn, infofn) = self._files(url)
+        try:
+            with open(infofn, 'r') as f:
+                info = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if not isinstance(info, dict) or info.get('url') != url or not os.path.exists(partfn):
+            return None
+        return info
+
+    def _save_info(self, url, info):
+        (partfn, infofn) = self._files(url)
+        with open(infofn, 'w') as f:
+            json.dump(info, f)
+
+    def discard(self, url):
+        """
+        Forget about any partial download of `url`.
+        """
+        for fn in self._files(url):
+            if os.path.exists(fn):
+                try:
+                    os.unlink(fn)
+                except OSError as e:
+                    logger.warning("Can't remove %s: %s", fn, e)
+
+    def prune(self):
+        """
+        Remove partial downloads which are older than :py:attr:`MAX_AGE_DAYS`.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        limit = time.time() - self.MAX_AGE_DAYS*86400
+        for fn in os.listdir(self.directory):
+            fullfn = os.path.join(self.directory, fn)
+            try:
+                if os.path.getmtime(fullfn) < limit:
+                    os.unlink(fullfn)
+            except OSError:
+                pass
+
+    def fetch(self, url, retries=DEFAULT_RETRIES, verifier=None, progress=None, sources=None,
+              stall_timeout=DEFAULT_STALL_TIMEOUT):
+        """
+        Download (or finish downloading) `url` into the store, and return the name of the
+        file with the complete contents. The file stays in the store until
+        :py:meth:`discard` is called.
+
+        The file is downloaded from the locations listed in `sources`, in order of
+        preference (see :py:func:`probe_mirrors`), or just from `url` if `sources` is
+        `None`. If a location fails, or if a connection to it didn't receive any data for
+        `stall_timeout` seconds, the download continues from the next one.
+
+        Connection errors are retried up to `retries` times, with an increasing delay.
+
+        If a :py:class:`DownloadVerifier` is given, the data is checked while it is being
+        downloaded. If the check fails, the partial download is discarded and
+        :py:exc:`upd_defs.Updater4PyiError` is raised. If a
+        :py:class:`upd_progress.ProgressTracker` is given as `progress`, it is informed of
+        the data as it is downloaded.
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.prune()
+
+        sources = list(sources or [url])
+        # after a verification failure, the locations left to try one by one
+        untried = None
+
+        attempt = 0
+        failures = 0
+        while True:
+            try:
+                partfn = self._fetch_once(url, verifier, progress, sources,
+                                          _source_timeout(sources, stall_timeout))
+                if progress is not None:
+                    progress.finish()
+                return partfn
+            except Updater4PyiError as e:
+                self.discard(url)
+                if untried is None and len(sources) > 1:
+                    # one of the locations may have a different file, so use them
+                    # separately from now on
+                    untried = list(sources)
+                if not untried:
+                    raise
+                logger.warning("Download of %s failed (%s), downloading it again from %s only",
+                               url, e, untried[0])
+                sources = [untried.pop(0)]
+                (attempt, failures) = (0, 0)
+                continue
+            except urllib2.HTTPError as e:
+                if e.code < 500 and len(sources) == 1:
+                    # client error -- no point in retrying
+                    raise
+                err = e
+            except (IOError, httplib.HTTPException) as e:
+                err = e
+            if len(sources) > 1:
+                failures += 1
+                # try the next location right away
+                sources = sources[1:] + sources[:1]
+                if failures % len(sources):
+                    logger.warning("Download of %s from %s failed (%s), continuing from %s",
+                                   url, sources[-1], err, sources[0])
+                    continue
+                if isinstance(err, urllib2.HTTPError) and err.code < 500:
+                    # all locations gave a client error
+                    raise err
+            attempt += 1
+            if attempt > retries:
+                raise IOError("Download of %s failed after %d attempts: %s" %(url, attempt, err))
+            delay = min(2**attempt, 30)
+            logger.warning("Download of %s interrupted (%s), resuming in %d seconds", url, err, delay)
+            time.sleep(delay)
+
+    def _fetch_once(self, url, verifier, progress=None, sources=None,
+                    timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        (partfn, infofn) = self._files(url)
+
+        if verifier is None:
+            # still makes sure we don't miss a truncated download
+            verifier = DownloadVerifier()
+
+        if not sources:
+            sources = [url]
+        source = sources[0]
+
+        info = self._load_info(url)
+        if (info is not None and info.get('source', url) != source and
+            not _mixable(verifier)):
+            # we can't tell whether this location has the same file as the one we
+            # started with
+            logger.debug("can't resume download of %s from %s, starting over", url, source)
+            self.discard(url)
+            info = None
+
+        if info is not None and info.get('segments') is not None:
+            # resume a segmented download
+            SegmentedFetch(self, url, info, verifier=verifier, progress=progress, sources=sources,
+                           timeout=timeout).run()
+            verifier.finish()
+            return partfn
+
+        have = (os.path.getsize(partfn) if info is not None else 0)
+
+        req = urllib2.Request(source)
+        if have:
+            req.add_header('Range', 'bytes=%d-' %(have))
+            if info.get('validator') and info.get('source', url) == source:
+                req.add_header('If-Range', info['validator'])
+            logger.debug("resuming download of %s at byte %d from %s", url, have, source)
+
+        try:
+            fdata = url_opener.open(req, timeout=timeout)
+        except urllib2.HTTPError as e:
+            if e.code == 416 and info is not None and info.get('size') == have:
+                # we already have the full file.
+                verifier.reset()
+                with open(partfn, 'rb') as f:
+                    verifier.update_from_file(f, have)
+                verifier.finish()
+                if progress is not None:
+                    progress.reset(have, have)
+                return partfn
+            if e.code == 416:
+                self.discard(url)
+            raise
+
+        try:
+            headers = fdata.info()
+            crange = None
+            if have and fdata.getcode() == 206:
+                crange = _parse_content_range(headers.getheader('Content-Range'))
+
+            if (crange is not None and crange[0] == have and
+                (info.get('size') is None or crange[2] is None or crange[2] == info['size'])):
+                mode = 'ab'
+                # account for the data we already have
+                verifier.reset()
+                verifier.check_size(info.get('size'))
+                with open(partfn, 'rb') as f:
+                    verifier.update_from_file(f, have)
+                if progress is not None:
+                    progress.reset(have, info.get('size'))
+            else:
+                # fresh download: either we didn't have anything, or the server sent the
+                # full file (e.g. because it changed)
+                mode = 'wb'
+                have = 0
+                size = headers.getheader('Content-Length')
+                etag = headers.getheader('ETag')
+                info = {
+                    'url': url,
+                    'source': source,
+                    'size': (int(size) if size and size.isdigit() else None),
+                    # weak ETags can't be used in If-Range
+                    'validator': ((etag if etag and not etag.startswith('W/') else None) or
+                                  headers.getheader('Last-Modified')),
+                    }
+                self._save_info(url, info)
+                verifier.reset()
+                verifier.check_size(info['size'])
+                if progress is not None:
+                    progress.reset(0, info['size'])
+
+                if (self.max_segments > 1 and info['size'] is not None and info['validator'] and
+                    info['size'] >= self.segmented_min_size and
+                    'bytes' in (headers.getheader('Accept-Ranges') or '').lower()):
+                    # large file, and the server supports ranges: use parallel connections
+                    info['segments'] = [[0, info['size']-1]]
+                    self._save_info(url, info)
+                    with open(partfn, 'wb') as f:
+                        f.truncate(info['size'])
+                    fetch = SegmentedFetch(self, url, info, first_response=fdata, verifier=verifier,
+                                           progress=progress, sources=sources, timeout=timeout)
+                    fdata = None
+                    fetch.run()
+                    verifier.finish()
+                    return partfn
+
+            with open(partfn, mode) as f:
+                while True:
+                    buf = fdata.read(_BLOCK_SIZE)
+                    if not buf:
+                        break
+                    verifier.update(buf)
+                    f.write(buf)
+                    if progress is not None:
+                        progress.add(len(buf))
+        finally:
+            if fdata is not None:
+                fdata.close()
+
+        if info.get('size') is not None and os.path.getsize(partfn) != info['size']:
+            raise IOError("Incomplete download: got %d of %d bytes" %(os.path.getsize(partfn), info['size']))
+
+        verifier.finish()
+        return partfn
+
+
+
+class SegmentedFetch(object):
+    """
+    Downloads a file of a :py:class:`PartialDownloadStore` with several parallel
+    connections, each fetching a byte range (a *segment*) of the file and writing it
+    straight to its offset in the preallocated partial file.
+
+    The download starts with a single connection. As long as adding a connection improves
+    the measured overall throughput, the largest remaining segment is split in two and a
+    new connection fetches its second half, up to the store's `max_segments`
+    connections. A connection which is done with its segment takes over the second half of
+    the largest remaining segment in the same way.
+
+    The remaining segments are saved in the store, so that the download can be resumed.
+
+    If the file is available from several locations (`sources`, the first of which is the
+    one `first_response` comes from), new connections go to each of them in turn, unless
+    the store's `stripe_mirrors` is `False`. If a connection fails, or doesn't receive any
+    data for `timeout` seconds, its segment is continued from another location. Data is
+    only fetched from other locations than the one the download started with if the
+    verifier knows the digest of the file.
+
+    If a :py:class:`DownloadVerifier` is given, the part of the file which is complete
+    from its beginning is fed to it as the download progresses. If a
+    :py:class:`upd_progress.ProgressTracker` is given as `progress`, it is informed of the
+    data received on all connections.
+    """
+
+    MEASURE_INTERVAL = 1.0
+    """
+    Interval (in seconds) at which the throughput is measured and connections are added.
+    """
+
+    MIN_SPEEDUP = 1.1
+    """
+    We keep adding connections as long as the throughput improves by this factor.
+    """
+
+    MIN_SEGMENT_SIZE = 1024*1024
+    """
+    Segments are not split into parts smaller than this (in bytes).
+    """
+
+    def __init__(self, store, url, info, first_response=None, verifier=None, progress=None,
+                 sources=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        self.store = store
+        self.url = url
+        self.info = info
+        self.origin = info.get('source', url)
+        if sources and _mixable(verifier):
+            self.sources = list(sources)
+        else:
+            self.sources = [self.origin]
+        self.failed_sources = set()
+        self.next_source = 0
+        self.timeout = timeout
+        (self.partfn, _) = store._files(url)
+        # segments are lists [next_byte_to_fetch, last_byte]
+        self.segments = [ list(seg) for seg in info['segments'] if seg[0] <= seg[1] ]
+        self.first_response = first_response
+        self.lock = threading.Lock()
+        self.total = 0
+        self.errors = []
+        self.discarded = False
+        self.verifier = verifier
+        self.verified_upto = 0
+        self.progress = progress
+        self.timing = upd_timing.current_report()
+
+    def run(self):
+        """
+        Download all the segments. Raises an `IOError` if a connection failed.
+        """
+        workers = []
+        if self.verifier is not None:
+            self.verifier.reset()
+        if self.progress is not None:
+            remaining = sum([ seg[1] - seg[0] + 1 for seg in self.segments ])
+            self.progress.reset(self.info['size'] - remaining, self.info['size'])
+        try:
+            for seg in self.segments:
+                if self.first_response is not None:
+                    workers.append(self._start(seg, self.first_response, self.sources[0]))
+                    self.next_source = 1
+                    self.first_response = None
+                else:
+                    workers.append(self._start(seg, None, self._pick_source()))
+
+            last_time = time.time()
+            last_total = 0
+            last_rate = None
+            growing = True
+            while [ w for w in workers if w.is_alive() ]:
+                time.sleep(0.05)
+                self._verify_completed()
+                now = time.time()
+                if now - last_time < self.MEASURE_INTERVAL:
+                    continue
+                with self.lock:
+                    rate = (self.total - last_total) / (now - last_time)
+                    (last_time, last_total) = (now, self.total)
+                    if not growing or self.errors:
+                        continue
+                    if last_rate is not None and rate < last_rate * self.MIN_SPEEDUP:
+                        logger.debug("segmented download: %d connections, %.0f bytes/s, not adding more",
+                                     len([ w for w in workers if w.is_alive() ]), rate)
+                        growing = False
+                        continue
+                    last_rate = rate
+                    if len([ w for w in workers if w.is_alive() ]) >= self.store.max_segments:
+                        continue
+                    newseg = self._split_largest()
+                if newseg is not None:
+                    workers.append(self._start(newseg, None, self._pick_source()))
+        finally:
+            if self.first_response is not None:
+                self.first_response.close()
+            for w in workers:
+                w.join()
+            if not self.discarded:
+                with self.lock:
+                    self.info['segments'] = [ seg for seg in self.segments if seg[0] <= seg[1] ]
+                self.store._save_info(self.url, self.info)
+
+        if self.errors:
+            raise self.errors[0]
+
+        self._verify_completed()
+
+    def _verify_completed(self):
+        # feed the verifier with what's complete from the start of the file. Everything
+        # before the first byte still to be fetched of any segment has been written.
+        if self.verifier is None:
+            return
+        with self.lock:
+            upto = min([ seg[0] for seg in self.segments if seg[0] <= seg[1] ] or [self.info['size']])
+        if upto > self.verified_upto:
+            with open(self.partfn, 'rb') as f:
+                f.seek(self.verified_upto)
+                self.verifier.update_from_file(f, upto - self.verified_upto)
+            self.verified_upto = upto
+
+    def _split_largest(self):
+        # call with self.lock held
+        seg = max(self.segments, key=lambda sg: sg[1] - sg[0])
+        remaining = seg[1] - seg[0] + 1
+        if remaining < 2*self.MIN_SEGMENT_SIZE:
+            return None
+        mid = seg[0] + remaining // 2
+        newseg = [mid, seg[1]]
+        seg[1] = mid - 1
+        self.segments.append(newseg)
+        return newseg
+
+    def _pick_source(self):
+        # the location for a new connection: the next one in turn when striping, otherwise
+        # the preferred one. Returns None if all locations failed.
+        with self.lock:
+            sources = [ src for src in self.sources if src not in self.failed_sources ]
+            if not sources:
+                return None
+            if not self.store.stripe_mirrors:
+                return sources[0]
+            src = sources[self.next_source % len(sources)]
+            self.next_source += 1
+            return src
+
+    def _start(self, seg, fdata, source):
+        t = threading.Thread(target=self._fetch_segment, args=(seg, fdata, source))
+        t.daemon = True
+        t.start()
+        return t
+
+    def _fetch_segment(self, seg, fdata, source):
+        with upd_timing.reporting(self.timing):
+            while True:
+                err = self._fetch_segment_data(seg, fdata, source)
+                fdata = None
+                if err is None:
+                    with self.lock:
+                        if self.errors or self.discarded:
+                            return
+                        # done early: take over half of what's left of the largest segment,
+                        # so that a slower connection doesn't hold up the end of the download
+                        seg = self._split_largest()
+                    if seg is None:
+                        return
+                    continue
+                with self.lock:
+                    self.failed_sources.add(source)
+                    discarded = self.discarded
+                if not discarded:
+                    failed_source = source
+                    source = self._pick_source()
+                    if source is not None:
+                        logger.warning("Download of %s from %s failed (%s), continuing from %s",
+                                       self.url, failed_source, err, source)
+                        continue
+                with self.lock:
+                    self.errors.append(err)
+                return
+
+    def _fetch_segment_data(self, seg, fdata, source):
+        # returns None if the segment was fetched, or the error which occurred
+        try:
+            if source is None:
+                raise IOError("No location left to download %s from" %(self.url))
+            if fdata is None:
+                fdata = self._open_segment(seg, source)
+            # unbuffered, so that the verifier reads what we wrote
+            with open(self.partfn, 'r+b', 0) as f:
+                f.seek(seg[0])
+                while True:
+                    with self.lock:
+                        n = min(_BLOCK_SIZE, seg[1] + 1 - seg[0])
+                    if n <= 0:
+                        break
+                    buf = fdata.read(n)
+                    if not buf:
+                        raise IOError("Connection closed while fetching %s" %(source))
+                    f.write(buf)
+                    with self.lock:
+                        seg[0] += len(buf)
+                        self.total += len(buf)
+                    if self.progress is not None:
+                        self.progress.add(len(buf))
+        except (IOError, httplib.HTTPException) as e:
+            return (e if isinstance(e, IOError) else IOError(str(e)))
+        finally:
+            if fdata is not None:
+                fdata.close()
+        return None
+
+    def _open_segment(self, seg, source):
+        headers = {'Range': 'bytes=%d-%d' %(seg[0], seg[1])}
+        if source == self.origin:
+            headers['If-Range'] = self.info['validator']
+        req = urllib2.Request(source, headers=headers)
+        fdata = url_opener.open(req, timeout=self.timeout)
+        crange = _parse_content_range(fdata.info().getheader('Content-Range'))
+        if fdata.getcode() != 206 or crange is None or crange[0] != seg[0]:
+            fdata.close()
+            if source != self.origin:
+                raise IOError("Can't fetch a part of %s from %s" %(self.url, source))
+            # the file changed on the server, start over.
+            with self.lock:
+                self.discarded = True
+            self.store.discard(self.url)
+            raise IOError("File %s changed on the server" %(self.url))
+        if crange[2] is not None and crange[2] != self.info['size']:
+            fdata.close()
+            raise IOError("%s has a different file (%d bytes instead of %d)"
+                          %(source, crange[2], self.info['size']))
+        return fdata
+
+
+
+def _parse_content_range(value):
+    # 'bytes first-last/total', where total may be '*'. Returns (first, last, total) or None.
+    if not value:
+        return None
+    m = re.match(r'^\s*bytes\s+(\d+)-(\d+)/(\d+|\*)\s*$', value)
+    if m is None:
+        return None
+    return (int(m.group(1)), int(m.group(2)), (int(m.group(3)) if m.group(3) != '*' else None))
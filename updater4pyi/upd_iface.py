@@ -36,6 +36,8 @@ import os.path
 import datetime
 
 from . import util
+from . import upd_async
+from . import upd_progress
 from .upd_defs import Updater4PyiError
 from .upd_log import logger
 
@@ -126,7 +128,11 @@ class UpdateConsoleInterface(UpdateInterface):
             #
             # yes, install update
             #
-            self.updater.install_update(upd_info)
+            self.updater.add_progress_observer(self._show_progress)
+            try:
+                self.updater.install_update(upd_info)
+            finally:
+                self.updater.remove_progress_observer(self._show_progress)
             #
             # update installed.
             #
@@ -144,6 +150,17 @@ class UpdateConsoleInterface(UpdateInterface):
             print ""
         
         
+    def _show_progress(self, info):
+        what = ("Downloading" if info.phase == upd_progress.PHASE_DOWNLOAD else "Extracting")
+        fraction = info.fraction()
+        line = "%s: %s%s" %(what, ("%3d%% " %(fraction*100) if fraction is not None else ""), info)
+        # overwrite the previous progress line
+        sys.stdout.write("\r" + line.ljust(78))
+        if info.finished:
+            sys.stdout.write("\n")
+        sys.stdout.flush()
+
+
     def _ynprompt(self, msg):
         yn = raw_input(msg)
         return re.match(r'\s*y(es)?\s*', yn, re.IGNORECASE) is not None
@@ -290,18 +307,27 @@ class UpdateGenericGuiInterface(UpdateInterface):
             return
 
         try:
-            self.do_check_for_updates()
-        finally:
+            self.do_check_for_updates(callback=self._update_check_done)
+        except:
             self.schedule_next_update_check()
+            raise
+
+
+    def _update_check_done(self, result):
+        self.schedule_next_update_check()
 
 
-    def do_check_for_updates(self):
+    def do_check_for_updates(self, callback=None):
         """
         Actually perform the udpate check. Call this function if you want to force an
         update check even though it's not yet due. If you want to periodically possibly
         check only if a check is due, then call `check_for_updates()` instead.
 
-        Returns:
+        The user is prompted with `ask_first_time_async()`, `ask_to_update_async()` and
+        `ask_to_restart_async()`, so the check may well complete only after this function
+        has returned, once the user has answered. When the check is complete, `callback` is
+        called (if not `None`) with the result, which is:
+
             - `None` if we asked the user for the first time if they want to check
               regularly for updates, and they refused.
             - `False` if no new update is available
@@ -311,75 +337,137 @@ class UpdateGenericGuiInterface(UpdateInterface):
                 - `(False, rel_info)` if the user declined to install the update now
             - the tuple `(False, None, error_str)` if an error occurred while checking
               for updates.
+
+        If the check completed before this function returns (e.g. if the prompts are
+        answered synchronously), the result is also returned. Otherwise, `None` is returned.
         """
         if self.is_currently_checking:
+            if callback is not None:
+                callback(None)
             return None
-        try:
-            self.is_currently_checking = True
 
-            # check for updates
+        self.is_currently_checking = True
 
+        # state of this update check, shared by the steps below
+        state = {'done': False, 'result': None}
+
+        def cleanup():
+            state['done'] = True
+            try:
+                self.last_check = datetime.datetime.now()
+                self.save_settings({'last_check': self.last_check})
+            finally:
+                self.is_currently_checking = False
+
+        def finish(result):
+            if state['done']:
+                return
+            state['result'] = result
+            cleanup()
+            if callback is not None:
+                callback(result)
+
+        def step(fn, *args):
+            # run one step of the update check, taking care of errors.
+            try:
+                fn(*args)
+            except Updater4PyiError as e:
+                if state['done']:
+                    raise
+                logger.warning("Error while checking for updates: %s", e)
+                finish((False, None, unicode(e)))
+            except Exception as e:
+                if state['done']:
+                    raise
+                # e.g. a connection error which wasn't turned into an Updater4PyiError. Don't
+                # let it escape into the GUI toolkit, and make sure the callback runs so that
+                # the next check is scheduled.
+                logger.exception("Unexpected error while checking for updates")
+                finish((False, None, unicode(e)))
+            except:
+                # e.g. SystemExit, if the program exits to let the update be installed
+                if not state['done']:
+                    cleanup()
+                raise
+
+        def start():
             if (self.ask_before_checking and not self.asked_before_checking):
                 # ask before we check.
                 logger.debug("UpdateGenericGuiInteface: this is the first time. Let's ask the user "
                              "if (s)he's cool with us auto-updating..")
-                answer = self.ask_first_time()
-                self.setCheckForUpdatesEnabled(answer, save=False);
-                self.asked_before_checking = True
-                self.save_settings({
-                    'asked_before_checking': True,
-                    'check_for_updates_enabled': answer,
-                    })
-                if (answer != True):
-                    logger.debug("UpdateGenericGuiInterface: are told not to check for updates.");
-                    return None
-
-            rel_info = self.updater.check_for_updates()
+                self.ask_first_time_async(lambda answer: step(got_first_time_answer, answer))
+                return
+            check()
+
+        def got_first_time_answer(answer):
+            self.setCheckForUpdatesEnabled(answer, save=False);
+            self.asked_before_checking = True
+            self.save_settings({
+                'asked_before_checking': True,
+                'check_for_updates_enabled': answer,
+                })
+            if (answer != True):
+                logger.debug("UpdateGenericGuiInterface: are told not to check for updates.");
+                finish(None)
+                return
+            check()
+
+        def check():
+            self.run_in_background_async(self.updater.check_for_updates, (),
+                                         lambda future: step(got_check_result, future))
+
+        def got_check_result(future):
+            rel_info = future.result()
 
             if (rel_info is None):
                 # no updates.
                 logger.debug("UpdateGenericGuiInterface: No updates available.")
-                return False
+                finish(False)
+                return
 
             logger.debug("Update (version %s) is available.", rel_info.get_version())
 
             #
             # There's an update, prompt the user.
             #
-            if self.ask_to_update(rel_info):
-                #
-                # yes, install update
-                #
-                # make sure we save our settings now in case we restart later
-                #
-                self.save_settings()
-                #
-                # And actually install the update.
-                #
-                self.updater.install_update(rel_info)
-                self.update_installed = True
-                #
-                # update installed.
-                #
-                if self.ask_to_restart():
-                    self.updater.restart_app()
-                    return (True, rel_info) # whatever, our app will have exited anyway
+            self.ask_to_update_async(rel_info,
+                                     lambda answer: step(got_update_answer, rel_info, answer))
 
+        def got_update_answer(rel_info, answer):
+            if not answer:
+                logger.debug("UpdateGenericGuiInterface: Not installing update.")
                 # return to the main program.
-                return (True, rel_info)
+                finish((False, rel_info))
+                return
+            #
+            # yes, install update
+            #
+            # make sure we save our settings now in case we restart later
+            #
+            self.save_settings()
+            #
+            # And actually install the update.
+            #
+            self.run_in_background_async(self.updater.install_update, (rel_info,),
+                                         lambda future: step(got_install_result, rel_info, future))
 
-            logger.debug("UpdateGenericGuiInterface: Not installing update.")
-            # return to the main program.
-            return (False, rel_info)
-        
-        except Updater4PyiError as e:
-            logger.warning("Error while checking for updates: %s", e)
-            return (False, None, unicode(e))
-            
-        finally:
-            self.last_check = datetime.datetime.now()
-            self.save_settings({'last_check': self.last_check})
-            self.is_currently_checking = False
+        def got_install_result(rel_info, future):
+            future.result()
+            self.update_installed = True
+            #
+            # update installed.
+            #
+            self.ask_to_restart_async(lambda answer: step(got_restart_answer, rel_info, answer))
+
+        def got_restart_answer(rel_info, answer):
+            if answer:
+                self.updater.restart_app()
+            # return to the main program. (whatever, if we restarted, our app will have
+            # exited anyway)
+            finish((True, rel_info))
+
+        step(start)
+        return state['result']
 
 
     def is_check_now_due(self, tolerance=datetime.timedelta(days=0, seconds=10)):
@@ -395,6 +483,7 @@ class UpdateGenericGuiInterface(UpdateInterface):
         if self.is_currently_checking:
             logger.debug("UpdateGenericGuiInteface: Not scheduling update check because we're currently "
                          "checking for updates!")
+            return
 
         if (self.is_initial_delay):
             self.set_timeout_check(self.init_check_delay)
@@ -416,8 +505,77 @@ class UpdateGenericGuiInterface(UpdateInterface):
 
 
 
+    def run_in_background(self, fn, *args, **kwargs):
+        """
+        Call `fn(*args, **kwargs)` and return its result (or raise its exception). This is
+        used for the calls which may block for a long time, i.e. querying the update source
+        and downloading and installing the update.
+
+        The default implementation simply calls the function. GUI interfaces should rather
+        reimplement `run_in_background_async()`, so that the application stays responsive
+        while `fn` runs.
+        """
+        return fn(*args, **kwargs)
+
+
+    def run_in_background_async(self, fn, args, callback):
+        """
+        Call `fn(*args)` like `run_in_background()`, but don't wait for it: `callback` is
+        called with a future (see :py:func:`upd_async.new_future`) once `fn` is done, from
+        which the result is obtained with `future.result()` (which raises `fn`'s exception,
+        if any). This is what `do_check_for_updates()` uses.
+
+        GUI interfaces should reimplement this function to start `fn` in a worker thread and
+        to return immediately, calling `callback` from the GUI thread once the worker has
+        finished. The default implementation calls `run_in_background()` and then
+        `callback`.
+        """
+        future = upd_async.new_future()
+        try:
+            result = self.run_in_background(fn, *args)
+        except BaseException:
+            future.set_exception(sys.exc_info()[1])
+        else:
+            future.set_result(result)
+        callback(future)
+
+
+    def ask_first_time_async(self, callback):
+        """
+        Prompt the user whether they want to regularly look for updates, and call `callback`
+        with the answer (`True` or `False`) once they have answered.
+
+        GUI interfaces should reimplement this function to show a non-blocking dialog and
+        call `callback` when the user is done with it. The default implementation calls
+        `callback(self.ask_first_time())`.
+        """
+        callback(self.ask_first_time())
+
+    def ask_to_update_async(self, rel_info, callback):
+        """
+        Prompt the user whether they want to install the update `rel_info`, and call
+        `callback` with the answer (`True` or `False`) once they have answered.
+
+        See `ask_first_time_async()`. The default implementation calls
+        `callback(self.ask_to_update(rel_info))`.
+        """
+        callback(self.ask_to_update(rel_info))
+
+    def ask_to_restart_async(self, callback):
+        """
+        Prompt the user to restart the program after a successful update, and call
+        `callback` with the answer (`True` or `False`) once they have answered.
+
+        See `ask_first_time_async()`. The default implementation calls
+        `callback(self.ask_to_restart())`.
+        """
+        callback(self.ask_to_restart())
+
+
     # ------------------------------------------------------------------------------
     # the following methods need to be reimplemented, using the gui toolkit at hand.
+    # (The prompts may alternatively be provided by reimplementing their `*_async()`
+    # counterparts above.)
     # ------------------------------------------------------------------------------
     
 
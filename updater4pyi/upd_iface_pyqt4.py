@@ -29,27 +29,68 @@
 #                                                                                     #
 #######################################################################################
 
+import sys
 import datetime
 
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
 from . import upd_core
+from . import upd_async
 from . import upd_iface
+from . import upd_progress
 from .upd_log import logger
 
 
 
 
+class _UpdateWorker(QThread):
+    """
+    Worker thread which runs a single call to `fn(*args, **kwargs)`, and remembers its result
+    or the exception it raised. `callback` is for the use of whoever waits for the worker to
+    finish.
+    """
+    def __init__(self, fn, args, kwargs, callback=None, parent=None):
+        QThread.__init__(self, parent)
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.callback = callback
+        self.result = None
+        self.exc_info = None
+
+    def run(self):
+        try:
+            self.result = self.fn(*self.args, **self.kwargs)
+        except BaseException:
+            # including SystemExit (e.g. from install_update() on windows), which must end
+            # the program, not just this thread
+            self.exc_info = sys.exc_info()
+
+
+
 class UpdatePyQt4Interface(QObject, upd_iface.UpdateGenericGuiInterface):
 
+    progressUpdated = pyqtSignal([object])
+    """
+    Emitted with a :py:class:`upd_progress.ProgressInfo` as the update is being downloaded and
+    installed. It is always delivered in the GUI thread.
+    """
+
     def __init__(self, updater, parent=None, **kwargs):
         self.timer = None
+        self._prompts = []
+        self._workers = []
+        self._progress_dialog = None
         
         QObject.__init__(self, parent=parent)
         # super doesn't propagate out of the Qt multiple inheritance...
         upd_iface.UpdateGenericGuiInterface.__init__(self, updater, **kwargs)
 
+        # the updater reports progress from the worker thread; the signal takes it to the GUI thread.
+        self.progressUpdated.connect(self.show_progress)
+        self.updater.add_progress_observer(self.progressUpdated.emit)
+
 
     # ------------
 
@@ -85,7 +126,7 @@ class UpdatePyQt4Interface(QObject, upd_iface.UpdateGenericGuiInterface):
         settings.sync()
 
 
-    def ask_first_time(self):
+    def ask_first_time_async(self, callback):
         msgBox = QMessageBox(parent=None)
         msgBox.setWindowModality(Qt.NonModal)
         msgBox.setText(unicode(self.tr("Would you like to regularly check for software updates%s?"))
@@ -97,22 +138,14 @@ class UpdatePyQt4Interface(QObject, upd_iface.UpdateGenericGuiInterface):
         msgBox.addButton(QMessageBox.No)
         msgBox.setIcon(QMessageBox.Question)
 
-        # show window as modeless window, so don't use exec_(). Instead, process application events
-        # until the user has chosen some option.
-        msgBox.show()
-        msgBox.raise_()
-        while (msgBox.isVisible()):
-            QApplication.processEvents()
-
-        # Yes, look for updates
-        if (msgBox.clickedButton() == msgBox.button(QMessageBox.Yes)):
-            return True
+        def answered(clickedbutton):
+            # Yes, look for updates. Anything else: no, go away
+            callback(clickedbutton == msgBox.button(QMessageBox.Yes))
 
-        # Anything else: no, go away
-        return False
+        self._show_prompt(msgBox, answered)
 
 
-    def ask_to_update(self, rel_info):
+    def ask_to_update_async(self, rel_info, callback):
         msgBox = QMessageBox(parent=None)
         msgBox.setWindowModality(Qt.NonModal)
         msgBox.setText(unicode(self.tr("A new software update is available (%sversion %s). "
@@ -127,31 +160,22 @@ class UpdatePyQt4Interface(QObject, upd_iface.UpdateGenericGuiInterface):
         msgBox.setEscapeButton(btnNotNow)
         msgBox.setIcon(QMessageBox.Question)
 
-        # show window as modeless window, so don't use exec_(). Instead, process application events
-        # until the user has chosen some option.
-        msgBox.show()
-        msgBox.raise_()
-        while (msgBox.isVisible()):
-            QApplication.processEvents()
+        def answered(clickedbutton):
+            # btnInstall: install update
+            if (clickedbutton == btnInstall):
+                callback(True)
+                return
+            # btnNotNow, btnDisableUpdates: don't check for updates
+            if (clickedbutton == btnDisableUpdates):
+                self.setCheckForUpdatesEnabled(False)
+            callback(False)
 
-        clickedbutton = msgBox.clickedButton()
+        self._show_prompt(msgBox, answered)
 
-        # btnInstall: install update
         
-        if (clickedbutton == btnInstall):
-            return True
-
-        # btnNotNow, btnDisableUpdates: don't check for updates
-        
-        if (clickedbutton == btnDisableUpdates):
-            self.setCheckForUpdatesEnabled(False)
-
-        return False
-
-        
-    def ask_to_restart(self):
+    def ask_to_restart_async(self, callback):
         msgBox = QMessageBox(parent=None)
-        #msgBox.setWindowModality(Qt.NonModal)
+        msgBox.setWindowModality(Qt.NonModal)
         msgBox.setText(self.tr("The software update is now complete."))
         
         thisprog = str(self.tr("This program"))
@@ -165,18 +189,126 @@ class UpdatePyQt4Interface(QObject, upd_iface.UpdateGenericGuiInterface):
         msgBox.setDefaultButton(btnRestart)
         msgBox.setEscapeButton(btnIgnore)
         msgBox.setIcon(QMessageBox.Information)
+
+        def answered(clickedbutton):
+            callback(clickedbutton == btnRestart)
+
+        self._show_prompt(msgBox, answered)
+
+
+    def _show_prompt(self, msgBox, answered):
+        """
+        Show the given message box as a modeless window, and call `answered(clickedbutton)` once
+        the user has closed it. We don't wait for the user here; rather, the dialog's
+        `finished()` signal takes over from the application's event loop.
+        """
+        # keep a reference to the message box while it is shown
+        self._prompts.append(msgBox)
+
+        def finished(result):
+            self._prompts.remove(msgBox)
+            answered(msgBox.clickedButton())
+
+        msgBox.finished.connect(finished)
         msgBox.show()
         msgBox.raise_()
-        msgBox.exec_();
 
-        clickedbutton = msgBox.clickedButton()
 
-        if (clickedbutton == btnRestart):
-            return True
+    # synchronous versions of the prompts, which wait for the answer in a local event loop.
+
+    def ask_first_time(self):
+        return self._wait_for_answer(self.ask_first_time_async)
+
+    def ask_to_update(self, rel_info):
+        return self._wait_for_answer(self.ask_to_update_async, rel_info)
+
+    def ask_to_restart(self):
+        return self._wait_for_answer(self.ask_to_restart_async)
+
+    def _wait_for_answer(self, ask_async, *args):
+        answer = []
+        loop = QEventLoop()
+
+        def callback(value):
+            answer.append(value)
+            loop.quit()
+
+        ask_async(*args, callback=callback)
+        if not answer:
+            loop.exec_()
+        return answer[0]
+
+
+    def run_in_background(self, fn, *args, **kwargs):
+        """
+        Run `fn(*args, **kwargs)` in a worker thread (see `run_in_background_async()`), and wait
+        for its result in a local event loop. The update check itself doesn't use this
+        function, so that it doesn't nest event loops.
+        """
+        future = self._wait_for_answer(self.run_in_background_async,
+                                       lambda: fn(*args, **kwargs), ())
+        return future.result()
+
+    def run_in_background_async(self, fn, args, callback):
+        """
+        Run `fn(*args)` in a worker :py:class:`QThread`, so that the network access and the
+        download and installation of the update don't block the Qt event loop. This function
+        returns immediately; `callback` is called in the GUI thread once the worker has
+        finished, by way of the worker's `finished()` signal.
+        """
+        worker = _UpdateWorker(fn, args, {}, callback=callback)
+        # keep a reference to the worker while it runs
+        self._workers.append(worker)
+        worker.finished.connect(self._worker_finished)
+        worker.start()
+
+    @pyqtSlot()
+    def _worker_finished(self):
+        worker = self.sender()
+        self._workers.remove(worker)
+        worker.deleteLater()
+
+        if self._progress_dialog is not None:
+            self._progress_dialog.hide()
+            self._progress_dialog = None
+
+        future = upd_async.new_future()
+        if worker.exc_info is not None:
+            future.set_exception(worker.exc_info[1])
+        else:
+            future.set_result(worker.result)
+        worker.callback(future)
+
+
+    @pyqtSlot(object)
+    def show_progress(self, info):
+        """
+        Show the progress of the update installation in a progress dialog. You may reimplement
+        this function to display the progress differently, e.g. in a status bar.
+        """
+        if self._progress_dialog is None:
+            self._progress_dialog = QProgressDialog(parent=None)
+            self._progress_dialog.setWindowTitle(self.tr("Software Update"))
+            self._progress_dialog.setCancelButton(None)
+            self._progress_dialog.setAutoReset(False)
+            self._progress_dialog.setAutoClose(False)
+            self._progress_dialog.show()
+
+        if info.phase == upd_progress.PHASE_DOWNLOAD:
+            what = unicode(self.tr("Downloading the software update..."))
+        else:
+            what = unicode(self.tr("Installing the software update..."))
+        self._progress_dialog.setLabelText(what + u"\n" + unicode(info))
+
+        fraction = info.fraction()
+        if fraction is None:
+            # unknown total: busy indicator
+            self._progress_dialog.setRange(0, 0)
+        else:
+            self._progress_dialog.setRange(0, 1000)
+            self._progress_dialog.setValue(int(fraction*1000))
+
 
-        return False
-        
-        
     def set_timeout_check(self, interval_timedelta):
 
         # interval in milliseconds
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+#######################################################################################
+#                                                                                     #
+#   This file is part of the updater4pyi Project.                                     #
+#                                                                                     #
+#   Copyright (C) 2014, Philippe Faist                                                #
+#   philippe.faist@bluewin.ch                                                         #
+#   All rights reserved.                                                              #
+#                                                                                     #
+#   Redistribution and use in source and binary forms, with or without                #
+#   modification, are permitted provided that the following conditions are met:       #
+#                                                                                     #
+#   1. Redistributions of source code must retain the above copyright notice, this    #
+#      list of conditions and the following disclaimer.                               #
+#   2. Redistributions in binary form must reproduce the above copyright notice,      #
+#      this list of conditions and the following disclaimer in the documentation      #
+#      and/or other materials provided with the distribution.                         #
+#                                                                                     #
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND   #
+#   ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED     #
+#   WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE            #
+#   DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR   #
+#   ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES    #
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;      #
+#   LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND       #
+#   ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT        #
+#   (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS     #
+#   SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                      #
+#                                                                                     #
+#######################################################################################
+
+"""
+File manifests for partial updates of directory installations.
+
+For onedir PyInstaller packages, usually only a handful of files change between two
+releases. A release may publish a *file manifest* next to the full archive, listing all
+the files of the installation with their size, digest and permissions. The
+:py:class:`~upd_core.Updater` compares the manifest with the currently installed files
+and only downloads the files which changed or were added.
+
+The manifest is a JSON file of the form::
+
+    {
+      "files_url": "myapp-1.1-linux.files/",
+      "files": [
+        { "path": "myapp", "size": 1234567, "digest": "sha256:9f86d0...", "mode": "0755" },
+        { "path": "lib/base_library.zip", "size": 748321, "digest": "sha256:60303a..." },
+        ...
+      ],
+      "links": [
+        { "path": "lib/Python.framework/Versions/Current", "target": "2.7" },
+        ...
+      ],
+      "dirs": [ "lib/plugins", ... ]
+    }
+
+The `path` of each file is relative to the installation directory, with forward
+slashes. The optional `links` are the symbolic links of the installation (e.g. in Mac OS X
+bundles), whose `target` is relative and must stay within the installation, and the
+optional `dirs` are its directories, so that empty directories are kept. The `mode` is optional (it defaults to ``0755``, like for files extracted from
+archives). Each file is downloaded from the URL given by its `url` field if present, or
+else from `files_url` + `path`. Relative URLs are resolved with respect to the URL of the
+manifest itself.
+
+You may generate a manifest for a given directory with :py:func:`make_manifest`.
+"""
+
+import os
+import os.path
+import stat
+import json
+import errno
+import hashlib
+import httplib
+import urllib
+import urlparse
+import collections
+
+from . import util
+from .upd_defs import Updater4PyiError
+from .upd_log import logger
+
+
+# -----------------------------------------------------------------------------
+
+
+ManifestEntry = collections.namedtuple('ManifestEntry', ('path', 'size', 'digest', 'mode', 'url',))
+"""
+A file listed in a :py:class:`FileManifest`.
+"""
+
+ManifestLink = collections.namedtuple('ManifestLink', ('path', 'target',))
+"""
+A symbolic link listed in a :py:class:`FileManifest`.
+"""
+
+
+DEFAULT_FILE_MODE = 0755
+
+
+class FileManifest(object):
+    """
+    The list of files of a directory installation, as published by a release. See the
+    module documentation for the format.
+    """
+    def __init__(self, entries, url=None, links=(), dirs=()):
+        """
+        Construct a file manifest from a list of :py:data:`ManifestEntry` objects. The `url`
+        is the location of the manifest, with respect to which relative file URLs are
+        resolved. The symbolic links of the installation are given as a list of
+        :py:data:`ManifestLink` objects, and its directories as a list of paths.
+        """
+        self.entries = list(entries)
+        self.url = url
+        self.links = list(links)
+        self.dirs = list(dirs)
+
+    @staticmethod
+    def parse(data, url=None):
+        """
+        Parse the JSON manifest data `data` (a string) located at `url`, and return a
+        `FileManifest` instance. Raises :py:exc:`upd_defs.Updater4PyiError` if the
+        manifest is invalid.
+        """
+        try:
+            d = json.loads(data)
+        except ValueError as e:
+            raise Updater4PyiError("Invalid file manifest: %s" %(str(e)))
+
+        if not isinstance(d, dict) or not isinstance(d.get('files', None), list):
+            raise Updater4PyiError("Invalid file manifest: expected a 'files' list")
+
+        files_url = d.get('files_url', '')
+
+        entries = []
+        for f in d['files']:
+            try:
+                path = _check_path(f['path'])
+                size = int(f['size'])
+                digest = f['digest']
+                util.digest_hasher(digest)
+                mode = f.get('mode', DEFAULT_FILE_MODE)
+                if isinstance(mode, basestring):
+                    # int(s, 0) parses prefixes '0' (octal) and '0x' (hex)
+                    mode = int(mode, 0)
+            except (KeyError, TypeError, ValueError) as e:
+                raise Updater4PyiError("Invalid file manifest entry %r: %s" %(f, str(e)))
+
+            fileurl = f.get('url', None)
+            if not fileurl:
+                fileurl = files_url + urllib.quote(path.encode('utf-8'))
+            if url:
+                fileurl = urlparse.urljoin(url, fileurl)
+
+            entries.append(ManifestEntry(path=path, size=size, digest=digest, mode=mode, url=fileurl))
+
+        links = []
+        dirs = []
+        try:
+            for l in d.get('links', []):
+                try:
+                    links.append(ManifestLink(path=_check_path(l['path']), target=_check_link_target(l)))
+                except (KeyError, TypeError, ValueError) as e:
+                    raise Updater4PyiError("Invalid file manifest link %r: %s" %(l, str(e)))
+            for p in d.get('dirs', []):
+                try:
+                    dirs.append(_check_path(p))
+                except (AttributeError, TypeError, ValueError) as e:
+                    raise Updater4PyiError("Invalid file manifest directory %r: %s" %(p, str(e)))
+        except TypeError as e:
+            raise Updater4PyiError("Invalid file manifest: %s" %(str(e)))
+
+        return FileManifest(entries, url=url, links=links, dirs=dirs)
+
+
+    def diff_tree(self, localdir):
+        """
+        Compare the manifest with the files installed in the directory `localdir`.
+
+        Returns a tuple `(unchanged, changed, removed)`, where `unchanged` and `changed` are
+        lists of :py:data:`ManifestEntry` objects (`changed` includes files which don't
+        exist locally), and `removed` is a list of paths of local files which are not
+        listed in the manifest.
+        """
+        unchanged = []
+        changed = []
+        for e in self.entries:
+            if _local_file_matches(os.path.join(localdir, e.path), e):
+                unchanged.append(e)
+            else:
+                changed.append(e)
+
+        known = set([ os.path.normpath(e.path) for e in self.entries ] +
+                    [ os.path.normpath(l.path) for l in self.links ])
+        removed = []
+        for (dirpath, dirnames, filenames) in os.walk(localdir):
+            # (symbolic links to directories are listed, but not walked into)
+            for fn in filenames + [ dn for dn in dirnames if os.path.islink(os.path.join(dirpath, dn)) ]:
+                relpath = os.path.relpath(os.path.join(dirpath, fn), localdir)
+                if os.path.normpath(relpath) not in known:
+                    removed.append(relpath)
+
+        return (unchanged, changed, removed)
+
+
+    def build_tree(self, localdir, destdir, fetch_file):
+        """
+        Populate the (new) directory `destdir` with the files listed in the manifest.
+
+        Files which are identical in the installed directory `localdir` are reused (hard
+        linked if possible, otherwise copied). The other files are fetched by calling
+        `fetch_file(entry, fdst)`, which should write the contents of the file described
+        by the :py:data:`ManifestEntry` `entry` to the open file `fdst`, and close
+        it. Fetched files are checked against the size and digest of the manifest. Files
+        of `localdir` which are not listed in the manifest are not carried over. The
+        directories and symbolic links listed in the manifest are created.
+
+        Raises :py:exc:`upd_defs.Updater4PyiError` if a file can't be fetched or doesn't
+        match the manifest.
+        """
+
+        (unchanged, changed, removed) = self.diff_tree(localdir)
+
+        logger.debug("file manifest: %d files unchanged, %d files to fetch (%d bytes), %d files removed",
+                     len(unchanged), len(changed), sum([ e.size for e in changed ]), len(removed))
+
+        _makedirs(destdir)
+
+        for d in self.dirs:
+            _makedirs(os.path.join(destdir, d))
+
+        for e in unchanged:
+            destfn = os.path.join(destdir, e.path)
+            _makedirs_for(destfn)
+            util.link_or_copy(os.path.join(localdir, e.path), destfn)
+
+        for e in changed:
+            destfn = os.path.join(destdir, e.path)
+            _makedirs_for(destfn)
+            logger.debug("fetching %s from %s", e.path, e.url)
+            try:
+                with open(destfn, 'wb') as f:
+                    fetch_file(e, f)
+            except (IOError, httplib.HTTPException) as exc:
+                raise Updater4PyiError("Failed to download %s: %s" %(e.path, str(exc)))
+            if not _local_file_matches(destfn, e):
+                raise Updater4PyiError("Downloaded file %s doesn't match the file manifest" %(e.path))
+
+        for e in self.entries:
+            destfn = os.path.join(destdir, e.path)
+            try:
+                os.chmod(destfn, e.mode)
+            except OSError:
+                logger.warning("Failed to set permissions to file %s. Ignoring." %(destfn));
+
+        for l in self.links:
+            destfn = os.path.join(destdir, l.path)
+            _makedirs_for(destfn)
+            try:
+                os.symlink(l.target, destfn)
+            except (AttributeError, OSError) as exc:
+                # (no os.symlink() on windows)
+                raise Updater4PyiError("Failed to create symbolic link %s: %s" %(l.path, str(exc)))
+
+
+
+def make_manifest(localdir, files_url='', algorithm='sha256'):
+    """
+    Utility for publishers: compute the file manifest of the directory `localdir`, and
+    return it as a dictionary which can be dumped as JSON (e.g. with `json.dump()`).
+
+    `files_url` is stored as is in the manifest. It is the base URL (usually relative to
+    the manifest) under which the files of the directory are published.
+    """
+    files = []
+    links = []
+    dirs = []
+    for (dirpath, dirnames, filenames) in os.walk(localdir):
+        dirnames.sort()
+        for dn in dirnames:
+            fulldn = os.path.join(dirpath, dn)
+            relpath = os.path.relpath(fulldn, localdir).replace(os.sep, '/')
+            if os.path.islink(fulldn):
+                # (os.walk() doesn't walk into it)
+                links.append({'path': relpath, 'target': os.readlink(fulldn)})
+            else:
+                dirs.append(relpath)
+        for fn in sorted(filenames):
+            fullfn = os.path.join(dirpath, fn)
+            relpath = os.path.relpath(fullfn, localdir).replace(os.sep, '/')
+            if os.path.islink(fullfn):
+                links.append({'path': relpath, 'target': os.readlink(fullfn)})
+                continue
+            files.append({
+                'path': relpath,
+                'size': os.path.getsize(fullfn),
+                'digest': algorithm + ':' + _file_hexdigest(fullfn, hashlib.new(algorithm)),
+                'mode': '%#o' %(stat.S_IMODE(os.stat(fullfn).st_mode)),
+                })
+    manifest = {'files_url': files_url, 'files': files}
+    if links:
+        manifest['links'] = links
+    if dirs:
+        manifest['dirs'] = dirs
+    return manifest
+
+
+
+# ------------------------------------------------------------------------------
+
+
+def _check_path(path):
+    if (not path or path.startswith('/') or path.startswith('\\') or
+        os.path.isabs(path) or '..' in path.replace('\\', '/').split('/')):
+        raise ValueError("Invalid path: %r" %(path))
+    return path.replace('/', os.sep)
+
+
+def _check_link_target(l):
+    target = l['target']
+    if not isinstance(target, basestring) or not target:
+        raise ValueError("Invalid link target: %r" %(target))
+    target = target.replace('/', os.sep)
+    # the link must point within the installation
+    resolved = os.path.normpath(os.path.join(os.path.dirname(_check_path(l['path'])), target))
+    if os.path.isabs(target) or resolved == os.pardir or resolved.startswith(os.pardir + os.sep):
+        raise ValueError("Link target outside of the installation: %r" %(l['target']))
+    return target
+
+
+def _file_hexdigest(fn, hasher):
+    with open(fn, 'rb') as f:
+        while True:
+            buf = f.read(65536)
+            if not buf:
+                break
+            hasher.update(buf)
+    return hasher.hexdigest()
+
+
+def _local_file_matches(fn, entry):
+    try:
+        if not os.path.isfile(fn) or os.path.getsize(fn) != entry.size:
+            return False
+        (hasher, expected_hexdigest) = util.digest_hasher(entry.digest)
+        return _file_hexdigest(fn, hasher) == expected_hexdigest
+    except (OSError, IOError):
+        return False
+
+
+def _makedirs_for(fn):
+    _makedirs(os.path.dirname(fn))
+
+def _makedirs(d):
+    try:
+        os.makedirs(d)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise Updater4PyiError("Failed to create directory %s: %s" %(d, str(e)))
+
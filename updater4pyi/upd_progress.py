@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+#######################################################################################
+#                                                                                     #
+#   This file is part of the updater4pyi Project.                                     #
+#                                                                                     #
+#   Copyright (C) 2014, Philippe Faist                                                #
+#   philippe.faist@bluewin.ch                                                         #
+#   All rights reserved.                                                              #
+#                                                                                     #
+#   Redistribution and use in source and binary forms, with or without                #
+#   modification, are permitted provided that the following conditions are met:       #
+#                                                                                     #
+#   1. Redistributions of source code must retain the above copyright notice, this    #
+#      list of conditions and the following disclaimer.                               #
+#   2. Redistributions in binary form must reproduce the above copyright notice,      #
+#      this list of conditions and the following disclaimer in the documentation      #
+#      and/or other materials provided with the distribution.                         #
+#                                                                                     #
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND   #
+#   ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED     #
+#   WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE            #
+#   DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR   #
+#   ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES    #
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;      #
+#   LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND       #
+#   ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT        #
+#   (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS     #
+#   SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                      #
+#                                                                                     #
+#######################################################################################
+
+
+
+"""
+Progress reporting for downloads and installs.
+
+A :py:class:`ProgressTracker` accounts for the bytes (and files) processed by one phase of
+the update, i.e. downloading (:py:data:`PHASE_DOWNLOAD`) or extracting
+(:py:data:`PHASE_EXTRACT`) the update, and regularly reports a :py:class:`ProgressInfo`
+snapshot to its *observers*, which are simply callables taking that snapshot as argument.
+
+Observers are registered with :py:meth:`upd_core.Updater.add_progress_observer`. Note that
+they are called from the thread which does the work, which may not be the main thread.
+"""
+
+import time
+import threading
+import collections
+
+from .upd_log import logger
+
+
+PHASE_DOWNLOAD = 'download'
+"""
+Phase name for downloading the update.
+"""
+
+PHASE_EXTRACT = 'extract'
+"""
+Phase name for extracting the files of the update.
+"""
+
+DEFAULT_REPORT_INTERVAL = 0.2
+"""
+Observers are informed of the progress at most once every this number of seconds
+(besides when a phase starts and when it finishes).
+"""
+
+RATE_WINDOW = 3.0
+"""
+The instantaneous rate is measured over the last this number of seconds.
+"""
+
+
+class ProgressInfo(object):
+    """
+    A snapshot of the progress of a phase, as given to the progress observers.
+
+    Attributes:
+
+        - `phase`: :py:data:`PHASE_DOWNLOAD` or :py:data:`PHASE_EXTRACT`;
+        - `name`: what is being processed, e.g. the URL of the download (or `None`);
+        - `bytes_done`, `bytes_total`: bytes processed so far and expected in total
+          (`bytes_total` is `None` if unknown);
+        - `files_done`, `files_total`: same, for files (only for extracting);
+        - `rate`, `average_rate`: current and average rate in bytes per second (`None`
+          if not yet known);
+        - `eta`: estimated number of seconds remaining (`None` if unknown);
+        - `elapsed`: seconds since the phase started;
+        - `finished`: `True` for the last report of the phase.
+    """
+    def __init__(self, **kwargs):
+        self.phase = None
+        self.name = None
+        self.bytes_done = 0
+        self.bytes_total = None
+        self.files_done = 0
+        self.files_total = None
+        self.rate = None
+        self.average_rate = None
+        self.eta = None
+        self.elapsed = 0.0
+        self.finished = False
+        self.__dict__.update(kwargs)
+
+    def fraction(self):
+        """
+        Return the fraction (between 0 and 1) of the work which is done, or `None` if the
+        total is unknown.
+        """
+        if self.bytes_total:
+            return min(1.0, float(self.bytes_done) / self.bytes_total)
+        if self.files_total:
+            return min(1.0, float(self.files_done) / self.files_total)
+        if self.finished:
+            return 1.0
+        return None
+
+    def __str__(self):
+        s = format_size(self.bytes_done)
+        if self.bytes_total is not None:
+            s += " of %s" %(format_size(self.bytes_total))
+        if self.files_total is not None:
+            s += ", %d of %d files" %(self.files_done, self.files_total)
+        elif self.files_done:
+            s += ", %d files" %(self.files_done)
+        if self.finished:
+            if self.average_rate:
+                s += " (%s/s)" %(format_size(self.average_rate))
+            return s
+        if self.rate is not None:
+            s += " (%s/s" %(format_size(self.rate))
+            if self.eta is not None:
+                s += ", %s left" %(format_duration(self.eta))
+            s += ")"
+        return s
+
+
+class ProgressTracker(object):
+    """
+    Accounts for the progress of one phase of the update and reports it to the
+    `observers`. All methods may be called from several threads at once.
+
+    Only data which is actually processed now counts for the rates; data which is
+    skipped, e.g. the part of a download which we already had when resuming it, is
+    accounted for with :py:meth:`reset`.
+    """
+    def __init__(self, phase, observers=(), name=None, bytes_total=None, files_total=None,
+                 report_interval=DEFAULT_REPORT_INTERVAL):
+        self.phase = phase
+        self.observers = list(observers)
+        self.name = name
+        self.report_interval = report_interval
+        self._lock = threading.Lock()
+        self._start_time = time.time()
+        self._last_report = None
+        self._bytes_done = 0
+        self._bytes_total = bytes_total
+        self._files_done = 0
+        self._files_total = files_total
+        # bytes actually processed since start, and recent (time, processed) samples
+        self._processed = 0
+        self._samples = collections.deque()
+
+    def reset(self, bytes_done=0, bytes_total=None, files_done=0, files_total=None):
+        """
+        Start (or start over) with `bytes_done` bytes and `files_done` files already
+        there. The totals are updated if they are given.
+        """
+        with self._lock:
+            self._bytes_done = bytes_done
+            self._files_done = files_done
+            if bytes_total is not None:
+                self._bytes_total = bytes_total
+            if files_total is not None:
+                self._files_total = files_total
+            info = self._report_info(force=True)
+        self._notify(info)
+
+    def add(self, nbytes, nfiles=0):
+        """
+        Account for `nbytes` more bytes and `nfiles` more files which were processed.
+        """
+        with self._lock:
+            self._bytes_done += nbytes
+            self._files_done += nfiles
+            self._processed += nbytes
+            info = self._report_info()
+        self._notify(info)
+
+    def finish(self):
+        """
+        The phase is complete. Observers are informed with a last report.
+        """
+        with self._lock:
+            info = self._report_info(force=True, finished=True)
+        self._notify(info)
+
+    def info(self, finished=False):
+        """
+        Return a :py:class:`ProgressInfo` snapshot of the current progress.
+        """
+        with self._lock:
+            return self._info(time.time(), finished)
+
+    def _info(self, now, finished):
+        elapsed = now - self._start_time
+
+        # instantaneous rate, over the last RATE_WINDOW seconds
+        self._samples.append((now, self._processed))
+        while len(self._samples) > 2 and now - self._samples[1][0] >= RATE_WINDOW:
+            self._samples.popleft()
+        (t0, processed0) = self._samples[0]
+        rate = None
+        if now - t0 > 0.5 or (finished and now > t0):
+            rate = (self._processed - processed0) / (now - t0)
+        average_rate = (self._processed / elapsed if elapsed > 0.5 or finished and elapsed > 0 else None)
+
+        eta = None
+        if self._bytes_total is not None and rate:
+            eta = max(0.0, (self._bytes_total - self._bytes_done) / rate)
+
+        return ProgressInfo(phase=self.phase, name=self.name,
+                            bytes_done=self._bytes_done, bytes_total=self._bytes_total,
+                            files_done=self._files_done, files_total=self._files_total,
+                            rate=rate, average_rate=average_rate, eta=eta,
+                            elapsed=elapsed, finished=finished)
+
+    def _report_info(self, force=False, finished=False):
+        # the snapshot to report now, if any; called with the lock held. The observers are
+        # then called without the lock, so that a slow observer doesn't hold up the other
+        # threads (when several threads report at once, their reports may thus arrive in
+        # either order).
+        if not self.observers:
+            return None
+        now = time.time()
+        if not force and self._last_report is not None and now - self._last_report < self.report_interval:
+            return None
+        self._last_report = now
+        return self._info(now, finished)
+
+    def _notify(self, info):
+        if info is None:
+            return
+        for observer in self.observers:
+            try:
+                observer(info)
+            except Exception:
+                logger.exception("Exception in progress observer %r", observer)
+
+
+
+def format_size(nbytes):
+    """
+    Format a number of bytes in a human-readable way, e.g. ``'3.2 MB'``.
+    """
+    nbytes = float(nbytes)
+    for unit in ('bytes', 'kB', 'MB', 'GB'):
+        if nbytes < 1000.0 or unit == 'GB':
+            break
+        nbytes /= 1000.0
+    if unit == 'bytes':
+        return "%d %s" %(nbytes, unit)
+    return "%.1f %s" %(nbytes, unit)
+
+
+def format_duration(seconds):
+    """
+    Format a number of seconds in a human-readable way, e.g. ``'2 min 5 s'``.
+    """
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return "%d s" %(seconds)
+    if seconds < 3600:
+        return "%d min %d s" %(seconds // 60, seconds % 60)
+    return "%d h %d min" %(seconds // 3600, (seconds % 3600) // 60)
@@ -51,19 +51,37 @@ import os.path
 import logging
 import copy
 import json
+import hashlib
 import inspect
+import time
+import threading
+import collections
+import httplib
 import urllib2
 
 from . import util
 from .upd_defs import RELTYPE_UNKNOWN, RELTYPE_EXE, RELTYPE_ARCHIVE, RELTYPE_BUNDLE_ARCHIVE
 from .upd_defs import Updater4PyiError
 from . import upd_downloader
+from . import upd_timing
 from .upd_log import logger
 
 
 # ---------------------------------------------------------------------
 
 
+DeltaPatchInfo = collections.namedtuple('DeltaPatchInfo', ('from_version', 'filename', 'url',))
+"""
+Describes a binary delta patch which rebuilds a release file from the release file of an
+older version `from_version`. The patch itself can be downloaded at `url`. See
+:py:mod:`upd_delta`.
+"""
+
+
+_BIN_RELEASE_INFO_FIELDS = ('version', 'filename', 'url', 'reltype', 'platform', 'size', 'digest',
+                            'checksums', 'delta_patches', 'manifest_url', 'chunk_index_url',
+                            'mirror_urls')
+
 class BinReleaseInfo(object):
     """
     A description of a release. This includes the release type (executable, archive,
@@ -83,10 +101,26 @@ class BinReleaseInfo(object):
     customizable.
 
     Arbitrary information about the release may be stored in this class, too.
+
+    The standard fields are stored in slots; other information is only stored in a
+    per-object dictionary if there is any, and information about the release as a whole
+    (see the `release` argument of the constructor) is shared by all the release files of
+    that release.
     """
+
+    __slots__ = _BIN_RELEASE_INFO_FIELDS + ('release', '_parsed_version', '__dict__')
+
     def __init__(self, version=None, filename=None, url=None,
                  reltype=RELTYPE_UNKNOWN,
                  platform=None,
+                 size=None,
+                 digest=None,
+                 checksums=None,
+                 delta_patches=None,
+                 manifest_url=None,
+                 chunk_index_url=None,
+                 mirror_urls=None,
+                 release=None,
                  **kwargs):
         """
         Construct a `BinReleaseInfo` object.
@@ -108,6 +142,38 @@ class BinReleaseInfo(object):
         this `platform` with the current platform determined with
         :py:func:`util.simple_platform`).
 
+        The `size` is the size of the release file in bytes, or `None` if unknown.
+
+        The `digest` is the published checksum of the release file, given as a string of
+        the form ``'<algorithm>:<hexdigest>'``, e.g. ``'sha256:9f86d0...'`` (see
+        :py:func:`util.digest_hasher`), or `None` if unknown. Alternatively, `checksums`
+        may be a :py:class:`ChecksumsFile` from which the digest is looked up when it is
+        first needed.
+
+        The `delta_patches` is a list of :py:data:`DeltaPatchInfo` objects describing
+        binary delta patches from which this release file can be rebuilt, starting from
+        the release file of an older version. Delta patches are only used if the `digest`
+        is known, so that the rebuilt file can be checked.
+
+        The `manifest_url` is the location of a file manifest for this release (see
+        :py:mod:`upd_manifest`), which allows to update a directory installation by only
+        downloading the files which changed.
+
+        The `chunk_index_url` is the location of a chunk index for the release file (see
+        :py:mod:`upd_chunks`), which allows to rebuild the release file by reusing the
+        parts of it which we already have locally.
+
+        The `mirror_urls` is a list of further locations from which the very same file can
+        be downloaded, e.g. mirrors of the main download server. The
+        :py:class:`~upd_core.Updater` downloads from whichever location responds fastest,
+        and switches to another one if a download fails (see
+        :py:func:`upd_downloader.download`).
+
+        The `release` is a dictionary of information about the release as a whole, such
+        as its name or its release notes, which may be shared by all the release files of
+        the same release (it should thus not be modified). Its items can also be accessed
+        as attributes of this object, e.g. `rel_description`.
+
         Any additional keyword arguments are interpreted as additional information about
         the release; they are stored as attributes to the constructed instance.
         """
@@ -120,10 +186,53 @@ class BinReleaseInfo(object):
         self.url = url
         self.reltype = reltype
         self.platform = platform
+        self.size = size
+        self.digest = digest
+        self.checksums = checksums
+        self.delta_patches = (list(delta_patches) if delta_patches else [])
+        self.manifest_url = manifest_url
+        self.chunk_index_url = chunk_index_url
+        self.mirror_urls = (list(mirror_urls) if mirror_urls else [])
+        self.release = release
+        self._parsed_version = None
 
         for k,v in kwargs.iteritems():
             setattr(self, k, v)
 
+    def __getattr__(self, name):
+        # only called for attributes which aren't found otherwise: look up the shared
+        # release information.
+        if name == 'release':
+            # e.g. a subclass which didn't call our constructor
+            return None
+        if name.startswith('__'):
+            raise AttributeError(name)
+        release = self.release
+        if release is not None and name in release:
+            return release[name]
+        raise AttributeError("%r object has no attribute %r" %(self.__class__.__name__, name))
+
+    def __copy__(self):
+        c = self.__class__.__new__(self.__class__)
+        for k in BinReleaseInfo.__slots__[:-1]:
+            setattr(c, k, getattr(self, k, None))
+        if c.delta_patches is not None:
+            c.delta_patches = list(c.delta_patches)
+        if c.mirror_urls is not None:
+            c.mirror_urls = list(c.mirror_urls)
+        c.__dict__.update(self.__dict__)
+        return c
+
+    def to_dict(self):
+        """
+        Return the information stored in this object as a dictionary: the standard fields,
+        the `release` information and any additional information given to the constructor.
+        """
+        d = dict([ (k, getattr(self, k, None)) for k in _BIN_RELEASE_INFO_FIELDS ])
+        d['release'] = self.release
+        d.update(self.__dict__)
+        return d
+
 
     def get_version(self):
         """
@@ -131,6 +240,16 @@ class BinReleaseInfo(object):
         """
         return self.version
 
+    def get_parsed_version(self):
+        """
+        Return the version (see :py:meth:`get_version`) parsed with
+        :py:func:`util.parse_version`.
+        """
+        v = getattr(self, '_parsed_version', None)
+        if v is None:
+            v = self._parsed_version = util.parse_version(self.get_version())
+        return v
+
     def get_filename(self):
         """
         Return the `filename` set in the constructor.
@@ -155,15 +274,122 @@ class BinReleaseInfo(object):
         """
         return self.platform
 
+    def get_size(self):
+        """
+        Return the `size` set in the constructor.
+        """
+        return self.size
+
+    def get_digest(self):
+        """
+        Return the `digest` set in the constructor. If it wasn't set, but a `checksums`
+        file was given, the digest is looked up in there (this may fetch the checksums
+        file).
+        """
+        if self.digest is None and self.checksums is not None:
+            self.digest = self.checksums.get_digest(self.filename)
+        return self.digest
+
+    def get_delta_patches(self):
+        """
+        Return the list of `delta_patches` set in the constructor.
+        """
+        return self.delta_patches
+
+    def get_manifest_url(self):
+        """
+        Return the `manifest_url` set in the constructor.
+        """
+        return self.manifest_url
+
+    def get_chunk_index_url(self):
+        """
+        Return the `chunk_index_url` set in the constructor.
+        """
+        return self.chunk_index_url
+
+    def get_mirror_urls(self):
+        """
+        Return the list of `mirror_urls` set in the constructor.
+        """
+        return (getattr(self, 'mirror_urls', None) or [])
+
+    def get_urls(self):
+        """
+        Return all the locations from which the release file can be downloaded: the `url`
+        (see :py:meth:`get_url`) followed by the `mirror_urls` (see
+        :py:meth:`get_mirror_urls`).
+        """
+        url = self.get_url()
+        return [url] + [ u for u in self.get_mirror_urls() if u != url ]
+
     def __repr__(self):
         return (self.__class__.__name__+'('+
                 ", ".join([ '%s=%r' % (k,v)
-                            for (k,v) in self.__dict__.iteritems() ]) +
+                            for (k,v) in self.to_dict().iteritems()
+                            if k != 'release' ]) +
                 ')')
 
 
 
 
+_HEXDIGEST_ALGORITHMS = {32: 'md5', 40: 'sha1', 64: 'sha256', 128: 'sha512'}
+
+class ChecksumsFile(object):
+    """
+    A checksums file published along with a release, in the format produced by the
+    `sha256sum` utility and its friends, i.e. with lines of the form::
+
+        9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08  myapp-1.1-linux.zip
+
+    The hash algorithm is determined from the length of the hex digests. A file containing
+    a single digest without a file name applies to `default_filename`.
+
+    The file is only fetched when a digest is first requested with :py:meth:`get_digest`.
+    """
+    def __init__(self, url, default_filename=None):
+        self.url = url
+        self.default_filename = default_filename
+        self._digests = None
+
+    def get_digest(self, filename):
+        """
+        Return the digest (``'<algorithm>:<hexdigest>'``) of the file `filename`, or
+        `None` if it isn't listed or if the checksums file can't be fetched.
+        """
+        if self._digests is None:
+            self._digests = self._fetch()
+        return self._digests.get(filename, None)
+
+    def _fetch(self):
+        logger.debug("fetching checksums file %s", self.url)
+        try:
+            fdata = upd_downloader.url_opener.open(self.url)
+            data = fdata.read()
+            fdata.close()
+        except (IOError, httplib.HTTPException) as e:
+            logger.warning("Can't fetch checksums file %s: %s", self.url, e)
+            return {}
+        return self.parse(data, default_filename=self.default_filename)
+
+    @staticmethod
+    def parse(data, default_filename=None):
+        """
+        Parse the contents of a checksums file, and return a dictionary mapping file names
+        to digests.
+        """
+        digests = {}
+        for line in data.splitlines():
+            m = re.match(r'^\s*(?P<hex>[0-9a-fA-F]+)\s*(\s[ *]?(?P<fn>.*?))?\s*$', line)
+            if m is None or len(m.group('hex')) not in _HEXDIGEST_ALGORITHMS:
+                continue
+            fn = m.group('fn') or default_filename
+            if fn:
+                digests[fn] = _HEXDIGEST_ALGORITHMS[len(m.group('hex'))] + ':' + m.group('hex').lower()
+        return digests
+
+
+
 # --------------------------------------------------------------
 
 
@@ -220,6 +446,14 @@ class UpdateSource(object):
 
         return True
 
+    def source_identity(self):
+        """
+        Return a string which identifies where this source gets its releases from (e.g. the
+        github repository), or `None`. This is used as a key to cache the releases (see
+        :py:class:`CachingUpdateSource`). The default implementation returns `None`.
+        """
+        return None
+
     # subclasses need to reimplement:
 
     def get_releases(self, newer_than_version=None, **kwargs):
@@ -248,21 +482,32 @@ class UpdateSource(object):
 class IgnoreArgument:
     pass
 
-def _make_bin_release_info(m, lst, innerkwargs):
+def _compile_rule(k, v):
+    # Returns a tuple (attribute, rule, wanted_args): for a callable rule, wanted_args tells
+    # which of the arguments 'm', 'd' and 'x' it accepts; for a fixed value, it is None.
+    if (type(v).__name__ != 'function'):
+        return (k, v, None)
+    argspec = inspect.getargspec(v)
+    anykw = (argspec.keywords is not None)
+    return (k, v, ('m' in argspec.args or anykw,
+                   'd' in argspec.args or anykw,
+                   'x' in argspec.args or anykw))
 
-    logger.debug("make_bin_release_info: lst=%r", lst)
+def _make_bin_release_info(m, rules, innerkwargs):
+    # `rules` is a list of rules compiled with _compile_rule()
+
+    logger.debug("make_bin_release_info: rules=%r", rules)
 
     args = {}
-    for k,v in lst+innerkwargs.items():
+    for (k, v, wanted_args) in rules:
         val = None
-        if (type(v).__name__ == 'function'):
-            argspec = inspect.getargspec(v)
+        if wanted_args is not None:
             valargs = {}
-            if ('m' in argspec.args or argspec.keywords is not None):
+            if wanted_args[0]:
                 valargs['m'] = m;
-            if ('d' in argspec.args or argspec.keywords is not None):
+            if wanted_args[1]:
                 valargs['d'] = innerkwargs;
-            if ('x' in argspec.args or argspec.keywords is not None):
+            if wanted_args[2]:
                 valargs['x'] = args; # determined args so far
 
             val = v(**valargs)
@@ -350,21 +595,26 @@ def relpattern(re_pattern, reltype=RELTYPE_UNKNOWN, platform=None, **kwargs):
             return IgnoreArgument
     
     """
-    # fix the values with default parameters
-    return (re_pattern,
-            (lambda m, filename, url, version=None,
-             _fix_plat=platform, _fix_rtyp=reltype, _fix_kwargs=copy.deepcopy(kwargs), **innerkwargs:
-             _make_bin_release_info(m,
-                                    [ ('version',version) ] +
-                                    _fix_kwargs.items() +
-                                    [ ('filename', filename),
-                                      ('url', url),
-                                      ('platform',_fix_plat),
-                                      ('reltype',_fix_rtyp) ],
-                                    innerkwargs
-                                    )
-             )
-            )
+    return (re_pattern, _RelPatternRules(platform, reltype, copy.deepcopy(kwargs)))
+
+
+class _RelPatternRules(object):
+    # The callable part of a relpattern(). The signatures of the callable rules are
+    # inspected once, here, rather than for each release file.
+    def __init__(self, platform, reltype, kwargs):
+        self.fixed_rules = [ _compile_rule(k, v) for (k, v) in kwargs.items() ]
+        self.platform_rule = _compile_rule('platform', platform)
+        self.reltype_rule = _compile_rule('reltype', reltype)
+
+    def __call__(self, m, filename, url, version=None, **innerkwargs):
+        rules = ([ ('version', version, None) ] +
+                 self.fixed_rules +
+                 [ ('filename', filename, None),
+                   ('url', url, None),
+                   self.platform_rule,
+                   self.reltype_rule ] +
+                 [ _compile_rule(k, v) for (k, v) in innerkwargs.items() ])
+        return _make_bin_release_info(m, rules, innerkwargs)
 
 
 class ReleaseInfoFromNameStrategy(object):
@@ -391,6 +641,11 @@ class ReleaseInfoFromNameStrategy(object):
     the URL at which the release can be accessed, and any keyword arguments that should be
     passed to the :py:class:`BinReleaseInfo` constructor. The callable should return a new
     :py:class:`BinReleaseInfo` instance.
+
+    The results are remembered (for up to :py:data:`NAMING_STRATEGY_CACHE_SIZE` different
+    files), so that identifying the same file again with the same information (e.g. from
+    a cached releases listing) doesn't go through the patterns again. The callables should
+    thus only depend on their arguments.
     """
     def __init__(self, patterns, *args, **kwargs):
         """
@@ -401,6 +656,7 @@ class ReleaseInfoFromNameStrategy(object):
         `*args` and `**kwargs` are simply passed on to the base class untouched.
         """
         self.patterns = [(_maybe_compile_re(r), cal) for (r, cal) in patterns]
+        self._cache = {}
         super(ReleaseInfoFromNameStrategy, self).__init__(*args, **kwargs)
 
     def get_release_info(self, filename, url, **kwargs):
@@ -418,19 +674,92 @@ class ReleaseInfoFromNameStrategy(object):
         If none of the patterns matched, then `None` is returned.
         """
 
+        key = _release_info_key(filename, url, kwargs)
+        if key is not None:
+            rinfo = self._cache.get(key, _NOT_CACHED)
+            if rinfo is not _NOT_CACHED:
+                if rinfo is None:
+                    return None
+                # the caller may modify the object it gets
+                rinfo = copy.copy(rinfo)
+                if isinstance(kwargs.get('checksums'), ChecksumsFile):
+                    # the key only has its URL; use the caller's object, which may have
+                    # been fetched already
+                    rinfo.checksums = kwargs['checksums']
+                if isinstance(kwargs.get('release'), dict):
+                    # likewise, the key only identifies the release
+                    rinfo.release = kwargs['release']
+                return rinfo
+
         logger.debug("Trying to match filename %r to get info. kwargs=%r", filename, kwargs)
-        
+
+        rinfo = None
         for (pat,cal) in self.patterns:
-            m = re.search(pat, filename)
+            m = pat.search(filename)
             if m is None:
                 continue
 
             rinfo = cal(m, filename, url, **kwargs)
             logger.debug("Got release info: %r", rinfo)
-            return rinfo
+            break
+        else:
+            logger.warning("Can't identify info for release file named %s!" %(filename))
+
+        if key is not None:
+            if len(self._cache) >= NAMING_STRATEGY_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[key] = rinfo
+            if rinfo is not None:
+                rinfo = copy.copy(rinfo)
+
+        return rinfo
+
+
+NAMING_STRATEGY_CACHE_SIZE = 4096
+"""
+The maximum number of release files whose information a
+:py:class:`ReleaseInfoFromNameStrategy` remembers.
+"""
 
-        logger.warning("Can't identify info for release file named %s!" %(filename))
+_NOT_CACHED = object()
+
+def _release_info_key(filename, url, kwargs):
+    # a hashable key for the arguments of get_release_info(), or None if some argument
+    # can't be hashed. (Lists, e.g. of delta patches, are converted to tuples, and a
+    # ChecksumsFile, which is created anew for each listing, to its URL. The release
+    # dictionary, shared by all files of the release, is keyed on the release's tag and
+    # URL rather than on its whole contents, which include the release notes.)
+    release = kwargs.get('release')
+    if isinstance(release, dict):
+        kwargs = dict(kwargs)
+        kwargs['release'] = _release_identity(release)
+    if not isinstance(kwargs.get('checksums'), ChecksumsFile):
+        try:
+            return (filename, url, frozenset(kwargs.iteritems()))
+        except TypeError:
+            pass
+    key = (filename, url, frozenset([ (k, _frozen_value(v)) for (k, v) in kwargs.iteritems() ]))
+    try:
+        hash(key)
+    except TypeError:
         return None
+    return key
+
+def _release_identity(release):
+    ident = (release.get('rel_tag_name'), release.get('rel_html_url'))
+    if ident == (None, None):
+        # not a release we can identify (e.g. from a custom update source)
+        return _frozen_value(release)
+    return ('release',) + ident
+
+def _frozen_value(v):
+    if isinstance(v, list):
+        return (list, tuple([ _frozen_value(x) for x in v ]))
+    if isinstance(v, dict):
+        return (dict, tuple(sorted([ (k, _frozen_value(x)) for (k, x) in v.iteritems() ])))
+    if isinstance(v, ChecksumsFile):
+        return (ChecksumsFile, v.url, v.default_filename)
+    return v
 
 def _maybe_compile_re(r, flags=re.IGNORECASE):
     if (isinstance(r, type(re.compile('')))):
@@ -514,6 +843,77 @@ _default_naming_strategy_patterns = (
 
 
 
+# Some files published with a release are not release files themselves, but accompany a
+# release file:
+#
+#   - Binary delta patches are named '<release file name>.from-<old version>.bsdiff',
+#     e.g. 'myapp-1.1-linux.from-1.0.bsdiff' rebuilds 'myapp-1.1-linux' from the 1.0
+#     executable. See upd_delta.
+#
+#   - File manifests are named '<release file name>.manifest.json', e.g.
+#     'myapp-1.1-linux.zip.manifest.json'. See upd_manifest.
+#
+#   - Chunk indexes are named '<release file name>.chunks.json'. See upd_chunks.
+#
+#   - Checksums are either given for a single file as '<release file name>.sha256' (or
+#     .sha1, .sha512, .md5), or for all files of the release in a file named like
+#     'SHA256SUMS', 'sha256sums.txt' or 'myapp-1.1-checksums.txt'. See ChecksumsFile.
+
+_rx_delta_patch = re.compile(r'^(?P<target>.+)\.from-(?P<from_version>\d[\w.-]*?)\.bsdiff$', re.IGNORECASE)
+_rx_manifest = re.compile(r'^(?P<target>.+)\.manifest\.json$', re.IGNORECASE)
+_rx_chunk_index = re.compile(r'^(?P<target>.+)\.chunks\.json$', re.IGNORECASE)
+_rx_checksum = re.compile(r'^(?P<target>.+)\.(sha1|sha256|sha512|md5)$', re.IGNORECASE)
+_rx_checksums_list = re.compile(r'^((sha1|sha256|sha512|md5)sums(\.txt)?|(.*[._-])?checksums\.txt)$', re.IGNORECASE)
+
+def _split_companion_files(files):
+    """
+    Set aside the files which accompany a release file (see above).
+
+    `files` is a list of tuples `(filename, url, ...)`. Returns a tuple `(relfiles,
+    companions)`, where `relfiles` is the list of the remaining tuples, and `companions`
+    is a dictionary mapping release file names to a dictionary of additional keyword
+    arguments for the `BinReleaseInfo` constructor (`delta_patches`, `manifest_url`,
+    `chunk_index_url` and `checksums`).
+    """
+    relfiles = []
+    companions = {}
+    release_checksums = None
+    for f in files:
+        (filename, url) = f[:2]
+        m = _rx_delta_patch.match(filename)
+        if m is not None:
+            d = companions.setdefault(m.group('target'), {})
+            d.setdefault('delta_patches', []).append(
+                DeltaPatchInfo(from_version=m.group('from_version'), filename=filename, url=url)
+                )
+            continue
+        m = _rx_manifest.match(filename)
+        if m is not None:
+            companions.setdefault(m.group('target'), {})['manifest_url'] = url
+            continue
+        m = _rx_chunk_index.match(filename)
+        if m is not None:
+            companions.setdefault(m.group('target'), {})['chunk_index_url'] = url
+            continue
+        m = _rx_checksum.match(filename)
+        if m is not None:
+            companions.setdefault(m.group('target'), {})['checksums'] = \
+                ChecksumsFile(url, default_filename=m.group('target'))
+            continue
+        if _rx_checksums_list.match(filename):
+            release_checksums = ChecksumsFile(url)
+            continue
+        relfiles.append(f)
+
+    if release_checksums is not None:
+        for f in relfiles:
+            companions.setdefault(f[0], {}).setdefault('checksums', release_checksums)
+
+    return (relfiles, companions)
+
+
+
+
 
 
 # -------------------------------------------------------
@@ -586,6 +986,13 @@ class UpdateLocalDirectorySource(UpdateSource):
         super(UpdateLocalDirectorySource, self).__init__(*args, **kwargs)
 
 
+    def source_identity(self):
+        """
+        Reimplemented from :py:meth:`UpdateSource.source_identity`.
+        """
+        return 'local:' + os.path.abspath(self.source_directory)
+
+
     def get_releases(self, newer_than_version=None, **kwargs):
 
         try:
@@ -619,12 +1026,23 @@ class UpdateLocalDirectorySource(UpdateSource):
 
             try:
                 # list files in that directory.
+                fnlist = []
                 for fn in os.listdir(base):
+                    if os.path.isdir(os.path.join(base,fn)):
+                        # e.g. the files of a file manifest
+                        continue
                     fnurl = util.path2url(os.path.join(base,fn))
                     logger.debug("base path %s ->  url path: %s", os.path.join(base,fn), fnurl)
+                    fnlist.append((fn, fnurl))
+
+                (fnlist, companions) = _split_companion_files(fnlist)
+
+                for (fn, fnurl) in fnlist:
                     inf = self.naming_strategy.get_release_info(filename=fn,
                                                                 url=fnurl,
                                                                 version=ver,
+                                                                size=os.path.getsize(os.path.join(base,fn)),
+                                                                **companions.get(fn, {})
                                                                 )
                     if inf is not None and self.test_release_filters(inf):
                         inf_list.append(inf)
@@ -633,10 +1051,11 @@ class UpdateLocalDirectorySource(UpdateSource):
 
 
         # debug: list found versions
-        logger.debug("Found releases:\n"+
-                     "\n".join(["\t* %s, %s (%r)" %(r.get_filename(), r.get_version(), r.__dict__)
-                                for r in inf_list])
-                     )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Found releases:\n"+
+                         "\n".join(["\t* %s, %s (%r)" %(r.get_filename(), r.get_version(), r)
+                                    for r in inf_list])
+                         )
         
         # return the list of releases
         return inf_list
@@ -659,8 +1078,26 @@ class UpdateGithubReleasesSource(UpdateSource):
     """
     Updates will be searched for in as releases of a github repo.
     """
+
+    PAGE_SIZE = 100
+    """
+    The number of releases requested per page of the github releases listing (100 is the
+    maximum allowed by github).
+    """
+
+    API_BASE_URL = 'https://api.github.com'
+    """
+    The default base URL of the github API.
+    """
+
+    DOWNLOAD_BASE_URL = 'https://github.com'
+    """
+    The default base URL from which release files are downloaded.
+    """
     
-    def __init__(self, github_user_repo, naming_strategy=None, *args, **kwargs):
+    def __init__(self, github_user_repo, naming_strategy=None, cache_dir=None,
+                 api_base_url=None, download_base_url=None, mirror_base_urls=None,
+                 *args, **kwargs):
         """
         Arguments:
             
@@ -672,6 +1109,22 @@ class UpdateGithubReleasesSource(UpdateSource):
               to use the default patterns. It may also be a list of patterns, which will
               be used as the argument to a new :py:class:`ReleaseInfoFromNameStrategy`
               instance.
+
+            - `cache_dir`: a directory in which the last releases listing is kept, so
+              that the next check can use a conditional request (see
+              :py:meth:`get_releases`). By default, a directory in the user's cache
+              directory is used. Set this to `False` to disable the cache.
+
+            - `api_base_url`, `download_base_url`: the base URLs of the github API and of
+              the release file downloads, by default :py:attr:`API_BASE_URL` and
+              :py:attr:`DOWNLOAD_BASE_URL`. These may be changed e.g. to use a github
+              enterprise server, or a local server for testing.
+
+            - `mirror_base_urls`: a list of base URLs of servers which mirror the release
+              files, with the same layout as the `download_base_url`
+              (``<base>/<user>/<repo>/releases/download/<tag>/<filename>``). The release
+              files may then be downloaded from any of them (see the `mirror_urls` of
+              :py:class:`BinReleaseInfo`).
         """
 
         if (naming_strategy is None):
@@ -679,12 +1132,26 @@ class UpdateGithubReleasesSource(UpdateSource):
         if (not isinstance(naming_strategy, ReleaseInfoFromNameStrategy)):
             naming_strategy = ReleaseInfoFromNameStrategy(naming_strategy)
 
+        if cache_dir is None:
+            cache_dir = os.path.join(util.user_cache_dir('updater4pyi'), 'github')
+
         self.naming_strategy = naming_strategy
         self.github_user_repo = github_user_repo
+        self.cache_dir = cache_dir
+        self.api_base_url = (api_base_url or self.API_BASE_URL).rstrip('/')
+        self.download_base_url = (download_base_url or self.DOWNLOAD_BASE_URL).rstrip('/')
+        self.mirror_base_urls = [ u.rstrip('/') for u in (mirror_base_urls or []) ]
 
         super(UpdateGithubReleasesSource, self).__init__(*args, **kwargs)
 
 
+    def source_identity(self):
+        """
+        Reimplemented from :py:meth:`UpdateSource.source_identity`.
+        """
+        return 'github:' + self.github_user_repo
+
+
     def get_releases(self, newer_than_version=None, **kwargs):
         """
         Reimplemented from :py:meth:`UpdateSource.get_releases`.
@@ -704,37 +1171,30 @@ class UpdateGithubReleasesSource(UpdateSource):
             rel_html_url         = the 'html_url' field of the release JSON dictionary
             relfile_content_type = the 'content_type' field of the asset JSON dictionary
 
+        The listing is requested in pages of :py:attr:`PAGE_SIZE` releases, most recent
+        first. The next page is only requested if all the releases so far are newer than
+        `newer_than_version`, so that the check only costs as much as there are new
+        releases, and not as much as the history of the repository.
+
+        The last listing is kept in the `cache_dir` given to the constructor, along with
+        the `ETag` and `Last-Modified` headers of the response. The next check sends a
+        conditional request, and if github replies that nothing changed (`304 Not
+        Modified`, which doesn't count towards github's API rate limit), the cached
+        listing is used.
+
         .. _Github API Documentation: https://developer.github.com/v3/repos/releases/
         """
 
         # get repo releases.
 
-        url = 'https://api.github.com/repos/'+self.github_user_repo+'/releases'
-
-        try:
-            fdata = upd_downloader.url_opener.open(url)
-        except urllib2.URLError as e:
-            logger.warning("Can't connect to github for software update check: %s", e)
-            return None
-
-        try:
-            data = json.load(fdata);
-        except ValueError:
-            logger.warning("Unable to parse data returned by github at %s!", url)
-            return None
-
-        if (isinstance(data, dict)):
-            logger.warning("Error: %s" %(data.get('message', '<no message provided>')))
-            return None
-
-        if (not isinstance(data, list)):
-            logger.warning("Expected list response from github: %r", data)
-            return None
-
         newer_than_version_parsed = None
         if (newer_than_version is not None):
             newer_than_version_parsed = util.parse_version(newer_than_version)
 
+        data = self._fetch_releases(newer_than_version_parsed)
+        if data is None:
+            return None
+
         inf_list = []
         
         for relinfo in data:
@@ -744,11 +1204,15 @@ class UpdateGithubReleasesSource(UpdateSource):
             rel_desc = relinfo.get('body', None)
             rel_date = relinfo.get('published_at', None)
             
-            # release version from tag name
-            # strip starting 'v' if present
-            relver = '0.0-unknown'
-            if tag_name:
-                relver = (tag_name[1:] if tag_name[0] == 'v' else tag_name)
+            relver = _github_release_version(relinfo)
+
+            # information about the release as a whole, shared by all its files
+            release_data = {
+                'rel_name': rel_name,
+                'rel_description': rel_desc,
+                'rel_tag_name': tag_name,
+                'rel_html_url': html_url,
+                }
 
             if (newer_than_version_parsed is not None and
                 util.parse_version(relver) <= newer_than_version_parsed):
@@ -756,40 +1220,684 @@ class UpdateGithubReleasesSource(UpdateSource):
                 continue
                 
             relfiles = relinfo.get('assets', {})
-            for relfile in relfiles:
+
+            # set aside delta patches and file manifests, they are attached to the
+            # release file they refer to.
+            (relfiles, companions) = _split_companion_files(
+                [ (relfile.get('name'), self._download_url(tag_name, relfile.get('name')), relfile)
+                  for relfile in relfiles
+                  if relfile.get('name', None) ]
+                )
+
+            for (_, _, relfile) in relfiles:
 
                 relfn = relfile.get('name', None)
                 rellabel = relfile.get('label', None)
                 relcontenttype = relfile.get('content_type', None)
                 # build up the download URL
-                relurl = 'https://github.com/'+self.github_user_repo+'/releases/download/'+tag_name+'/'+relfn;
+                relurl = self._download_url(tag_name, relfn)
 
                 inf = self.naming_strategy.get_release_info(filename=relfn,
                                                             url=relurl,
                                                             version=relver,
+                                                            size=relfile.get('size', None),
+                                                            digest=relfile.get('digest', None),
+                                                            release=release_data,
+                                                            mirror_urls=self._mirror_urls(tag_name, relfn),
                                                             # additional info:
-                                                            rel_name=rel_name,
                                                             relfile_label=rellabel,
-                                                            rel_description=rel_desc,
                                                             relfile_content_type=relcontenttype,
-                                                            rel_tag_name=tag_name,
-                                                            rel_html_url=html_url,
+                                                            **companions.get(relfn, {})
                                                             )
                 if self.test_release_filters(inf):
                     inf_list.append(inf)
 
         # debug: list found versions
-        logger.debug("Found releases:\n"+
-                     "\n".join(["\t* %s, %s (%r)" %(r.get_filename(), r.get_version(), r.__dict__)
-                                for r in inf_list])
-                     )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Found releases:\n"+
+                         "\n".join(["\t* %s, %s (%r)" %(r.get_filename(), r.get_version(), r)
+                                    for r in inf_list])
+                         )
         
         # return the list of releases
         return inf_list
+
+
+    def _fetch_releases(self, newer_than_version_parsed):
+        # Returns the list of releases, each trimmed to the fields we use (see
+        # _trim_release()), or None if there was an error. The list contains at least all
+        # releases newer than newer_than_version_parsed (or all releases if that's None).
+
+        url = (self.api_base_url+'/repos/'+self.github_user_repo+'/releases?per_page=%d'
+               %(self.PAGE_SIZE))
+
+        cached = self._load_cached_listing(url)
+
+        req = urllib2.Request(url)
+        if cached is not None:
+            if cached.get('etag'):
+                req.add_header('If-None-Match', cached['etag'])
+            if cached.get('last_modified'):
+                req.add_header('If-Modified-Since', cached['last_modified'])
+
+        try:
+            fdata = upd_downloader.url_opener.open(req)
+        except urllib2.HTTPError as e:
+            if e.code == 304 and cached is not None:
+                e.close()
+                logger.debug("Releases listing at %s not modified, using cached listing.", url)
+                fdata = None
+            else:
+                logger.warning("Can't connect to github for software update check: %s", e)
+                return None
+        except urllib2.URLError as e:
+            logger.warning("Can't connect to github for software update check: %s", e)
+            return None
+
+        if fdata is None:
+            listing = cached
+        else:
+            page = self._read_page(url, fdata)
+            if page is None:
+                return None
+            (releases, next_url) = page
+            headers = fdata.info()
+            listing = {
+                'url': url,
+                'etag': headers.getheader('ETag'),
+                'last_modified': headers.getheader('Last-Modified'),
+                'releases': releases,
+                'next_url': next_url,
+                }
+
+        if fdata is None and not self._need_next_page(listing, newer_than_version_parsed):
+            return listing['releases']
+
+        # follow the next pages, as long as there may be newer releases there
+        while self._need_next_page(listing, newer_than_version_parsed):
+            next_url = listing['next_url']
+            logger.debug("Fetching next page of releases listing %s", next_url)
+            try:
+                page = self._read_page(next_url, upd_downloader.url_opener.open(next_url))
+            except urllib2.URLError as e:
+                logger.warning("Can't fetch releases listing page %s: %s", next_url, e)
+                page = None
+            if page is None:
+                # go with what we have
+                break
+            listing['releases'] = listing['releases'] + page[0]
+            listing['next_url'] = page[1]
+
+        self._save_cached_listing(url, listing)
+
+        return listing['releases']
+
+    def _need_next_page(self, listing, newer_than_version_parsed):
+        return (listing.get('next_url') and
+                not self._listing_covers(listing, newer_than_version_parsed))
+
+    def _listing_covers(self, listing, newer_than_version_parsed):
+        # the listing is ordered from the most recent release. If we have seen an older
+        # release, we don't need to look further.
+        if newer_than_version_parsed is None:
+            return not listing.get('next_url')
+        return bool([ True for rel in listing['releases']
+                      if util.parse_version(_github_release_version(rel)) <= newer_than_version_parsed ])
+
+    def _read_page(self, url, fdata):
+        # read a page of the releases listing. Returns (releases, next_page_url), or None
+        # if there was an error. The releases are parsed and trimmed as they come in. The
+        # whole page is read even if it contains older releases: a release which was
+        # backported may be listed before newer releases of the same page.
+        releases = []
+        try:
+            for relinfo in util.iter_json_array(fdata, raw_decode=_timed_json_raw_decode):
+                if not isinstance(relinfo, dict):
+                    raise ValueError("Expected a release object, got %r" %(relinfo))
+                releases.append(_trim_release(relinfo))
+        except util.NotAJsonArray as e:
+            if (isinstance(e.value, dict)):
+                logger.warning("Error: %s" %(e.value.get('message', '<no message provided>')))
+            else:
+                logger.warning("Expected list response from github: %r", e.value)
+            return None
+        except ValueError:
+            logger.warning("Unable to parse data returned by github at %s!", url)
+            return None
+        finally:
+            fdata.close()
+
+        return (releases, _link_next_url(fdata.info().getheader('Link')))
+
+    def _cached_listing_file(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(util.utf8_str(url)).hexdigest() + '.json')
+
+    def _load_cached_listing(self, url):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._cached_listing_file(url), 'r') as f:
+                cached = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if (not isinstance(cached, dict) or cached.get('url') != url or
+            not isinstance(cached.get('releases'), list)):
+            return None
+        return cached
+
+    def _save_cached_listing(self, url, cached):
+        if not self.cache_dir or not (cached.get('etag') or cached.get('last_modified')):
+            return
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(self._cached_listing_file(url), 'w') as f:
+                json.dump(cached, f)
+        except (IOError, OSError) as e:
+            logger.warning("Can't save releases listing to cache: %s", e)
+
+    def _download_url(self, tag_name, filename, base_url=None):
+        return ((base_url or self.download_base_url)+'/'+self.github_user_repo+'/releases/download/'
+                +tag_name+'/'+filename)
+
+    def _mirror_urls(self, tag_name, filename):
+        # (a tuple, so that the naming strategy can hash it)
+        return tuple([ self._download_url(tag_name, filename, base_url=base)
+                       for base in self.mirror_base_urls ])
+
     
 
 
 
+# ---------------------------------------------------------------------------
+
+
+MULTI_SOURCE_FIRST = 'first'
+"""
+:py:class:`MultiUpdateSource` mode: return the releases of the first source which
+answers.
+"""
+
+MULTI_SOURCE_MERGE = 'merge'
+"""
+:py:class:`MultiUpdateSource` mode: query all sources at once, and merge their releases.
+"""
+
+DEFAULT_HEDGE_DELAY = 2.0
+"""
+Default number of seconds after which :py:class:`MultiUpdateSource` queries the next
+source, if the previous ones haven't answered yet.
+"""
+
+DEFAULT_MULTI_SOURCE_TIMEOUT = 20.0
+"""
+Default number of seconds after which :py:class:`MultiUpdateSource` stops waiting for its
+sources.
+"""
+
+
+class MultiUpdateSource(UpdateSource):
+    """
+    An update source which gets its releases from several other sources, e.g. github and a
+    mirror on an internal server, so that a slow or unreachable source doesn't stall the
+    update check. Each source is queried in its own thread.
+
+    In :py:data:`MULTI_SOURCE_FIRST` mode, the sources are queried in the given order: the
+    first source is queried, and if it hasn't answered after `hedge_delay` seconds, or if
+    it failed, the next source is queried too, and so on. The releases of the first source
+    which answers are returned. (With a `hedge_delay` of zero, all sources are queried at
+    once.)
+
+    In :py:data:`MULTI_SOURCE_MERGE` mode, all sources are queried at once, and the
+    releases of all sources which answered are returned. A release file (identified by its
+    version and its file name) which several sources provide is only returned once, as
+    given by the first source in the list.
+
+    We give up waiting for the sources after `timeout` seconds (or never, if `timeout` is
+    `None`), and return what we have got by then. Sources which fail or return `None` are
+    ignored; if none of them returned releases, `None` is returned.
+
+    Add release filters to this object; they are applied to the releases of all sources.
+    """
+    def __init__(self, sources, mode=MULTI_SOURCE_FIRST, hedge_delay=DEFAULT_HEDGE_DELAY,
+                 timeout=DEFAULT_MULTI_SOURCE_TIMEOUT, *args, **kwargs):
+        """
+        Get releases from the :py:class:`UpdateSource` objects in the list `sources`, in
+        order of preference. See the class documentation for the other arguments.
+        """
+        if not sources:
+            raise ValueError("MultiUpdateSource: no sources given")
+        if mode not in (MULTI_SOURCE_FIRST, MULTI_SOURCE_MERGE):
+            raise ValueError("MultiUpdateSource: invalid mode %r" %(mode))
+
+        self.sources = list(sources)
+        self.mode = mode
+        self.hedge_delay = hedge_delay
+        self.timeout = timeout
+
+        super(MultiUpdateSource, self).__init__(*args, **kwargs)
+
+
+    def source_identity(self):
+        """
+        Reimplemented from :py:meth:`UpdateSource.source_identity`. The identity is made of
+        the identities of all sources, or is `None` if one of them has no identity.
+        """
+        identities = [ src.source_identity() for src in self.sources ]
+        if None in identities:
+            return None
+        return 'multi-%s:' %(self.mode) + '|'.join(identities)
+
+    def get_releases(self, newer_than_version=None, **kwargs):
+        """
+        Reimplemented from :py:meth:`UpdateSource.get_releases`. Queries the sources as
+        described in the class documentation.
+        """
+        query = _MultiSourceQuery(self.sources, newer_than_version, kwargs)
+        if self.mode == MULTI_SOURCE_FIRST:
+            releases = query.first(self.hedge_delay, self.timeout)
+        else:
+            releases = query.merge(self.timeout)
+
+        if releases is None:
+            return None
+
+        return [ inf for inf in releases if self.test_release_filters(inf) ]
+
+
+_PENDING = object()
+
+class _MultiSourceQuery(object):
+    # the state of a MultiUpdateSource.get_releases() call. The sources which are still
+    # running when we return are simply left to finish in their threads.
+
+    def __init__(self, sources, newer_than_version, kwargs):
+        self.sources = sources
+        self.newer_than_version = newer_than_version
+        self.kwargs = kwargs
+        self.report = upd_timing.current_report()
+        self.cond = threading.Condition()
+        self.answers = [ _PENDING ] * len(sources)
+        self.answer_order = []
+        self.nstarted = 0
+
+    def _start_next(self):
+        i = self.nstarted
+        self.nstarted += 1
+        logger.debug("Querying update source %r", self.sources[i])
+        t = threading.Thread(target=self._query, args=(i,))
+        t.daemon = True
+        t.start()
+
+    def _query(self, i):
+        src = self.sources[i]
+        try:
+            with upd_timing.reporting(self.report):
+                releases = src.get_releases(newer_than_version=self.newer_than_version, **self.kwargs)
+        except Exception as e:
+            logger.warning("Update source %r failed: %s", src, e)
+            releases = None
+        with self.cond:
+            self.answers[i] = releases
+            self.answer_order.append(i)
+            self.cond.notify_all()
+
+    def _wait(self, until):
+        # wait for an answer, at most until the given time (or indefinitely if None).
+        # Returns False if that time has passed.
+        if until is None:
+            self.cond.wait()
+            return True
+        remaining = until - time.time()
+        if remaining <= 0:
+            return False
+        self.cond.wait(remaining)
+        return True
+
+    def first(self, hedge_delay, timeout):
+        deadline = (time.time() + timeout if timeout is not None else None)
+        with self.cond:
+            self._start_next()
+            next_hedge = time.time() + hedge_delay
+            while True:
+                for i in self.answer_order:
+                    if self.answers[i] is not None:
+                        logger.debug("Got releases from update source %r", self.sources[i])
+                        return self.answers[i]
+                if len(self.answer_order) == len(self.sources):
+                    return None
+                if self.nstarted < len(self.sources):
+                    if len(self.answer_order) == self.nstarted or time.time() >= next_hedge:
+                        # all running sources failed, or they are slow: try the next one
+                        self._start_next()
+                        next_hedge = time.time() + hedge_delay
+                        continue
+                    until = (min(next_hedge, deadline) if deadline is not None else next_hedge)
+                else:
+                    until = deadline
+                if (not self._wait(until) and deadline is not None and time.time() >= deadline):
+                    logger.warning("Update sources didn't answer within %g seconds", timeout)
+                    return None
+
+    def merge(self, timeout):
+        deadline = (time.time() + timeout if timeout is not None else None)
+        with self.cond:
+            while self.nstarted < len(self.sources):
+                self._start_next()
+            while len(self.answer_order) < len(self.sources):
+                if not self._wait(deadline):
+                    logger.warning("Some update sources didn't answer within %g seconds", timeout)
+                    break
+            answers = list(self.answers)
+
+        releases = None
+        seen = set()
+        for lst in answers:
+            if lst is _PENDING or lst is None:
+                continue
+            if releases is None:
+                releases = []
+            for inf in lst:
+                key = (inf.get_parsed_version(), inf.get_filename())
+                if key in seen:
+                    continue
+                seen.add(key)
+                releases.append(inf)
+        return releases
+
+
+# ---------------------------------------------------------------------------
+
+
+DEFAULT_CACHE_TTL = 15*60
+"""
+Default number of seconds during which :py:class:`CachingUpdateSource` serves cached
+releases without asking the source.
+"""
+
+DEFAULT_CACHE_STALE_TTL = 24*3600
+"""
+Default number of seconds after the TTL has expired during which
+:py:class:`CachingUpdateSource` still serves the cached releases, while it refreshes them
+in the background.
+"""
+
+DEFAULT_CACHE_MAX_ENTRIES = 32
+DEFAULT_CACHE_MAX_SIZE = 1024*1024
+
+
+class CachingUpdateSource(UpdateSource):
+    """
+    An update source which caches the releases returned by another source on disk, so
+    that repeated update checks (e.g. after restarting the program, or when the user
+    clicks "check now" several times) don't need to query the source each time.
+
+    Cached releases are kept for each `newer_than_version` given to
+    :py:meth:`get_releases`:
+
+        - if they are younger than `ttl` seconds, they are returned as is;
+
+        - if they are younger than `ttl + stale_ttl` seconds, they are returned as is, but
+          they are refreshed by querying the source in a background thread;
+
+        - otherwise, the source is queried.
+
+    The least recently used entries are removed when there are more than `max_entries`
+    entries or when they take more than `max_size` bytes.
+
+    Only releases which are plain :py:class:`BinReleaseInfo` instances, whose additional
+    attributes can be stored in JSON, are cached. Otherwise, the source is queried each
+    time.
+
+    Add release filters to this object, not to the wrapped source: the filters are
+    applied to the cached releases at each call, so that changing a filter (e.g. to
+    include beta releases) takes effect immediately.
+    """
+    def __init__(self, source, cache_dir=None, identity=None, ttl=DEFAULT_CACHE_TTL,
+                 stale_ttl=DEFAULT_CACHE_STALE_TTL, max_entries=DEFAULT_CACHE_MAX_ENTRIES,
+                 max_size=DEFAULT_CACHE_MAX_SIZE, *args, **kwargs):
+        """
+        Cache the releases of the :py:class:`UpdateSource` `source` in the directory
+        `cache_dir` (by default, in the user's cache directory). The cached releases are
+        identified by `identity`, by default the :py:meth:`UpdateSource.source_identity`
+        of `source`.
+        """
+        if identity is None:
+            identity = source.source_identity()
+        if identity is None:
+            raise ValueError("CachingUpdateSource: can't identify source %r, please specify identity="
+                             %(source))
+        if cache_dir is None:
+            cache_dir = os.path.join(util.user_cache_dir('updater4pyi'), 'releases')
+
+        self.source = source
+        self.cache_dir = cache_dir
+        self.identity = identity
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._refreshing = set()
+
+        super(CachingUpdateSource, self).__init__(*args, **kwargs)
+
+
+    def source_identity(self):
+        """
+        Reimplemented from :py:meth:`UpdateSource.source_identity`.
+        """
+        return self.identity
+
+    def get_releases(self, newer_than_version=None, **kwargs):
+        """
+        Reimplemented from :py:meth:`UpdateSource.get_releases`. Returns the cached
+        releases, or queries the wrapped source, as described in the class documentation.
+        """
+        fn = self._cache_file(newer_than_version)
+        entry = self._load(fn)
+        age = (time.time() - entry['time'] if entry is not None else None)
+
+        if entry is None or age < 0 or age >= self.ttl + self.stale_ttl:
+            releases = self._refresh(newer_than_version, **kwargs)
+        else:
+            releases = entry['releases']
+            if age < self.ttl:
+                logger.debug("Using cached releases (%d seconds old)", age)
+            else:
+                logger.debug("Using stale cached releases (%d seconds old), refreshing", age)
+                self._refresh_in_background(newer_than_version, **kwargs)
+
+        if releases is None:
+            return None
+
+        return [ inf for inf in releases if self.test_release_filters(inf) ]
+
+    def clear(self):
+        """
+        Remove all the cached releases of this source.
+        """
+        prefix = self._cache_prefix()
+        for fn in self._cache_files():
+            if os.path.basename(fn).startswith(prefix):
+                util.ignore_exc(lambda : os.unlink(fn), OSError)
+
 
+    def _refresh(self, newer_than_version, **kwargs):
+        releases = self.source.get_releases(newer_than_version=newer_than_version, **kwargs)
+        if releases is not None:
+            self._store(self._cache_file(newer_than_version), releases)
+        return releases
 
+    def _refresh_in_background(self, newer_than_version, **kwargs):
+        with self._lock:
+            if newer_than_version in self._refreshing:
+                return
+            self._refreshing.add(newer_than_version)
 
+        def run():
+            try:
+                self._refresh(newer_than_version, **kwargs)
+            except Exception as e:
+                logger.warning("Failed to refresh cached releases: %s", e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(newer_than_version)
+
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+
+    def _cache_prefix(self):
+        return hashlib.sha1(util.utf8_str(self.identity)).hexdigest()[:16] + '-'
+
+    def _cache_file(self, newer_than_version):
+        key = hashlib.sha1(util.utf8_str(repr(newer_than_version))).hexdigest()[:16]
+        return os.path.join(self.cache_dir, self._cache_prefix() + key + '.json')
+
+    def _cache_files(self):
+        try:
+            return [ os.path.join(self.cache_dir, fn) for fn in os.listdir(self.cache_dir)
+                     if fn.endswith('.json') ]
+        except OSError:
+            return []
+
+    def _load(self, fn):
+        try:
+            with open(fn, 'r') as f:
+                with upd_timing.phase(upd_timing.PHASE_JSON_PARSE):
+                    entry = json.load(f)
+                    entry['time'] = float(entry['time'])
+                    entry['releases'] = _release_infos_from_json(entry['releases'],
+                                                                 entry.get('release_data', []))
+            # mark as recently used
+            os.utime(fn, None)
+            return entry
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _store(self, fn, releases):
+        try:
+            (release_files, release_data) = _release_infos_to_json(releases)
+            data = json.dumps({
+                'identity': self.identity,
+                'time': time.time(),
+                'releases': release_files,
+                'release_data': release_data,
+                })
+        except (TypeError, ValueError) as e:
+            logger.debug("Can't cache releases: %s", e)
+            return
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmpfn = fn + '.%d-%d.tmp' %(os.getpid(), threading.current_thread().ident)
+            with open(tmpfn, 'w') as f:
+                f.write(data)
+            if os.path.exists(fn):
+                os.unlink(fn)
+            os.rename(tmpfn, fn)
+        except (IOError, OSError) as e:
+            logger.warning("Can't save cached releases: %s", e)
+            return
+        self._evict()
+
+    def _evict(self):
+        files = []
+        for fn in self._cache_files():
+            try:
+                st = os.stat(fn)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, fn))
+        files.sort(reverse=True)
+        total = 0
+        for (i, (mtime, size, fn)) in enumerate(files):
+            total += size
+            if i >= self.max_entries or total > self.max_size:
+                logger.debug("Evicting cached releases %s", fn)
+                util.ignore_exc(lambda : os.unlink(fn), OSError)
+
+
+def _release_infos_to_json(releases):
+    # Returns (release_files, release_data). The `release` information shared by several
+    # release files is stored once in release_data, and referred to by its index.
+    # Raises TypeError if a release can't be stored.
+    lst = []
+    release_data = []
+    release_index = {}
+    for inf in releases:
+        if type(inf) is not BinReleaseInfo:
+            raise TypeError("%s is not a plain BinReleaseInfo" %(inf.__class__.__name__))
+        d = inf.to_dict()
+        del d['release']
+        if inf.release is not None:
+            if id(inf.release) not in release_index:
+                release_index[id(inf.release)] = len(release_data)
+                release_data.append(inf.release)
+            d['release'] = release_index[id(inf.release)]
+        d['delta_patches'] = [ list(p) for p in inf.delta_patches ]
+        if inf.checksums is not None:
+            if not isinstance(inf.checksums, ChecksumsFile):
+                raise TypeError("Can't store checksums %r" %(inf.checksums))
+            d['checksums'] = [inf.checksums.url, inf.checksums.default_filename]
+        lst.append(d)
+    return (lst, release_data)
+
+def _release_infos_from_json(lst, release_data):
+    release_data = [ dict([ (str(k), v) for (k, v) in r.iteritems() ]) for r in release_data ]
+    checksums = {}
+    releases = []
+    for d in lst:
+        d = dict([ (str(k), v) for (k, v) in d.iteritems() ])
+        if d.get('release') is not None:
+            d['release'] = release_data[d['release']]
+        d['delta_patches'] = [ DeltaPatchInfo(*p) for p in d.get('delta_patches', []) ]
+        if d.get('checksums') is not None:
+            key = tuple(d['checksums'])
+            if key not in checksums:
+                checksums[key] = ChecksumsFile(*key)
+            d['checksums'] = checksums[key]
+        releases.append(BinReleaseInfo(**d))
+    return releases
+
+
+
+# the fields of the github API releases listing which we use
+_GITHUB_RELEASE_FIELDS = ('html_url', 'tag_name', 'name', 'body', 'published_at')
+_GITHUB_ASSET_FIELDS = ('name', 'label', 'content_type', 'size', 'digest')
+
+_json_decoder = json.JSONDecoder()
+
+def _timed_json_raw_decode(s, idx):
+    with upd_timing.phase(upd_timing.PHASE_JSON_PARSE):
+        return _json_decoder.raw_decode(s, idx)
+
+def _trim_release(relinfo):
+    # keep only the fields of a github release JSON dictionary which we use, so that the
+    # cached listing stays small.
+    rel = dict([ (k, relinfo[k]) for k in _GITHUB_RELEASE_FIELDS if k in relinfo ])
+    rel['assets'] = [ dict([ (k, a[k]) for k in _GITHUB_ASSET_FIELDS if k in a ])
+                      for a in relinfo.get('assets', []) ]
+    return rel
+
+
+def _github_release_version(relinfo):
+    # release version from tag name
+    # strip starting 'v' if present
+    tag_name = relinfo.get('tag_name', None)
+    if not tag_name:
+        return '0.0-unknown'
+    return (tag_name[1:] if tag_name[0] == 'v' else tag_name)
+
+
+def _link_next_url(link):
+    # find the rel="next" URL in a Link header, e.g.
+    #   <https://api.github.com/...&page=2>; rel="next", <https://...&page=5>; rel="last"
+    if not link:
+        return None
+    for m in re.finditer(r'<(?P<url>[^>]*)>(?P<params>[^,<]*)', link):
+        if re.search(r';\s*rel\s*=\s*"?([^"]*\s)?next(\s[^"]*)?"?', m.group('params')):
+            return m.group('url')
+    return None
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+#######################################################################################
+#                                                                                     #
+#   This file is part of the updater4pyi Project.                                     #
+#                                                                                     #
+#   Copyright (C) 2014, Philippe Faist                                                #
+#   philippe.faist@bluewin.ch                                                         #
+#   All rights reserved.                                                              #
+#                                                                                     #
+#   Redistribution and use in source and binary forms, with or without                #
+#   modification, are permitted provided that the following conditions are met:       #
+#                                                                                     #
+#   1. Redistributions of source code must retain the above copyright notice, this    #
+#      list of conditions and the following disclaimer.                               #
+#   2. Redistributions in binary form must reproduce the above copyright notice,      #
+#      this list of conditions and the following disclaimer in the documentation      #
+#      and/or other materials provided with the distribution.                         #
+#                                                                                     #
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND   #
+#   ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED     #
+#   WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE            #
+#   DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR   #
+#   ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES    #
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;      #
+#   LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND       #
+#   ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT        #
+#   (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS     #
+#   SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.                      #
+#                                                                                     #
+#######################################################################################
+
+
+
+"""
+Timing instrumentation for the update process.
+
+A :py:class:`TimingReport` records how much time the phases of an update check or of an
+update installation took (querying the source, downloading, extracting, installing,
+etc.; see the `PHASE_*` constants). :py:class:`upd_core.Updater` creates one for each
+call to :py:meth:`~upd_core.Updater.check_for_updates` and
+:py:meth:`~upd_core.Updater.install_update`, see
+:py:meth:`~upd_core.Updater.last_timing_report` and
+:py:meth:`~upd_core.Updater.add_timing_observer`.
+
+The report is made *current* for the thread which does the work (see :py:func:`reporting`),
+so that the code deep down (e.g. in the update sources or in the downloader) can simply
+time its work with ``with upd_timing.phase(...):``, which does nothing if no report is
+current.
+"""
+
+import time
+import threading
+import collections
+import contextlib
+
+
+PHASE_SOURCE_QUERY = 'source_query'
+PHASE_JSON_PARSE = 'json_parse'
+PHASE_RELEASE_SELECTION = 'release_selection'
+PHASE_CONNECT = 'connect'
+PHASE_MIRROR_PROBE = 'mirror_probe'
+PHASE_DOWNLOAD = 'download'
+PHASE_VERIFY = 'verify'
+PHASE_EXTRACT = 'extract'
+PHASE_CHMOD = 'chmod'
+PHASE_PERMISSIONS = 'permissions'
+PHASE_BACKUP_RENAME = 'backup_rename'
+PHASE_PRIVILEGED_INSTALL = 'privileged_install'
+PHASE_CLEANUP = 'cleanup'
+PHASE_REMOVE_BACKUP = 'remove_backup'
+
+
+class PhaseTiming(object):
+    """
+    The time spent in one phase: `seconds` in total, over `count` times.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.count = 0
+
+    def __repr__(self):
+        return "PhaseTiming(%r, seconds=%.3f, count=%d)" %(self.name, self.seconds, self.count)
+
+
+class TimingReport(object):
+    """
+    The timings of one update operation (`operation` is e.g. ``'install_update'``).
+
+    Attributes:
+
+        - `phases`: an ordered dictionary of :py:class:`PhaseTiming` instances, by phase
+          name, in the order in which the phases were first entered;
+        - `total`: the total duration of the operation in seconds (`None` while it is
+          still running);
+        - `error`: a description of the error which made the operation fail, or `None`.
+
+    Phases may be nested (e.g. connecting happens while downloading), and may be timed in
+    several threads at once (e.g. parallel connections of a segmented download), in which
+    case their time adds up. Phases which don't apply are absent from the report.
+    """
+    def __init__(self, operation):
+        self.operation = operation
+        self.phases = collections.OrderedDict()
+        self.total = None
+        self.error = None
+        self._start_time = time.time()
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, count=1):
+        """
+        Account for `seconds` spent in the phase `name`, over `count` times (e.g. a loop
+        may time its iterations itself and report them all at once).
+        """
+        with self._lock:
+            p = self._phase_timing(name)
+            p.seconds += seconds
+            p.count += count
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Context manager which times the code it runs in the phase `name`.
+        """
+        with self._lock:
+            # so that the phases are listed in the order in which they started
+            self._phase_timing(name)
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - t0)
+
+    def _phase_timing(self, name):
+        p = self.phases.get(name)
+        if p is None:
+            p = PhaseTiming(name)
+            self.phases[name] = p
+        return p
+
+    def seconds(self, name):
+        """
+        Return the time spent in the phase `name`, or 0 if it was not entered.
+        """
+        with self._lock:
+            p = self.phases.get(name)
+            return (p.seconds if p is not None else 0.0)
+
+    def finish(self, error=None):
+        """
+        The operation is complete; `error` is a description of the error if it failed.
+        """
+        self.total = time.time() - self._start_time
+        if error is not None:
+            self.error = error
+
+    def to_dict(self):
+        """
+        Return the report as a dictionary which can be serialized to JSON.
+        """
+        with self._lock:
+            return {
+                'operation': self.operation,
+                'total': self.total,
+                'error': self.error,
+                'phases': [ {'name': p.name, 'seconds': p.seconds, 'count': p.count}
+                            for p in self.phases.itervalues() ],
+                }
+
+    def __str__(self):
+        with self._lock:
+            s = "%s: %s" %(self.operation, ("%.2f s" %(self.total) if self.total is not None
+                                            else "running"))
+            if self.error:
+                s += " (failed: %s)" %(self.error)
+            if self.phases:
+                s += "; " + ", ".join([ "%s %.2f s" %(p.name, p.seconds) + (" (x%d)" %(p.count)
+                                                                            if p.count > 1 else "")
+                                        for p in self.phases.itervalues() ])
+            return s
+
+
+
+_current = threading.local()
+
+
+def current_report():
+    """
+    Return the :py:class:`TimingReport` which is current in this thread, or `None`.
+    """
+    return getattr(_current, 'report', None)
+
+
+@contextlib.contextmanager
+def reporting(report):
+    """
+    Context manager which makes `report` (which may be `None`) the current report of this
+    thread while the code it runs is executed.
+    """
+    previous = current_report()
+    _current.report = report
+    try:
+        yield report
+    finally:
+        _current.report = previous
+
+
+@contextlib.contextmanager
+def phase(name):
+    """
+    Context manager which times the code it runs in the phase `name` of the current report
+    of this thread, if there is one.
+    """
+    report = current_report()
+    if report is None:
+        yield
+        return
+    with report.phase(name):
+        yield
@@ -42,6 +42,9 @@ import logging
 import inspect
 import urllib
 import datetime
+import hashlib
+import json
+import shutil
 
 logger = logging.getLogger('updater4pyi')
 
@@ -58,6 +61,15 @@ def ignore_exc(f, exc=(Exception,), value_if_exc=None):
         return value_if_exc
 
 
+def utf8_str(x):
+    """
+    Return `x` as a byte string, encoding it in UTF-8 if it is a unicode string.
+    """
+    if isinstance(x, unicode):
+        return x.encode('utf-8')
+    return x
+
+
 # -------------------------------------
 
 
@@ -205,6 +217,146 @@ def applescript_quote(x):
     return '"' + re.sub(r'([\\"])', r'\\\1', x) + '"'
 
 
+# ------------------------------------------------------------------------
+
+# file digests
+
+
+def digest_hasher(digest):
+    """
+    Parse a digest specification of the form ``'<algorithm>:<hexdigest>'``, for example
+    ``'sha256:9f86d081884c...'`` (this is the format used by the github API).
+
+    Returns a tuple `(hasher, hexdigest)` where `hasher` is a new, empty `hashlib` hash
+    object for the given algorithm and `hexdigest` is the expected hex digest in lower
+    case. Raises a :py:exc:`ValueError` if the digest specification can't be parsed or if
+    the algorithm is not supported.
+    """
+    m = re.match(r'^\s*(?P<algo>[a-zA-Z0-9_-]+)\s*[:=]\s*(?P<hex>[0-9a-fA-F]+)\s*$', digest)
+    if m is None:
+        raise ValueError("Can't parse digest: %r" %(digest))
+    algo = m.group('algo').lower().replace('-', '')
+    try:
+        hasher = hashlib.new(algo)
+    except ValueError:
+        raise ValueError("Unsupported digest algorithm: %s" %(m.group('algo')))
+    return (hasher, m.group('hex').lower())
+
+
+
+# ------------------------------------------------------------------------
+
+# incremental reading of JSON arrays
+
+
+JSON_STREAM_CHUNK_SIZE = 16384
+"""
+The number of bytes :py:func:`iter_json_array` reads at once.
+"""
+
+
+class NotAJsonArray(ValueError):
+    """
+    Raised by :py:func:`iter_json_array` if the JSON document is valid, but isn't an
+    array. The document is available as the `value` attribute.
+    """
+    def __init__(self, value):
+        super(NotAJsonArray, self).__init__("JSON document is not an array")
+        self.value = value
+
+
+def iter_json_array(f, chunk_size=JSON_STREAM_CHUNK_SIZE, raw_decode=None):
+    """
+    Parse a JSON array from the file-like object `f` incrementally, yielding its
+    elements one by one as soon as they have been read. The caller may stop iterating at
+    any point, in which case the rest of the document isn't read.
+
+    Only the element being parsed is kept in memory (along with a chunk of data). The
+    elements are decoded with `raw_decode(s, idx)`, by default the method of a
+    `json.JSONDecoder`.
+
+    Raises :py:exc:`ValueError` if the data is not valid JSON, or
+    :py:exc:`NotAJsonArray` if it is some other JSON value.
+    """
+    return _JsonArrayReader(f, chunk_size, raw_decode or _json_decoder.raw_decode).elements()
+
+
+_json_decoder = json.JSONDecoder()
+
+_JSON_WHITESPACE = ' \t\n\r'
+_JSON_VALUE_END = ',]' + _JSON_WHITESPACE
+
+class _JsonArrayReader(object):
+    # An element which isn't complete yet fails to decode, in which case we read more
+    # data and try again. We read as much data as we have buffered, so that decoding
+    # a large element takes a number of attempts logarithmic in its size.
+
+    def __init__(self, f, chunk_size, raw_decode):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.raw_decode = raw_decode
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        # read more data. Returns False at the end of the data.
+        if self.eof:
+            return False
+        data = self.f.read(max(self.chunk_size, len(self.buf) - self.pos))
+        if not data:
+            self.eof = True
+            return False
+        # forget what we've already consumed
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def _next_char(self):
+        # skip whitespace, and return the next character (or None at the end of the data)
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _JSON_WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return None
+
+    def elements(self):
+        c = self._next_char()
+        if c != '[':
+            # not an array. Parse it anyway for the error message
+            data = self.buf[self.pos:] + self.f.read()
+            raise NotAJsonArray(json.loads(data))
+        self.pos += 1
+
+        if self._next_char() == ']':
+            return
+        while True:
+            if self._next_char() is None:
+                raise ValueError("Unexpected end of JSON data")
+            try:
+                (value, end) = self.raw_decode(self.buf, self.pos)
+                # a number might continue in the next chunk
+                complete = (self.eof or (end < len(self.buf) and self.buf[end] in _JSON_VALUE_END))
+            except ValueError:
+                if self.eof:
+                    raise
+                complete = False
+            if not complete:
+                self._fill()
+                continue
+            yield value
+            self.pos = end
+            c = self._next_char()
+            if c == ']':
+                return
+            if c != ',':
+                raise ValueError("Expected ',' or ']' in JSON array, got %r" %(c))
+            self.pos += 1
+
+
+
 # ------------------------------------------------------------------------
 
 # utility to get resource files bundled with pyinstaller
@@ -227,6 +379,45 @@ def resource_path(relative_path):
 # ------------
 
 
+def user_cache_dir(appname):
+    """
+    Return the directory in which the application `appname` should store its cached
+    files, following the conventions of the current platform. The directory is not
+    created.
+    """
+    if is_macosx():
+        return os.path.join(os.path.expanduser('~/Library/Caches'), appname)
+    if is_win():
+        base = os.environ.get('LOCALAPPDATA', None) or os.environ.get('APPDATA', None)
+        if not base:
+            base = os.path.expanduser('~')
+        return os.path.join(base, appname, 'Cache')
+    base = os.environ.get('XDG_CACHE_HOME', None)
+    if not base:
+        base = os.path.expanduser('~/.cache')
+    return os.path.join(base, appname)
+
+
+# ------------
+
+
+def link_or_copy(src, dst):
+    """
+    Create a hard link `dst` pointing to the file `src` if possible (e.g. if both are on
+    the same filesystem), otherwise copy the file.
+    """
+    if hasattr(os, 'link'):
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+
+
+# ------------
+
+
 def path2url(p):
 
     x = p;
@@ -436,21 +627,150 @@ def run_win(argv, needs_sudo=False, wait=True, cwd=None):
 _component_re = re.compile(r'(\d+ | [a-z]+ | \.| -)', re.VERBOSE)
 _replace = {'pre':'c', 'preview':'c','-':'final-','rc':'c','dev':'@'}.get
 
-def _parse_version_parts(s):
-    for part in _component_re.split(s):
+PARSE_VERSION_CACHE_SIZE = 4096
+"""
+The maximum number of parsed versions which :py:func:`parse_version` remembers.
+"""
+
+_TAG_END = -257
+
+_tag_codes = {}
+
+def _version_tag_codes(tag):
+    # Encode an alphanumeric version part as a tuple of negative integers, one for each
+    # character and a final _TAG_END, such that the codes compare like the tags
+    # themselves (a tag sorts before the longer tags it is a prefix of) and are below
+    # any numeric part.
+    try:
+        return _tag_codes[tag]
+    except KeyError:
+        pass
+    codes = tuple([ ord(c) - 256 for c in tag ]) + (_TAG_END,)
+    if len(_tag_codes) < PARSE_VERSION_CACHE_SIZE:
+        _tag_codes[tag] = codes
+    return codes
+
+_TAG_FINAL = _version_tag_codes('final')
+_TAG_FINAL_DASH = _version_tag_codes('final-')
+
+def _version_key(s):
+    # numeric parts are ints, alphanumeric parts tuples of codes, flattened at the end
+    parts = []
+    for part in _component_re.split(utf8_str(s).lower()):
         part = _replace(part,part)
         if not part or part=='.':
             continue
         if part[:1] in '0123456789':
-            yield part.zfill(8)    # pad for numeric comparison
+            parts.append(int(part))
+            continue
+        if part<'final':   # remove '-' before a prerelease tag
+            while parts and parts[-1]==_TAG_FINAL_DASH: parts.pop()
+        # remove trailing zeros from each series of numeric parts
+        while parts and parts[-1]==0:
+            parts.pop()
+        parts.append(_version_tag_codes(part))
+
+    # ensure that alpha/beta/candidate are before final
+    while parts and parts[-1]==0:
+        parts.pop()
+    parts.append(_TAG_FINAL)
+
+    key = []
+    for part in parts:
+        if isinstance(part, tuple):
+            key.extend(part)
         else:
-            yield '*'+part
+            key.append(part)
+    return tuple(key)
+
+
+class Version(object):
+    """
+    A parsed version number, as returned by :py:func:`parse_version`. Versions are
+    hashable and compare chronologically. They may also be ordered against version
+    strings, but they are only ever equal to other `Version` objects.
+
+    The version is stored as a tuple of integers: numeric parts are stored as they are,
+    and alphanumeric parts (such as 'beta') are encoded as sequences of negative integers
+    which sort in alphabetical order. Use :py:func:`parse_version` rather than instantiating this
+    class directly, as it remembers the versions it has already parsed.
+    """
+
+    __slots__ = ('_key', '_string')
+
+    def __init__(self, s):
+        self._string = s
+        self._key = _version_key(s)
 
-    yield '*final'  # ensure that alpha/beta/candidate are before final
+    def _other_key(self, other):
+        if isinstance(other, basestring):
+            return parse_version(other)._key
+        return None
+
+    def __eq__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key == other._key
+
+    def __ne__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self._key != other._key
+
+    def __lt__(self, other):
+        try:
+            return self._key < other._key
+        except AttributeError:
+            k = self._other_key(other)
+            if k is None:
+                return NotImplemented
+            return self._key < k
+
+    def __le__(self, other):
+        try:
+            return self._key <= other._key
+        except AttributeError:
+            k = self._other_key(other)
+            if k is None:
+                return NotImplemented
+            return self._key <= k
+
+    def __gt__(self, other):
+        try:
+            return self._key > other._key
+        except AttributeError:
+            k = self._other_key(other)
+            if k is None:
+                return NotImplemented
+            return self._key > k
+
+    def __ge__(self, other):
+        try:
+            return self._key >= other._key
+        except AttributeError:
+            k = self._other_key(other)
+            if k is None:
+                return NotImplemented
+            return self._key >= k
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __reduce__(self):
+        return (parse_version, (self._string,))
+
+    def __str__(self):
+        return utf8_str(self._string)
+
+    def __repr__(self):
+        return 'Version(%r)' %(self._string)
+
+
+_version_cache = {}
 
 def parse_version(s):
     """
-    Convert a version string to a chronologically-sortable key
+    Convert a version string to a chronologically-sortable :py:class:`Version`.
 
     This function is based on code from `setuptools
     <https://bitbucket.org/pypa/setuptools/src/353a4270074435faa7daa2aa0ee480e22e505f53/pkg_resources.py?at=default>`_.
@@ -464,12 +784,10 @@ def parse_version(s):
     *possible* to create pathological version coding schemes that will fool
     this parser, but they should be very rare in practice.
 
-    The returned value will be a tuple of strings.  Numeric portions of the
-    version are padded to 8 digits so they will compare numerically, but
-    without relying on how numbers compare relative to strings.  Dots are
-    dropped, but dashes are retained.  Trailing zeros between alpha segments
-    or dashes are suppressed, so that e.g. "2.4.0" is considered the same as
-    "2.4". Alphanumeric parts are lower-cased.
+    Numeric portions of the version compare numerically.  Dots are dropped, but
+    dashes are retained.  Trailing zeros between alpha segments or dashes are
+    suppressed, so that e.g. "2.4.0" is considered the same as "2.4".
+    Alphanumeric parts are lower-cased.
 
     The algorithm assumes that strings like "-" and any alpha string that
     alphabetically follows "final"  represents a "patch level".  So, "2.4-1"
@@ -485,17 +803,22 @@ def parse_version(s):
     candidates, and therefore are not as new as a version string that does not
     contain them, and "dev" is replaced with an '@' so that it sorts lower than
     than any other pre-release tag.
+
+    The parsed versions are remembered (up to :py:data:`PARSE_VERSION_CACHE_SIZE` of
+    them), so that parsing the same version again, e.g. when sorting releases, is cheap.
+    If `s` is already a :py:class:`Version`, it is returned as is.
     """
-    parts = []
-    for part in _parse_version_parts(s.lower()):
-        if part.startswith('*'):
-            if part<'*final':   # remove '-' before a prerelease tag
-                while parts and parts[-1]=='*final-': parts.pop()
-            # remove trailing zeros from each series of numeric parts
-            while parts and parts[-1]=='00000000':
-                parts.pop()
-        parts.append(part)
-    return tuple(parts)
+    if isinstance(s, Version):
+        return s
+    try:
+        return _version_cache[s]
+    except KeyError:
+        pass
+    v = Version(s)
+    if len(_version_cache) >= PARSE_VERSION_CACHE_SIZE:
+        _version_cache.clear()
+    _version_cache[s] = v
+    return v
 
 
 